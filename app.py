@@ -1,15 +1,50 @@
 import os
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
+import asyncio
+import base64
+import bisect
+import contextvars
+import csv
+import gzip
+import hashlib
+import heapq
+import io
+import itertools
 import json
+from urllib.parse import parse_qs
+import re
 import uuid
 import random
-import string
-from flask import Flask, render_template, request, jsonify, redirect, url_for
-from datetime import datetime
+import secrets
+import tempfile
+import threading
+import time
+import timeit
+import unicodedata
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait, FIRST_COMPLETED, TimeoutError as FuturesTimeoutError, CancelledError
+import click
+from flask import Flask, Response, render_template, request, jsonify, redirect, url_for, stream_with_context
+from datetime import datetime, timedelta, timezone
+from email.utils import parsedate_to_datetime
+from functools import wraps
 from dotenv import load_dotenv
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import create_engine, event, tuple_
+from sqlalchemy.exc import IntegrityError, OperationalError
+from sqlalchemy.orm import Session
 from flask_mail import Mail, Message
 
+# Dependencias opcionales del cliente asíncrono y del punto de entrada ASGI
+try:
+    import aiohttp
+    from asgiref.wsgi import WsgiToAsgi
+except ImportError:
+    aiohttp = None
+    WsgiToAsgi = None
+
 # Cargar variables de entorno
 load_dotenv()
 
@@ -20,6 +55,46 @@ app.config['SECRET_KEY'] = os.getenv('SECRET_KEY', 'dev_key_12345')
 app.config['SQLALCHEMY_DATABASE_URI'] = os.getenv('DATABASE_URL', 'sqlite:///bookings.db')
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 
+# Ajustes de SQLite para escrituras concurrentes (reservas y registro de correos)
+DB_SQLITE_JOURNAL_MODE = os.getenv('DB_SQLITE_JOURNAL_MODE', 'WAL')
+DB_SQLITE_SYNCHRONOUS = os.getenv('DB_SQLITE_SYNCHRONOUS', 'NORMAL')
+DB_BUSY_TIMEOUT = float(os.getenv('DB_BUSY_TIMEOUT', '15'))  # segundos esperando a que se libere un bloqueo
+
+def is_sqlite_memory(uri):
+    return uri.startswith('sqlite') and (uri in ('sqlite://', 'sqlite:///') or ':memory:' in uri or 'mode=memory' in uri)
+
+def database_engine_options(uri, busy_timeout=DB_BUSY_TIMEOUT):
+    """Opciones del engine de SQLAlchemy: pool de conexiones, pre-ping y timeout de bloqueo de SQLite"""
+    options = {
+        'pool_pre_ping': os.getenv('DB_POOL_PRE_PING', 'true').lower() == 'true',
+        'pool_recycle': int(os.getenv('DB_POOL_RECYCLE', '1800')),
+    }
+    if uri.startswith('sqlite'):
+        options['connect_args'] = {'timeout': busy_timeout}
+    # Las bases de datos SQLite en memoria usan una única conexión compartida (sin pool configurable)
+    if not is_sqlite_memory(uri):
+        options['pool_size'] = int(os.getenv('DB_POOL_SIZE', '10'))
+        options['max_overflow'] = int(os.getenv('DB_MAX_OVERFLOW', '10'))
+        options['pool_timeout'] = float(os.getenv('DB_POOL_TIMEOUT', '30'))
+    return options
+
+def sqlite_pragmas(journal_mode=DB_SQLITE_JOURNAL_MODE, synchronous=DB_SQLITE_SYNCHRONOUS, busy_timeout=DB_BUSY_TIMEOUT):
+    """Devuelve un listener 'connect' que aplica los PRAGMA de SQLite a cada conexión nueva.
+    WAL permite leer mientras otra conexión escribe y synchronous=NORMAL evita un fsync por commit."""
+    def apply_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        try:
+            if journal_mode:
+                cursor.execute(f"PRAGMA journal_mode={journal_mode}")
+            if synchronous:
+                cursor.execute(f"PRAGMA synchronous={synchronous}")
+            cursor.execute(f"PRAGMA busy_timeout={int(busy_timeout * 1000)}")
+        finally:
+            cursor.close()
+    return apply_pragmas
+
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = database_engine_options(app.config['SQLALCHEMY_DATABASE_URI'])
+
 # Configuración de Flask-Mail
 app.config['MAIL_SERVER'] = os.getenv('EMAIL_HOST', 'smtp.gmail.com')
 app.config['MAIL_PORT'] = 465  # Puerto para SSL
@@ -37,6 +112,8 @@ db = SQLAlchemy(app)
 
 # Asegurarse de que las tablas existan en la base de datos
 with app.app_context():
+    if db.engine.dialect.name == 'sqlite':
+        event.listen(db.engine, 'connect', sqlite_pragmas())
     db.create_all()
 
 # Modelo para las reservas
@@ -44,6 +121,9 @@ class Booking(db.Model):
     id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
     pnr = db.Column(db.String(6), unique=True, nullable=False)  # Código PNR de 6 caracteres
     flight_id = db.Column(db.String(100), nullable=False)
+    # Origen y destino (IATA) extraídos de flight_id para filtrar por ruta con un índice
+    origin = db.Column(db.String(3), nullable=True)
+    destination = db.Column(db.String(3), nullable=True)
     fare_type = db.Column(db.String(20), nullable=False)
     fare_price = db.Column(db.Float, nullable=False)
     currency = db.Column(db.String(3), nullable=False)
@@ -57,12 +137,55 @@ class Booking(db.Model):
     infants = db.Column(db.Integer, default=0)
     passenger_data = db.Column(db.Text, nullable=False)  # JSON string con datos de pasajeros
     amadeus_booking_id = db.Column(db.String(100), nullable=True)  # ID de reserva en Amadeus (si se integra)
-    status = db.Column(db.String(20), default='CONFIRMED')  # CONFIRMED, CANCELLED, etc.
+    status = db.Column(db.String(20), default='CONFIRMED')  # PENDING, CONFIRMED, FAILED, NEEDS_REVIEW, CANCELLED, etc.
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    passengers = db.relationship('Passenger', backref='booking', order_by='Passenger.position', cascade='all, delete-orphan')
+    
+    # Índices compuestos para el listado paginado por cursor (created_at, id), con y sin filtros.
+    # También sirven para consultar solo por su primera columna (estado, email, fecha o ruta).
+    __table_args__ = (
+        db.Index('ix_booking_created_at_id', 'created_at', 'id'),
+        db.Index('ix_booking_status_created_at_id', 'status', 'created_at', 'id'),
+        db.Index('ix_booking_contact_email_created_at_id', 'contact_email', 'created_at', 'id'),
+        db.Index('ix_booking_origin_destination_created_at_id', 'origin', 'destination', 'created_at', 'id'),
+        db.Index('ix_booking_origin_created_at_id', 'origin', 'created_at', 'id'),
+        db.Index('ix_booking_destination_created_at_id', 'destination', 'created_at', 'id'),
+    )
+    
+    @db.validates('flight_id')
+    def set_route(self, key, flight_id):
+        self.origin, self.destination = route_from_flight_id(flight_id)
+        return flight_id
     
     def __repr__(self):
         return f'<Booking {self.id}>'
 
+# Origen y destino de un flight_id con formato ORIGEN-DESTINO-VUELO (ej. MEX-CUN-AM500), o (None, None)
+def route_from_flight_id(flight_id):
+    parts = (flight_id or '').split('-')
+    if len(parts) >= 3 and len(parts[0]) == 3 and len(parts[1]) == 3:
+        return parts[0].upper(), parts[1].upper()
+    return None, None
+
+# Modelo para los pasajeros de cada reserva
+class Passenger(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    booking_id = db.Column(db.String(36), db.ForeignKey('booking.id'), nullable=False, index=True)
+    position = db.Column(db.Integer, nullable=False, default=0)  # Orden del pasajero dentro de la reserva
+    passenger_type = db.Column(db.String(3), nullable=False, index=True)  # ADT, CHD, INF
+    first_name = db.Column(db.String(100), nullable=False, default='')
+    last_name = db.Column(db.String(100), nullable=False, default='')
+    age = db.Column(db.Integer, nullable=True)  # Solo niños e infantes
+    
+    # Índice único en lugar de UniqueConstraint para que ensure_indexes() lo cree también en tablas existentes
+    __table_args__ = (
+        db.Index('ix_passenger_name', 'last_name', 'first_name'),
+        db.Index('uq_passenger_booking_position', 'booking_id', 'position', unique=True),
+    )
+    
+    def __repr__(self):
+        return f'<Passenger {self.id} - {self.first_name} {self.last_name}>'
+
 # Modelo para registrar los correos enviados
 class EmailLog(db.Model):
     id = db.Column(db.Integer, primary_key=True)
@@ -70,229 +193,2066 @@ class EmailLog(db.Model):
     recipient = db.Column(db.String(100), nullable=False)  # Destinatario del correo
     subject = db.Column(db.String(200), nullable=False)  # Asunto del correo
     body = db.Column(db.Text, nullable=False)  # Contenido HTML del correo
-    sent_at = db.Column(db.DateTime, default=datetime.now)  # Fecha y hora de envío
+    sent_at = db.Column(db.DateTime, default=datetime.now, index=True)  # Fecha y hora de envío
     environment = db.Column(db.String(20), nullable=False)  # Entorno (development, testing, production)
     
     def __repr__(self):
         return f'<EmailLog {self.id} - PNR: {self.pnr}>'
 
-# Función para generar un PNR único (6 caracteres alfanuméricos)
-def generate_pnr():
-    # Caracteres permitidos en un PNR (solo letras mayúsculas y números, excluyendo caracteres confusos)
-    chars = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'  # Excluimos I, O, 0, 1 para evitar confusiones
-    while True:
-        # Generar un PNR de 6 caracteres
-        pnr = ''.join(random.choice(chars) for _ in range(6))
-        # Verificar que no exista ya en la base de datos
-        if not Booking.query.filter_by(pnr=pnr).first():
-            return pnr
+# Modelo para las claves de idempotencia (cabecera Idempotency-Key) y la respuesta que produjeron
+class IdempotencyKey(db.Model):
+    key = db.Column(db.String(255), primary_key=True)
+    request_hash = db.Column(db.String(64), nullable=False)  # Huella de la ruta y los datos enviados
+    status = db.Column(db.String(20), nullable=False, default='IN_PROGRESS')  # IN_PROGRESS, COMPLETED
+    response_status = db.Column(db.Integer, nullable=True)
+    response_body = db.Column(db.Text, nullable=True)
+    response_mimetype = db.Column(db.String(100), nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<IdempotencyKey {self.key} - {self.status}>'
+
+# Modelo para la cola persistente de reservas asíncronas (una tarea por reserva pendiente)
+class BookingJob(db.Model):
+    id = db.Column(db.Integer, primary_key=True)
+    booking_id = db.Column(db.String(36), db.ForeignKey('booking.id'), nullable=False, index=True)
+    status = db.Column(db.String(20), nullable=False, default='QUEUED')  # QUEUED, RUNNING, DONE, FAILED, NEEDS_REVIEW
+    payload = db.Column(db.Text, nullable=False)  # JSON con la oferta, los pasajeros y el contacto
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    max_attempts = db.Column(db.Integer, nullable=False, default=3)
+    run_after = db.Column(db.DateTime, nullable=False, default=datetime.utcnow)  # No se procesa antes de esta fecha
+    locked_by = db.Column(db.String(100), nullable=True)  # Trabajador que la está procesando
+    locked_at = db.Column(db.DateTime, nullable=True)
+    last_error = db.Column(db.Text, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    booking = db.relationship('Booking', backref=db.backref('jobs', cascade='all, delete-orphan'))
+    
+    __table_args__ = (db.Index('ix_booking_job_status_run_after', 'status', 'run_after'),)
+    
+    def __repr__(self):
+        return f'<BookingJob {self.id} - {self.status}>'
 
-# Configuración de la URL de la API de Amadeus
-BASE_URL = "https://test.api.amadeus.com/v2"
+# Grupos de pasajeros del formulario de reserva y su tipo estándar
+PASSENGER_GROUPS = (('adults', 'ADT'), ('children', 'CHD'), ('infants', 'INF'))
+# Tipos de pasajero en otros formatos guardados por versiones anteriores
+PASSENGER_TYPE_ALIASES = {'ADULT': 'ADT', 'CHILD': 'CHD', 'INFANT': 'INF', 'HELD_INFANT': 'INF'}
 
-# Función para obtener un token de acceso
-def get_access_token():
-    auth_url = "https://test.api.amadeus.com/v1/security/oauth2/token"
-    headers = {
-        "Content-Type": "application/x-www-form-urlencoded"
-    }
+def parse_passenger_age(value):
+    try:
+        return int(value) if value not in (None, '') else None
+    except (TypeError, ValueError):
+        return None
+
+def build_passengers(passenger_data):
+    """Convierte los datos de pasajeros ({'adults': [...], 'children': [...], 'infants': [...]}
+    o la lista plana de versiones anteriores) en filas de Passenger"""
+    if isinstance(passenger_data, dict):
+        items = [(passenger, passenger_type) for group, passenger_type in PASSENGER_GROUPS
+                 for passenger in passenger_data.get(group) or [] if isinstance(passenger, dict)]
+    elif isinstance(passenger_data, list):
+        items = [(passenger, str(passenger.get('type') or 'ADT').upper())
+                 for passenger in passenger_data if isinstance(passenger, dict)]
+    else:
+        items = []
+    return [
+        Passenger(
+            position=position,
+            passenger_type=PASSENGER_TYPE_ALIASES.get(passenger_type, passenger_type),
+            first_name=passenger.get('firstName') or '',
+            last_name=passenger.get('lastName') or '',
+            age=parse_passenger_age(passenger.get('age'))
+        )
+        for position, (passenger, passenger_type) in enumerate(items)
+    ]
+
+def serialize_passenger(passenger):
     data = {
-        "grant_type": "client_credentials",
-        "client_id": os.getenv("AMADEUS_API_KEY"),
-        "client_secret": os.getenv("AMADEUS_API_SECRET")
+        'firstName': passenger.first_name,
+        'lastName': passenger.last_name,
+        'type': passenger.passenger_type
+    }
+    if passenger.age is not None:
+        data['age'] = passenger.age
+    return data
+
+def booking_passengers(booking):
+    """Lista de pasajeros de la reserva en el formato de las respuestas y correos. Las reservas
+    antiguas que aún no se migraron (flask --app app migrate-passengers) se leen del JSON."""
+    passengers = booking.passengers
+    if not passengers and booking.passenger_data:
+        try:
+            passengers = build_passengers(json.loads(booking.passenger_data))
+        except ValueError:
+            passengers = []
+    return [serialize_passenger(passenger) for passenger in passengers]
+
+def get_booking_by_pnr(pnr):
+    """Carga la reserva y sus pasajeros en una sola consulta (JOIN)"""
+    return Booking.query.options(db.joinedload(Booking.passengers)).filter_by(pnr=pnr).first()
+
+def booking_view(booking):
+    """Vista serializada de la reserva que comparten /find_booking, /api/find_booking y /send_booking_email"""
+    flight_segments = booking.flight_id.split('-')
+    return {
+        'booking_id': booking.id,
+        'pnr': booking.pnr,
+        'flight_id': booking.flight_id,
+        'origin': flight_segments[0] if len(flight_segments) > 0 else '',
+        'destination': flight_segments[1] if len(flight_segments) > 1 else '',
+        'fare_type': booking.fare_type,
+        'fare_price': booking.fare_price,
+        'currency': booking.currency,
+        'service_fee': booking.service_fee,
+        'service_fee_currency': booking.service_fee_currency,
+        'total_price': booking.total_price,
+        'contact_email': booking.contact_email,
+        'contact_phone': booking.contact_phone,
+        'status': booking.status,
+        'created_at': booking.created_at.strftime("%Y-%m-%d %H:%M:%S") if booking.created_at else "",
+        'passengers': booking_passengers(booking)
     }
+
+# Caché LRU de vistas de reservas por PNR (consultas repetidas del bot de WhatsApp)
+class BookingViewCache:
+    """Caché de lectura de vistas de reservas. Las entradas se invalidan al guardar cambios en la
+    reserva (ver invalidate_changed_bookings) y caducan tras `ttl` segundos por si la base de datos
+    se modifica desde otro proceso. Las vistas almacenadas se comparten y son de solo lectura."""
+
+    def __init__(self, max_entries=5000, ttl=300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        # pnr -> (instante de almacenamiento, vista)
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Se incrementa con cada invalidación; una carga iniciada antes no guarda su resultado
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def get(self, pnr, loader):
+        """Devuelve la vista de la reserva desde la caché o, si no está, la carga con `loader(pnr)`"""
+        with self._lock:
+            entry = self._entries.get(pnr)
+            if entry is not None and time.time() - entry[0] <= self.ttl:
+                self._entries.move_to_end(pnr)
+                self.hits += 1
+                return entry[1]
+            self.misses += 1
+            generation = self._generation
+        view = loader(pnr)
+        if view is None:
+            return None
+        with self._lock:
+            if generation == self._generation:
+                self._entries[pnr] = (time.time(), view)
+                self._entries.move_to_end(pnr)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return view
+
+    def invalidate(self, *pnrs):
+        with self._lock:
+            self._generation += 1
+            for pnr in pnrs:
+                if self._entries.pop(pnr, None) is not None:
+                    self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+                'ttl_seconds': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0,
+                'invalidations': self.invalidations
+            }
+
+booking_cache = BookingViewCache(
+    max_entries=int(os.getenv('BOOKING_CACHE_MAX_ENTRIES', '5000')),
+    ttl=int(os.getenv('BOOKING_CACHE_TTL', '300'))
+)
+
+def load_booking_view(pnr):
+    booking = get_booking_by_pnr(pnr)
+    return booking_view(booking) if booking else None
+
+def get_booking_view(pnr):
+    """Vista de la reserva por PNR (lectura a través de la caché) o None si no existe"""
+    return booking_cache.get(pnr, load_booking_view)
+
+# Invalidación de la caché: se anotan los PNR de las reservas creadas, modificadas o eliminadas
+# en cada flush y se invalidan cuando la transacción se confirma
+def collect_changed_bookings(session, flush_context, instances):
+    changed = session.info.setdefault('changed_pnrs', set())
+    for obj in itertools.chain(session.new, session.dirty, session.deleted):
+        if isinstance(obj, Booking) and obj.pnr:
+            changed.add(obj.pnr)
+
+def invalidate_changed_bookings(session):
+    changed = session.info.pop('changed_pnrs', None)
+    if changed:
+        booking_cache.invalidate(*changed)
+
+def discard_changed_bookings(session):
+    session.info.pop('changed_pnrs', None)
+
+event.listen(db.session, 'before_flush', collect_changed_bookings)
+event.listen(db.session, 'after_commit', invalidate_changed_bookings)
+event.listen(db.session, 'after_soft_rollback', lambda session, previous_transaction: discard_changed_bookings(session))
+
+def migrate_passenger_data(batch_size=500):
+    """Crea las filas de Passenger de las reservas guardadas antes de existir la tabla,
+    a partir del JSON de passenger_data. Devuelve el número de reservas migradas.
+    Si otro proceso migra las mismas reservas a la vez, el índice único (booking_id, position)
+    rechaza el lote duplicado y se continúa con el siguiente."""
+    migrated = 0
+    last_id = ''
+    while True:
+        bookings = (Booking.query
+                    .filter(Booking.id > last_id, ~Booking.passengers.any())
+                    .order_by(Booking.id)
+                    .limit(batch_size)
+                    .all())
+        if not bookings:
+            return migrated
+        for booking in bookings:
+            try:
+                passenger_data = json.loads(booking.passenger_data or '[]')
+            except ValueError as e:
+                print(f"No se pudieron migrar los pasajeros de la reserva {booking.pnr}: {str(e)}")
+                continue
+            passengers = build_passengers(passenger_data)
+            for passenger in passengers:
+                passenger.booking_id = booking.id
+            db.session.add_all(passengers)
+            migrated += 1 if passengers else 0
+        last_id = bookings[-1].id
+        try:
+            db.session.commit()
+        except IntegrityError:
+            db.session.rollback()
+            print(f"Otro proceso ya migró los pasajeros de algunas reservas hasta {last_id}, se omite el lote")
+
+# Caracteres permitidos en un PNR (solo letras mayúsculas y números, excluyendo caracteres confusos)
+PNR_ALPHABET = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'  # Excluimos I, O, 0, 1 para evitar confusiones
+PNR_LENGTH = 6
+# Intentos de inserción si el PNR generado ya existe en la base de datos
+PNR_MAX_ATTEMPTS = int(os.getenv('PNR_MAX_ATTEMPTS', '5'))
+
+# Función para generar un PNR (6 caracteres alfanuméricos)
+def generate_pnr():
+    """Genera un PNR con una fuente aleatoria criptográfica. No consulta la base de datos:
+    la unicidad la garantiza el índice único de Booking.pnr al insertar (ver save_booking)"""
+    return ''.join(secrets.choice(PNR_ALPHABET) for _ in range(PNR_LENGTH))
+
+def is_pnr_conflict(error):
+    """Indica si un IntegrityError se debe al índice único del PNR"""
+    return 'pnr' in str(getattr(error, 'orig', error)).lower()
+
+def save_booking(booking, regenerate_pnr=True):
+    """Inserta la reserva con una sola escritura. Si el PNR choca con otra reserva
+    (por ejemplo, dos solicitudes simultáneas), genera otro y vuelve a intentarlo"""
+    for attempt in range(PNR_MAX_ATTEMPTS):
+        db.session.add(booking)
+        try:
+            db.session.commit()
+            return booking
+        except IntegrityError as e:
+            db.session.rollback()
+            if not regenerate_pnr or not is_pnr_conflict(e) or attempt == PNR_MAX_ATTEMPTS - 1:
+                raise
+            print(f"PNR {booking.pnr} duplicado, generando uno nuevo")
+            booking.pnr = generate_pnr()
+
+# Configuración de la URL de la API de Amadeus (puede apuntar a un servidor local de pruebas)
+AMADEUS_BASE_URL = os.getenv('AMADEUS_BASE_URL', 'https://test.api.amadeus.com').rstrip('/')
+
+# Gestor del token OAuth de Amadeus
+class AmadeusTokenManager:
+    """Reutiliza el token OAuth de Amadeus hasta poco antes de que expire.
+    Solo un hilo renueva el token a la vez; los demás esperan y reutilizan el resultado."""
+
+    def __init__(self, client, expiry_margin=60):
+        self.client = client
+        self.expiry_margin = expiry_margin
+        # (token, instante de expiración en time.monotonic()); se reemplaza de forma atómica
+        self._state = (None, 0.0)
+        self._lock = threading.Lock()
+
+    def _fetch_token(self):
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded"
+        }
+        data = {
+            "grant_type": "client_credentials",
+            "client_id": os.getenv("AMADEUS_API_KEY"),
+            "client_secret": os.getenv("AMADEUS_API_SECRET")
+        }
+        response = None
+        try:
+            response = self.client.request(
+                "POST", "/v1/security/oauth2/token", operation="token",
+                authenticated=False, headers=headers, data=data
+            )
+            response.raise_for_status()  # Raise an exception for bad status codes
+            payload = response.json()
+        except requests.exceptions.RequestException as e:
+            print(f"Error getting access token: {str(e)}")
+            if response is not None:
+                print(f"Response content: {response.text}")
+            raise Exception("Error al autenticar con la API de Amadeus") from e
+
+        # Amadeus devuelve la vigencia en segundos (normalmente 1799)
+        expires_in = int(payload.get("expires_in", 1799))
+        lifetime = expires_in - self.expiry_margin if expires_in > self.expiry_margin else expires_in / 2
+        self._state = (payload["access_token"], time.monotonic() + lifetime)
+        print(f"Nuevo token de Amadeus obtenido (válido por {expires_in}s)")
+
+    def cached_token(self):
+        """Token en caché si sigue vigente, o None (sin bloquear ni solicitar uno nuevo)"""
+        token, expires_at = self._state
+        if token and time.monotonic() < expires_at:
+            return token
+        return None
+
+    def get_token(self):
+        token = self.cached_token()
+        if token:
+            return token
+
+        with self._lock:
+            # Otro hilo pudo haber renovado el token mientras esperábamos el lock
+            token, expires_at = self._state
+            if token and time.monotonic() < expires_at:
+                return token
+            self._fetch_token()
+            return self._state[0]
+
+    def invalidate(self, token=None):
+        """Descarta el token en caché. Si se indica `token`, solo se descarta si sigue siendo el actual,
+        para que varios hilos que reciben un 401 con el mismo token no provoquen renovaciones repetidas."""
+        with self._lock:
+            if token is None or self._state[0] == token:
+                self._state = (None, 0.0)
+
+
+# Clases de prioridad para la cuota de Amadeus, de mayor a menor
+AMADEUS_PRIORITIES = ('booking', 'search', 'autocomplete', 'warming')
+
+# Prioridad por defecto de cada operación (el token siempre va primero: todas las demás dependen de él)
+AMADEUS_OPERATION_PRIORITIES = {
+    'token': 'booking',
+    'flight_orders': 'booking',
+    'pricing': 'booking',
+    'flight_offers': 'search',
+    'locations': 'autocomplete',
+}
+
+# Prioridad explícita de las llamadas a Amadeus del contexto actual (hilo o tarea asyncio),
+# ej. el calentamiento de la caché usa 'warming' aunque llame a search_flights
+amadeus_priority = contextvars.ContextVar('amadeus_priority', default=None)
+
+# Instante límite (time.monotonic()) de la solicitud entrante en curso; las llamadas a Amadeus
+# solo usan el tiempo que queda hasta ese instante
+amadeus_deadline = contextvars.ContextVar('amadeus_deadline', default=None)
+
+# Error cuando se agota el tiempo límite de la solicitud entrante antes de llamar a Amadeus
+class DeadlineExceeded(TimeoutError):
+    pass
+
+# Tiempo límite agotado mientras se esperaba la respuesta de Amadeus (la solicitud ya se había enviado).
+# No indica que Amadeus esté caído: el timeout se recortó a lo que le quedaba a la solicitud entrante
+class ResponseDeadlineExceeded(DeadlineExceeded):
+    pass
+
+# Segundos que quedan del tiempo límite de la solicitud actual (None si no tiene límite)
+def deadline_remaining():
+    deadline = amadeus_deadline.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+# Lanza DeadlineExceeded si ya no queda tiempo; si no, devuelve los segundos restantes (o None)
+def check_deadline():
+    remaining = deadline_remaining()
+    if remaining is not None and remaining <= 0:
+        raise DeadlineExceeded("Se agotó el tiempo límite de la solicitud")
+    return remaining
+
+# Interpreta la cabecera Retry-After (segundos o fecha HTTP) y devuelve los segundos de espera
+def parse_retry_after(value):
+    if not value:
+        return None
     try:
-        response = requests.post(auth_url, headers=headers, data=data)
-        response.raise_for_status()  # Raise an exception for bad status codes
-        return response.json()["access_token"]
-    except requests.exceptions.RequestException as e:
-        print(f"Error getting access token: {str(e)}")
-        print(f"Response content: {response.text}")
-        raise Exception("Error al autenticar con la API de Amadeus") from e
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+# Error de una solicitud que agotó su espera en la cola del limitador (no es un fallo de Amadeus)
+class AmadeusQueueTimeout(TimeoutError):
+    pass
+
+# Limitador de solicitudes salientes hacia Amadeus
+class PriorityRateLimiter:
+    """Token bucket compartido por todo el proceso. Cuando no hay capacidad, las solicitudes esperan
+    en una cola ordenada por prioridad (AMADEUS_PRIORITIES) y, dentro de cada prioridad, por orden de
+    llegada. Cada solicitud espera como máximo el tiempo configurado para su clase; si Amadeus
+    responde 429, la cola se detiene durante el tiempo indicado en Retry-After."""
+
+    def __init__(self, rate, burst=None, max_waits=None):
+        self.rate = rate
+        self.burst = burst or rate
+        self.max_waits = max_waits or {}
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._queue = []
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+        self._stats = {
+            priority: {'requests': 0, 'queued': 0, 'timeouts': 0, 'hedge_skipped': 0, 'wait_seconds': 0.0, 'max_wait_seconds': 0.0}
+            for priority in AMADEUS_PRIORITIES
+        }
+        self.throttled = 0
+
+    def _refill(self, now):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def _try_take(self, entry):
+        """Con el lock tomado: consume un token si `entry` encabeza la cola y hay capacidad.
+        Devuelve 0 si lo consiguió o los segundos que conviene esperar antes de reintentar."""
+        now = time.monotonic()
+        self._refill(now)
+        if self._queue[0] is not entry:
+            return 0.05
+        if now < self._blocked_until:
+            return self._blocked_until - now
+        if self._tokens < 1:
+            return (1 - self._tokens) / self.rate
+        self._tokens -= 1
+        heapq.heappop(self._queue)
+        self._condition.notify_all()
+        return 0
+
+    def _enqueue(self, priority):
+        entry = (AMADEUS_PRIORITIES.index(priority), next(self._sequence))
+        heapq.heappush(self._queue, entry)
+        return entry
+
+    def _leave(self, entry):
+        self._queue.remove(entry)
+        heapq.heapify(self._queue)
+        self._condition.notify_all()
+
+    def _record(self, priority, waited, timed_out=False):
+        stats = self._stats[priority]
+        stats['requests'] += 1
+        if timed_out:
+            stats['timeouts'] += 1
+        if waited > 0:
+            stats['queued'] += 1
+            stats['wait_seconds'] += waited
+            stats['max_wait_seconds'] = max(stats['max_wait_seconds'], waited)
+
+    def _record_timeout(self, priority, waited, timeout):
+        # Sin espera permitida (solicitud duplicada) la solicitud simplemente no se envía:
+        # no es una espera agotada que haya visto ningún cliente
+        if timeout == 0:
+            self._stats[priority]['hedge_skipped'] += 1
+        else:
+            self._record(priority, waited, timed_out=True)
+
+    def _timeout_error(self, priority, waited):
+        return AmadeusQueueTimeout(f"Cuota de Amadeus agotada: la solicitud ({priority}) esperó {waited:.1f}s sin capacidad disponible")
+
+    def acquire(self, priority='search', timeout=None):
+        """Espera un token. Devuelve los segundos esperados o lanza TimeoutError si se agota `timeout`."""
+        timeout = self.max_waits.get(priority, 30) if timeout is None else timeout
+        started = time.monotonic()
+        with self._condition:
+            entry = self._enqueue(priority)
+            while True:
+                delay = self._try_take(entry)
+                waited = time.monotonic() - started
+                if delay == 0:
+                    self._record(priority, waited)
+                    return waited
+                if waited >= timeout:
+                    self._leave(entry)
+                    self._record_timeout(priority, waited, timeout)
+                    raise self._timeout_error(priority, waited)
+                self._condition.wait(min(delay, timeout - waited))
+
+    async def acquire_async(self, priority='search', timeout=None):
+        """Equivalente de acquire() para el event loop: espera con asyncio.sleep en lugar de bloquear el hilo."""
+        timeout = self.max_waits.get(priority, 30) if timeout is None else timeout
+        started = time.monotonic()
+        with self._condition:
+            entry = self._enqueue(priority)
+        try:
+            while True:
+                with self._condition:
+                    delay = self._try_take(entry)
+                    waited = time.monotonic() - started
+                    if delay == 0:
+                        self._record(priority, waited)
+                        return waited
+                    if waited >= timeout:
+                        self._leave(entry)
+                        self._record_timeout(priority, waited, timeout)
+                        raise self._timeout_error(priority, waited)
+                await asyncio.sleep(min(delay, timeout - waited))
+        except asyncio.CancelledError:
+            with self._condition:
+                if entry in self._queue:
+                    self._leave(entry)
+            raise
+
+    def pause(self, seconds):
+        """Detiene la cola `seconds` segundos (Amadeus respondió 429)."""
+        with self._condition:
+            self.throttled += 1
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+            self._tokens = 0.0
+            self._condition.notify_all()
+
+    def stats(self):
+        with self._condition:
+            depth = {priority: 0 for priority in AMADEUS_PRIORITIES}
+            for rank, _ in self._queue:
+                depth[AMADEUS_PRIORITIES[rank]] += 1
+            return {
+                'rate_per_second': self.rate,
+                'burst': self.burst,
+                'available_tokens': round(self._tokens, 2),
+                'paused_seconds': round(max(0.0, self._blocked_until - time.monotonic()), 2),
+                'throttled_responses': self.throttled,
+                'queue_depth': depth,
+                'classes': {
+                    priority: dict(
+                        stats,
+                        wait_seconds=round(stats['wait_seconds'], 3),
+                        max_wait_seconds=round(stats['max_wait_seconds'], 3),
+                        avg_wait_seconds=round(stats['wait_seconds'] / stats['queued'], 3) if stats['queued'] else 0.0
+                    )
+                    for priority, stats in self._stats.items()
+                }
+            }
+
+
+# Cierra la respuesta de la solicitud duplicada que no se usó
+def _close_hedge_loser(future):
+    if future.exception() is None:
+        future.result().close()
+
+# Cliente HTTP compartido para todas las llamadas a Amadeus
+class AmadeusClient:
+    """Mantiene una sesión con pool de conexiones (keep-alive) hacia Amadeus, aplica timeouts de
+    conexión/lectura por operación y reintenta con backoff aleatorio solo las solicitudes GET,
+    que son idempotentes. Las solicitudes POST nunca se reintentan para no duplicar reservas."""
+
+    # Códigos HTTP transitorios que justifican reintentar un GET
+    RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+    def __init__(self, base_url, pool_size=10, connect_timeout=3.05, read_timeouts=None,
+                 max_retries=2, backoff_factor=0.5, backoff_max=5.0, token_expiry_margin=60, rate_limiter=None,
+                 hedge_operations=(), hedge_min_delay=0.5, hedge_max_ratio=0.1, hedge_min_samples=20):
+        self.base_url = base_url.rstrip('/')
+        self.connect_timeout = connect_timeout
+        self.read_timeouts = read_timeouts or {}
+        self.max_retries = max_retries
+        self.backoff_factor = backoff_factor
+        self.backoff_max = backoff_max
+        self.rate_limiter = rate_limiter
+        self.pool_size = pool_size
+
+        # Solicitudes GET "cubiertas" (hedging): si la respuesta tarda más que el p95 reciente de la
+        # operación, se lanza una segunda solicitud idéntica y se usa la que responda primero
+        self.hedge_operations = set(hedge_operations)
+        self.hedge_min_delay = hedge_min_delay
+        self.hedge_max_ratio = hedge_max_ratio
+        self.hedge_min_samples = hedge_min_samples
+        self._latencies = {}
+        self._latency_lock = threading.Lock()
+        self._hedge_executor = None
+        self.hedge_stats = {'requests': 0, 'hedged': 0, 'hedge_wins': 0, 'skipped': 0}
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.token_manager = AmadeusTokenManager(self, expiry_margin=token_expiry_margin)
+
+    def timeout_for(self, operation):
+        """(conexión, lectura) de la operación, recortados al tiempo que le queda a la solicitud entrante"""
+        connect_timeout = self.connect_timeout
+        read_timeout = self.read_timeouts.get(operation, self.read_timeouts.get('default', 30))
+        remaining = check_deadline()
+        if remaining is not None:
+            connect_timeout = min(connect_timeout, remaining)
+            read_timeout = min(read_timeout, remaining)
+        return (connect_timeout, read_timeout)
+
+    def deadline_clipped(self, operation, timeout):
+        """Indica si el timeout (conexión, lectura) se recortó al tiempo límite de la solicitud entrante"""
+        connect_timeout, read_timeout = timeout
+        return (connect_timeout < self.connect_timeout
+                or read_timeout < self.read_timeouts.get(operation, self.read_timeouts.get('default', 30)))
+
+    def record_latency(self, operation, seconds):
+        with self._latency_lock:
+            samples = self._latencies.get(operation)
+            if samples is None:
+                samples = self._latencies[operation] = deque(maxlen=200)
+            samples.append(seconds)
+
+    def latency_percentile(self, operation, percentile):
+        with self._latency_lock:
+            samples = sorted(self._latencies.get(operation, ()))
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(len(samples) * percentile))]
+
+    def hedge_delay(self, operation):
+        """Segundos tras los que conviene lanzar la solicitud duplicada, o None si no se debe duplicar"""
+        if operation not in self.hedge_operations:
+            return None
+        with self._latency_lock:
+            self.hedge_stats['requests'] += 1
+            if len(self._latencies.get(operation, ())) < self.hedge_min_samples:
+                return None
+            # Nunca duplicar más de una fracción de las solicitudes, aunque Amadeus esté lento en general
+            if self.hedge_stats['hedged'] >= self.hedge_max_ratio * self.hedge_stats['requests']:
+                self.hedge_stats['skipped'] += 1
+                return None
+        return max(self.hedge_min_delay, self.latency_percentile(operation, 0.95))
+
+    def _hedge_pool(self):
+        if self._hedge_executor is None:
+            with self._latency_lock:
+                if self._hedge_executor is None:
+                    self._hedge_executor = ThreadPoolExecutor(
+                        max_workers=max(4, self.pool_size * 2),
+                        thread_name_prefix='amadeus-hedge'
+                    )
+        return self._hedge_executor
+
+    def latency_stats(self):
+        with self._latency_lock:
+            operations = list(self._latencies)
+            hedging = dict(self.hedge_stats)
+        return {
+            'operations': {
+                operation: {
+                    'samples': len(self._latencies[operation]),
+                    'p50_seconds': round(self.latency_percentile(operation, 0.5), 3),
+                    'p95_seconds': round(self.latency_percentile(operation, 0.95), 3)
+                }
+                for operation in operations
+            },
+            'hedging': dict(hedging, enabled_operations=sorted(self.hedge_operations))
+        }
+
+    def _backoff(self, attempt):
+        # Backoff exponencial con "full jitter" para no sincronizar los reintentos de varios workers
+        return random.uniform(0, min(self.backoff_max, self.backoff_factor * (2 ** attempt)))
+
+    def priority_for(self, operation):
+        if operation == 'token':
+            return 'booking'
+        return amadeus_priority.get() or AMADEUS_OPERATION_PRIORITIES.get(operation, 'search')
+
+    def throttle_response(self, response):
+        """Si Amadeus respondió 429, detiene el limitador el tiempo indicado en Retry-After."""
+        if response.status_code == 429 and self.rate_limiter is not None:
+            delay = parse_retry_after(response.headers.get('Retry-After'))
+            self.rate_limiter.pause(delay if delay is not None else 1.0)
+
+    def queue_timeout_for(self, operation, hedge=False):
+        """Espera máxima en la cola del limitador: la de la prioridad, recortada al tiempo restante.
+        Las solicitudes duplicadas (hedge) no esperan: si no hay capacidad inmediata, no se envían."""
+        if hedge:
+            return 0
+        priority = self.priority_for(operation)
+        queue_timeout = self.rate_limiter.max_waits.get(priority, 30)
+        remaining = check_deadline()
+        return queue_timeout if remaining is None else min(queue_timeout, remaining)
+
+    def _request_once(self, method, url, operation, headers, timeout, hedge=False, **kwargs):
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(self.priority_for(operation), timeout=self.queue_timeout_for(operation, hedge))
+        response = self.session.request(method, url, headers=headers, timeout=timeout, **kwargs)
+        self.throttle_response(response)
+        return response
+
+    def _send(self, method, url, operation, authenticated, headers, timeout, hedge=False, **kwargs):
+        headers = dict(headers or {})
+        if not authenticated:
+            return self._request_once(method, url, operation, headers, timeout, hedge=hedge, **kwargs)
+
+        access_token = self.token_manager.get_token()
+        headers["Authorization"] = f"Bearer {access_token}"
+        response = self._request_once(method, url, operation, headers, timeout, hedge=hedge, **kwargs)
+
+        # Si Amadeus rechaza el token (revocado o expirado antes de lo previsto), renovarlo y reintentar una vez
+        if response.status_code == 401:
+            print("Amadeus rechazó el token (401), renovando y reintentando")
+            self.token_manager.invalidate(access_token)
+            headers["Authorization"] = f"Bearer {self.token_manager.get_token()}"
+            response = self._request_once(method, url, operation, headers, timeout, **kwargs)
+        return response
+
+    def _send_hedged(self, method, url, operation, authenticated, headers, timeout, **kwargs):
+        delay = self.hedge_delay(operation)
+        if delay is None:
+            return self._send(method, url, operation, authenticated, headers, timeout, **kwargs)
+
+        # Cada solicitud se ejecuta con una copia del contexto (prioridad y tiempo límite)
+        pool = self._hedge_pool()
+        primary = pool.submit(contextvars.copy_context().run, self._send, method, url, operation, authenticated, headers, timeout, **kwargs)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        with self._latency_lock:
+            self.hedge_stats['hedged'] += 1
+        hedge = pool.submit(contextvars.copy_context().run, self._send, method, url, operation, authenticated, headers, timeout, hedge=True, **kwargs)
+        pending = {primary, hedge}
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                if future.exception() is not None:
+                    continue
+                if future is hedge:
+                    with self._latency_lock:
+                        self.hedge_stats['hedge_wins'] += 1
+                # Liberar la conexión de la solicitud perdedora cuando termine
+                for loser in pending:
+                    loser.add_done_callback(_close_hedge_loser)
+                return future.result()
+        # Ambas fallaron: propagar el error de la solicitud original
+        return primary.result()
+
+    def request(self, method, path, operation='default', authenticated=True, headers=None, **kwargs):
+        method = method.upper()
+        url = f"{self.base_url}{path}"
+        retries = self.max_retries if method == 'GET' else 0
+
+        attempt = 0
+        while True:
+            # Los timeouts se recalculan en cada intento con el tiempo que le queda a la solicitud entrante
+            timeout = self.timeout_for(operation)
+            started = time.monotonic()
+            try:
+                if method == 'GET':
+                    response = self._send_hedged(method, url, operation, authenticated, headers, timeout, **kwargs)
+                else:
+                    response = self._send(method, url, operation, authenticated, headers, timeout, **kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                # Un timeout recortado al tiempo límite de la solicitud no es un fallo de Amadeus
+                if isinstance(e, requests.exceptions.Timeout) and self.deadline_clipped(operation, timeout):
+                    if isinstance(e, requests.exceptions.ConnectTimeout):
+                        raise DeadlineExceeded("Se agotó el tiempo límite de la solicitud al conectar con Amadeus") from e
+                    raise ResponseDeadlineExceeded("Se agotó el tiempo límite de la solicitud esperando a Amadeus") from e
+                if attempt >= retries:
+                    raise
+                delay = self._backoff(attempt)
+                print(f"Error de red en {operation} ({str(e)}), reintento {attempt + 1}/{retries} en {delay:.2f}s")
+                error = e
+            else:
+                if response.status_code < 500:
+                    self.record_latency(operation, time.monotonic() - started)
+                if response.status_code not in self.RETRY_STATUS_CODES or attempt >= retries:
+                    return response
+                delay = self._backoff(attempt)
+                print(f"Amadeus respondió {response.status_code} en {operation}, reintento {attempt + 1}/{retries} en {delay:.2f}s")
+                error = None
+            # No reintentar si la espera consumiría el tiempo que le queda a la solicitud entrante
+            remaining = deadline_remaining()
+            if remaining is not None and delay >= remaining:
+                if error is not None:
+                    raise error
+                return response
+            time.sleep(delay)
+            attempt += 1
+
+    def get(self, path, operation='default', **kwargs):
+        return self.request('GET', path, operation=operation, **kwargs)
+
+    def post(self, path, operation='default', **kwargs):
+        return self.request('POST', path, operation=operation, **kwargs)
+
+
+amadeus_client = AmadeusClient(
+    AMADEUS_BASE_URL,
+    pool_size=int(os.getenv('AMADEUS_POOL_SIZE', '20')),
+    connect_timeout=float(os.getenv('AMADEUS_CONNECT_TIMEOUT', '3.05')),
+    read_timeouts={
+        'token': float(os.getenv('AMADEUS_TIMEOUT_TOKEN', '10')),
+        'locations': float(os.getenv('AMADEUS_TIMEOUT_LOCATIONS', '5')),
+        'flight_offers': float(os.getenv('AMADEUS_TIMEOUT_FLIGHT_OFFERS', '30')),
+        'flight_orders': float(os.getenv('AMADEUS_TIMEOUT_FLIGHT_ORDERS', '45')),
+        'pricing': float(os.getenv('AMADEUS_TIMEOUT_PRICING', '20')),
+    },
+    max_retries=int(os.getenv('AMADEUS_MAX_RETRIES', '2')),
+    backoff_factor=float(os.getenv('AMADEUS_RETRY_BACKOFF', '0.5')),
+    token_expiry_margin=int(os.getenv('AMADEUS_TOKEN_EXPIRY_MARGIN', '60')),
+    hedge_operations=('locations', 'flight_offers') if os.getenv('AMADEUS_HEDGE_ENABLED', 'false').lower() == 'true' else (),
+    hedge_min_delay=float(os.getenv('AMADEUS_HEDGE_MIN_DELAY', '0.5')),
+    hedge_max_ratio=float(os.getenv('AMADEUS_HEDGE_MAX_RATIO', '0.1')),
+    rate_limiter=PriorityRateLimiter(
+        rate=float(os.getenv('AMADEUS_QUOTA_PER_SECOND', '10')),
+        burst=float(os.getenv('AMADEUS_QUOTA_BURST', '0')) or None,
+        max_waits={
+            'booking': float(os.getenv('AMADEUS_QUEUE_TIMEOUT_BOOKING', '30')),
+            'search': float(os.getenv('AMADEUS_QUEUE_TIMEOUT_SEARCH', '10')),
+            'autocomplete': float(os.getenv('AMADEUS_QUEUE_TIMEOUT_AUTOCOMPLETE', '2')),
+            'warming': float(os.getenv('AMADEUS_QUEUE_TIMEOUT_WARMING', '60')),
+        }
+    )
+)
+token_manager = amadeus_client.token_manager
+
+# Tiempo máximo en segundos de los endpoints que llaman a Amadeus. El tiempo restante se reparte entre
+# las llamadas de la solicitud (token, búsqueda, reserva): cada una usa solo lo que queda
+REQUEST_BUDGETS = {
+    'search': float(os.getenv('REQUEST_BUDGET_SEARCH', '30')),
+    'api_search_flights': float(os.getenv('REQUEST_BUDGET_SEARCH', '30')),
+    'api_search_flights_batch': float(os.getenv('REQUEST_BUDGET_BATCH', '60')),
+    'api_fare_calendar': float(os.getenv('REQUEST_BUDGET_CALENDAR', '90')),
+    'search_stream': float(os.getenv('REQUEST_BUDGET_STREAM', '60')),
+    'create_booking': float(os.getenv('REQUEST_BUDGET_BOOKING', '60')),
+    'autocomplete_airport': float(os.getenv('REQUEST_BUDGET_AUTOCOMPLETE', '3')),
+}
+
+@app.before_request
+def set_request_deadline():
+    budget = REQUEST_BUDGETS.get(request.endpoint)
+    amadeus_deadline.set(time.monotonic() + budget if budget else None)
+
+@app.teardown_request
+def clear_request_deadline(error=None):
+    amadeus_deadline.set(None)
+
+# Función para obtener un token de acceso
+def get_access_token():
+    return token_manager.get_token()
+
+# Obtener el token al iniciar la aplicación (opcional) para que la primera búsqueda no espere la autenticación
+if os.getenv('AMADEUS_PREFETCH_TOKEN', 'false').lower() == 'true':
+    def _prefetch_token():
+        try:
+            get_access_token()
+        except Exception as e:
+            print(f"No se pudo obtener el token de Amadeus al iniciar: {str(e)}")
+
+    threading.Thread(target=_prefetch_token, name='amadeus-token-prefetch', daemon=True).start()
 
 # Función para buscar aeropuertos y ciudades
 def search_airports(keyword):
     try:
-        # Obtener token de acceso
-        access_token = get_access_token()
-        
-        # Configurar la llamada a la API
-        search_url = "https://test.api.amadeus.com/v1/reference-data/locations"
-        headers = {
-            "Authorization": f"Bearer {access_token}"
-        }
-        
-        # Parámetros de búsqueda
-        params = {
-            "keyword": keyword,
-            "subType": "AIRPORT,CITY",
-            "page[limit]": 10,  # Limitar a 10 resultados para mejor rendimiento
-            "view": "LIGHT"  # Vista ligera para obtener solo la información necesaria
-        }
-        
         # Realizar la solicitud
-        response = requests.get(search_url, headers=headers, params=params)
+        response = amadeus_client.get("/v1/reference-data/locations", operation="locations", params=airport_search_params(keyword))
         response.raise_for_status()
         
         # Procesar los resultados
-        results = response.json()
-        airports = []
-        
-        for item in results.get('data', []):
-            airport_data = {
-                'iataCode': item.get('iataCode', ''),
-                'name': item.get('name', ''),
-                'cityName': item.get('address', {}).get('cityName', ''),
-                'countryName': item.get('address', {}).get('countryName', ''),
-                'subType': item.get('subType', '')
-            }
-            airports.append(airport_data)
-        
-        return airports
+        return parse_airport_results(response.json())
     except Exception as e:
         print(f"Error searching airports: {str(e)}")
         if 'response' in locals():
             print(f"Response content: {response.text}")
         return []
 
-# Función para consultar vuelos
-def search_flights(origin, destination, departure_date, return_date=None, adults=1, children=0, infants=0, source_system="GDS", trip_type="roundtrip"):
-    try:
-        # Convert airport codes to uppercase
-        origin = origin.upper()
-        destination = destination.upper()
+# Parámetros de búsqueda de aeropuertos y ciudades
+def airport_search_params(keyword):
+    return {
+        "keyword": keyword,
+        "subType": "AIRPORT,CITY",
+        "page[limit]": 10,  # Limitar a 10 resultados para mejor rendimiento
+        "view": "LIGHT"  # Vista ligera para obtener solo la información necesaria
+    }
+
+# Convierte la respuesta de Airport & City Search al formato usado por el autocompletado
+def parse_airport_results(results):
+    airports = []
+    
+    for item in results.get('data', []):
+        airport_data = {
+            'iataCode': item.get('iataCode', ''),
+            'name': item.get('name', ''),
+            'cityName': item.get('address', {}).get('cityName', ''),
+            'countryName': item.get('address', {}).get('countryName', ''),
+            'subType': item.get('subType', '')
+        }
+        airports.append(airport_data)
+    
+    return airports
+
+# Normaliza un texto para el índice de aeropuertos: minúsculas, sin acentos ni signos de puntuación
+def normalize_airport_text(text):
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(char for char in text if not unicodedata.combining(char))
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', text.lower()).split())
+
+# Índice local de aeropuertos y ciudades para el autocompletado
+class AirportIndex:
+    """Índice de prefijos en memoria: una lista ordenada de términos normalizados (código IATA,
+    ciudad, nombre y cada una de sus palabras) que se recorre con búsqueda binaria. Los resultados
+    se ordenan por coincidencia exacta del código y después por popularidad."""
+
+    def __init__(self, limit=10):
+        self.limit = limit
+        self._lock = threading.Lock()
+        self._entries = []
+        self._keys = {}
+        self._terms = []
+
+    def _terms_for(self, position, entry):
+        terms = {normalize_airport_text(entry['iataCode'])}
+        for field in ('cityName', 'name'):
+            value = normalize_airport_text(entry[field])
+            if value:
+                terms.add(value)
+                terms.update(value.split())
+        return [(term, position) for term in terms if term]
+
+    def add(self, entries):
+        """Añade entradas con el formato de parse_airport_results (más `popularity`).
+        Devuelve cuántas eran nuevas."""
+        added = 0
+        with self._lock:
+            new_terms = []
+            for entry in entries:
+                key = (entry.get('iataCode', ''), entry.get('subType', ''))
+                if not key[0] or key in self._keys:
+                    continue
+                position = len(self._entries)
+                entry = dict(entry)
+                entry.setdefault('popularity', 0)
+                self._entries.append(entry)
+                self._keys[key] = position
+                new_terms.extend(self._terms_for(position, entry))
+                added += 1
+            if new_terms:
+                # Se construye una lista nueva para que las búsquedas concurrentes no vean un estado a medias
+                self._terms = sorted(self._terms + new_terms)
+        return added
+
+    def load_csv(self, path):
+        with open(path, newline='', encoding='utf-8') as f:
+            return self.add({
+                'iataCode': row['iata_code'],
+                'name': row['name'],
+                'cityName': row['city'],
+                'countryName': row['country'],
+                'subType': row['sub_type'],
+                'popularity': float(row.get('popularity') or 0)
+            } for row in csv.DictReader(f))
+
+    def search(self, keyword, limit=None):
+        query = normalize_airport_text(keyword)
+        if not query:
+            return []
+        terms, entries = self._terms, self._entries
+        matches = set()
+        start = bisect.bisect_left(terms, (query, -1))
+        for term, position in itertools.islice(terms, start, None):
+            if not term.startswith(query):
+                break
+            matches.add(position)
+
+        code = query.upper()
+        ranked = sorted(
+            (entries[position] for position in matches),
+            key=lambda entry: (entry['iataCode'] != code, -entry['popularity'], entry['subType'] != 'CITY', entry['iataCode'])
+        )
+        return [
+            {name: entry[name] for name in ('iataCode', 'name', 'cityName', 'countryName', 'subType')}
+            for entry in ranked[:limit or self.limit]
+        ]
+
+
+AIRPORT_DATA_FILE = os.getenv('AIRPORT_DATA_FILE', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'airports.csv'))
+airport_index = AirportIndex(limit=int(os.getenv('AUTOCOMPLETE_MAX_RESULTS', '10')))
+try:
+    print(f"Índice de aeropuertos cargado: {airport_index.load_csv(AIRPORT_DATA_FILE)} entradas")
+except (OSError, KeyError, ValueError) as e:
+    print(f"No se pudo cargar el índice de aeropuertos ({AIRPORT_DATA_FILE}): {str(e)}")
+
+# Autocompletado: primero el índice local y, solo si no hay coincidencias, Amadeus
+def autocomplete_airports(keyword):
+    airports = airport_index.search(keyword)
+    if airports:
+        return airports
+    airports = search_airports(keyword)
+    # Guardar los resultados de Amadeus para que la siguiente búsqueda se resuelva localmente
+    airport_index.add(airports)
+    return airports
+
+# Aerolíneas incluidas por defecto en las búsquedas, agrupadas por región
+# Configuración para incluir aerolíneas de Latinoamérica, Norteamérica y rutas internacionales
+# Cada aerolínea pertenece a un solo grupo: la búsqueda progresiva consulta los grupos por separado
+# y una aerolínea repetida devolvería sus ofertas dos veces
+AIRLINE_GROUPS = {
+    # Latinoamérica
+    'latam': ["AM", "AV", "CM", "LA", "AR", "4M", "JJ", "G3", "H2", "LU", "LP", "P9", "UC", "WV", "Y4", "VB"],
+    # Estados Unidos y Canadá
+    'us_canada': ["AA", "DL", "UA", "B6", "AS", "WN", "AC", "WS", "F8"],
+    # Europa (incluye Turkish Airlines)
+    'europe': ["IB", "BA", "LH", "AF", "AZ", "UX", "LX", "OS", "SN", "TP", "TK"],
+    # Medio Oriente (incluye rutas a Israel)
+    'middle_east': ["LY", "MS", "EK", "EY", "QR", "SV", "ME", "RJ"],
+    # Asia y otras internacionales
+    'asia': ["CX", "SQ", "NH", "OZ", "KE", "CA", "MU", "HU", "JL"],
+}
+
+# Aerolíneas con mejor contenido NDC (datos más completos y tarifas personalizadas)
+NDC_PREFERRED_AIRLINES = ["BA", "AA", "IB", "LH", "AF", "DL", "UA"]
+
+def resolve_airline_codes(source_system="GDS", airlines=None):
+    """Devuelve la lista ordenada y sin duplicados de códigos IATA a incluir en la búsqueda.
+    Si no se indica una lista explícita se usan todas las regiones de AIRLINE_GROUPS."""
+    if airlines:
+        codes = {code.strip().upper() for code in airlines if code and code.strip()}
+    else:
+        codes = {code for group in AIRLINE_GROUPS.values() for code in group}
+        # Para NDC, asegurarse de que las aerolíneas con mejor contenido NDC estén incluidas
+        if source_system == "NDC":
+            codes.update(NDC_PREFERRED_AIRLINES)
+    return sorted(codes)
+
+# Construye los parámetros de la consulta Flight Offers Search de Amadeus
+def build_flight_search_params(origin, destination, departure_date, return_date=None, adults=1, children=0, infants=0, source_system="GDS", trip_type="roundtrip", airlines=None):
+    # Convert airport codes to uppercase
+    origin = origin.upper()
+    destination = destination.upper()
+    
+    # Convert passenger counts to integers
+    adults = int(adults)
+    children = int(children) if children else 0
+    infants = int(infants) if infants else 0
+    
+    params = {
+        "originLocationCode": origin,
+        "destinationLocationCode": destination,
+        "departureDate": departure_date,
+        "adults": adults,
+        "max": 250,  # Aumentado a 250 para obtener más resultados (máximo permitido por la API)
+        "travelClass": "ECONOMY"  # Clase de viaje fija en Economy
+    }
+    
+    # Add children and infants if specified
+    if children > 0:
+        params["children"] = children
+    if infants > 0:
+        params["infants"] = infants
         
-        # Convert passenger counts to integers
-        adults = int(adults)
-        children = int(children) if children else 0
-        infants = int(infants) if infants else 0
+    # Configurar parámetros según el tipo de viaje
+    if trip_type.lower() == "roundtrip" and return_date:
+        # Para vuelos de ida y vuelta
+        params["returnDate"] = return_date
+        params["nonStop"] = "false"  # Allow connections for better results
+    elif trip_type.lower() == "oneway":
+        # Para vuelos de solo ida
+        # Asegurarse de que no se envíe returnDate incluso si viene como parámetro
+        if "returnDate" in params:
+            del params["returnDate"]
+        # Opcionalmente, podemos ajustar otros parámetros para vuelos de solo ida
+        params["nonStop"] = "false"  # Allow connections for better results
         
-        access_token = get_access_token()
-        search_url = "https://test.api.amadeus.com/v2/shopping/flight-offers"
+    # Incluir amplia variedad de aerolíneas para mostrar múltiples tarifas y opciones
+    params["includedAirlineCodes"] = ",".join(resolve_airline_codes(source_system, airlines))
+    
+    # Si hay niños o infantes, incluir servicios adicionales para familias
+    if children > 0 or infants > 0:
+        # Incluir opciones de equipaje para familias
+        params["includedServiceCodes"] = "BAG"
+            
+    # Configurar el tipo de distribución (NDC o EDIFACT)
+    if source_system and source_system != "GDS":
+        # NDC (New Distribution Capability) ofrece contenido enriquecido y tarifas personalizadas
+        # EDIFACT es el sistema tradicional de distribución
+        params["sources"] = source_system
+    
+    return params
+
+# Función para consultar vuelos
+def search_flights(origin, destination, departure_date, return_date=None, adults=1, children=0, infants=0, source_system="GDS", trip_type="roundtrip", airlines=None):
+    try:
+        params = build_flight_search_params(origin, destination, departure_date, return_date, adults, children, infants, source_system, trip_type, airlines)
         headers = {
-            "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json"
         }
-        params = {
-            "originLocationCode": origin,
-            "destinationLocationCode": destination,
-            "departureDate": departure_date,
-            "adults": adults,
-            "max": 250,  # Aumentado a 250 para obtener más resultados (máximo permitido por la API)
-            "travelClass": "ECONOMY"  # Clase de viaje fija en Economy
-        }
-        
-        # Add children and infants if specified
-        if children > 0:
-            params["children"] = children
-        if infants > 0:
-            params["infants"] = infants
-            
-        # Configurar parámetros según el tipo de viaje
-        if trip_type.lower() == "roundtrip" and return_date:
-            # Para vuelos de ida y vuelta
-            params["returnDate"] = return_date
-            params["nonStop"] = "false"  # Allow connections for better results
-        elif trip_type.lower() == "oneway":
-            # Para vuelos de solo ida
-            # Asegurarse de que no se envíe returnDate incluso si viene como parámetro
-            if "returnDate" in params:
-                del params["returnDate"]
-            # Opcionalmente, podemos ajustar otros parámetros para vuelos de solo ida
-            params["nonStop"] = "false"  # Allow connections for better results
-            
-        # Incluir amplia variedad de aerolíneas para mostrar múltiples tarifas y opciones
-        # Configuración para incluir aerolíneas de Latinoamérica, Norteamérica y rutas internacionales
-        params["includedAirlineCodes"] = (
-            # Latinoamérica
-            "AM,AV,CM,LA,AR,4M,JJ,G3,H2,LU,LP,P9,UC,WV,Y4,VB," +
-            # Estados Unidos y Canadá
-            "AA,DL,UA,B6,AS,WN,AC,WS,F8," +
-            # Europa
-            "IB,BA,LH,AF,AZ,UX,LX,OS,SN,TP,TK," +
-            # Medio Oriente (incluye rutas a Turquía e Israel)
-            "TK,LY,MS,EK,EY,QR,SV,ME,RJ," +
-            # Asia y otras internacionales
-            "CX,SQ,NH,OZ,KE,CA,MU,HU,JL"
-        )  # Códigos IATA de aerolíneas seleccionadas
-        
-        # Si hay niños o infantes, incluir servicios adicionales para familias
-        if children > 0 or infants > 0:
-            # Incluir opciones de equipaje para familias
-            params["includedServiceCodes"] = "BAG"
-                
-        # Configurar el tipo de distribución (NDC o EDIFACT)
-        if source_system and source_system != "GDS":
-            # NDC (New Distribution Capability) ofrece contenido enriquecido y tarifas personalizadas
-            # EDIFACT es el sistema tradicional de distribución
-            params["sources"] = source_system
-            
-            # Para NDC, podemos añadir parámetros adicionales para mejorar los resultados
-            if source_system == "NDC":
-                # Asegurarse de que las aerolíneas con mejor contenido NDC estén incluidas
-                # Estas aerolíneas ofrecen datos más completos y tarifas personalizadas en NDC
-                ndc_preferred_airlines = ["BA", "AA", "IB", "LH", "AF", "DL", "UA"]
-                
-                # Convertir la cadena de aerolíneas actuales a un conjunto para operaciones más eficientes
-                current_airlines = set(params.get("includedAirlineCodes", "").split(","))
-                
-                # Añadir las aerolíneas NDC preferidas que no estén ya incluidas
-                for airline in ndc_preferred_airlines:
-                    current_airlines.add(airline)
-                
-                # Eliminar cualquier cadena vacía que pueda haberse colado
-                if "" in current_airlines:
-                    current_airlines.remove("")
-                
-                # Actualizar el parámetro con la lista unificada
-                params["includedAirlineCodes"] = ",".join(current_airlines)
         
         print(f"Searching flights with params: {params}")  # Debug log
-        response = requests.get(search_url, headers=headers, params=params)
-        response.raise_for_status()
+
+        def fetch_offers():
+            response = amadeus_client.get("/v2/shopping/flight-offers", operation="flight_offers", headers=headers, params=params)
+            if response.status_code >= 400:
+                print(f"Response content: {response.text}")
+            response.raise_for_status()
+            return response
+
+        # El circuito se abre si Amadeus falla o responde demasiado lento de forma sostenida
+        response = search_circuit.call(fetch_offers)
         return response.json()
     except Exception as e:
         print(f"Error searching flights: {str(e)}")
-        if 'response' in locals():
-            print(f"Response content: {response.text}")
         raise
 
-@app.route('/', methods=['GET'])
-def index():
-    return render_template('index.html')
-
-# Ruta para continuar una reserva desde una URL compartida
-@app.route('/quick_search')
-def quick_search():
-    # Obtener parámetros de la URL
-    origin = request.args.get('origin', '')
-    destination = request.args.get('destination', '')
-    departure_date = request.args.get('departure_date', '')
-    return_date = request.args.get('return_date', '')
-    trip_type = request.args.get('trip_type', 'roundtrip')
-    adults = request.args.get('adults', '1')
-    children = request.args.get('children', '0')
-    infants = request.args.get('infants', '0')
-    
-    # Pasar los parámetros a la plantilla
-    return render_template(
-        'index.html',
-        prefill={
-            'origin': origin,
-            'destination': destination,
-            'departure_date': departure_date,
-            'return_date': return_date,
-            'trip_type': trip_type,
-            'adults': adults,
-            'children': children,
-            'infants': infants,
-            'auto_search': 'true' if all([origin, destination, departure_date]) else 'false'
-        }
+# Clave normalizada de una búsqueda de vuelos
+def flight_search_key(origin, destination, departure_date, return_date=None, adults=1, children=0, infants=0, source_system="GDS", trip_type="roundtrip", airlines=None):
+    """Normaliza los parámetros de búsqueda para que dos búsquedas equivalentes compartan la misma clave"""
+    trip_type = (trip_type or 'roundtrip').lower()
+    # Sin fecha de regreso, una búsqueda "roundtrip" es en la práctica de solo ida
+    if trip_type != 'roundtrip' or not return_date:
+        trip_type = 'oneway'
+        return_date = ''
+    source_system = source_system or 'GDS'
+    return (
+        origin.strip().upper(),
+        destination.strip().upper(),
+        departure_date,
+        return_date,
+        int(adults),
+        int(children) if children else 0,
+        int(infants) if infants else 0,
+        trip_type,
+        source_system,
+        ','.join(resolve_airline_codes(source_system, airlines))
     )
 
-# Ruta para buscar reservas por PNR
-@app.route('/find_booking', methods=['POST'])
-def find_booking():
+# Caché de resultados de búsqueda de vuelos
+class SearchResultCache:
+    """Caché en memoria con expiración (TTL) y desalojo LRU limitado por tamaño en bytes.
+    Los resultados almacenados se comparten entre solicitudes y deben tratarse como de solo lectura."""
+
+    def __init__(self, ttl=1200, max_bytes=64 * 1024 * 1024, stale_ttl=0):
+        self.ttl = ttl
+        # Tiempo adicional durante el que se conservan las entradas caducadas para servirlas
+        # como resultado obsoleto si Amadeus no está disponible
+        self.stale_ttl = stale_ttl
+        self.max_bytes = max_bytes
+        # clave -> (instante de almacenamiento, tamaño en bytes, resultados)
+        self._entries = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.stale_hits = 0
+
+    def get(self, key):
+        """Devuelve (resultados, antigüedad en segundos) o None si no hay una entrada vigente"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            stored_at, size, value = entry
+            age = time.time() - stored_at
+            if age > self.ttl:
+                if age > self.ttl + self.stale_ttl:
+                    self._remove(key)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value, age
+
+    def peek(self, key):
+        """Como get(), pero sin contar aciertos/fallos ni cambiar el orden LRU (para consultas internas)"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, size, value = entry
+            age = time.time() - stored_at
+            return (value, age) if age <= self.ttl else None
+
+    def get_stale(self, key):
+        """Devuelve (resultados, antigüedad) aunque la entrada haya caducado, mientras siga dentro de stale_ttl"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            stored_at, size, value = entry
+            age = time.time() - stored_at
+            if age > self.ttl + self.stale_ttl:
+                self._remove(key)
+                return None
+            self.stale_hits += 1
+            return value, age
+
+    def set(self, key, value):
+        size = len(json.dumps(value, separators=(',', ':')))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.time(), size, value)
+            self._total_bytes += size
+            # Desalojar las entradas usadas menos recientemente hasta respetar el límite de memoria
+            while self._total_bytes > self.max_bytes:
+                oldest_key = next(iter(self._entries))
+                self._remove(oldest_key)
+                self.evictions += 1
+
+    def _remove(self, key):
+        _, size, _ = self._entries.pop(key)
+        self._total_bytes -= size
+
+    def invalidate(self, key):
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+                return True
+            return False
+
+    def invalidate_route(self, origin=None, destination=None):
+        """Elimina todas las búsquedas de una ruta (o de un origen/destino). Devuelve el número de entradas eliminadas"""
+        origin = origin.upper() if origin else None
+        destination = destination.upper() if destination else None
+        with self._lock:
+            keys = [key for key in self._entries
+                    if (origin is None or key[0] == origin) and (destination is None or key[1] == destination)]
+            for key in keys:
+                self._remove(key)
+            return len(keys)
+
+    def clear(self):
+        with self._lock:
+            count = len(self._entries)
+            self._entries.clear()
+            self._total_bytes = 0
+            return count
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._total_bytes,
+                'max_bytes': self.max_bytes,
+                'ttl_seconds': self.ttl,
+                'stale_ttl_seconds': self.stale_ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'stale_hits': self.stale_hits,
+                'evictions': self.evictions
+            }
+
+
+search_cache = SearchResultCache(
+    ttl=int(os.getenv('SEARCH_CACHE_TTL', '1200')),
+    max_bytes=int(os.getenv('SEARCH_CACHE_MAX_MB', '64')) * 1024 * 1024,
+    stale_ttl=int(os.getenv('SEARCH_CACHE_STALE_TTL', '21600'))
+)
+
+# Agrupación de llamadas concurrentes idénticas (single-flight)
+class SingleFlight:
+    """Cuando varias solicitudes concurrentes piden lo mismo (misma clave), solo la primera llama a
+    Amadeus; las demás esperan su resultado (o su error) con un tiempo máximo de espera propio."""
+
+    class _Call:
+        def __init__(self):
+            self.event = threading.Event()
+            self.result = None
+            self.error = None
+
+    def __init__(self, wait_timeout=None):
+        self.wait_timeout = wait_timeout
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.coalesced = 0
+        self.timeouts = 0
+        self.errors = 0
+
+    def do(self, key, fn, timeout=None):
+        """Ejecuta fn() una sola vez por clave entre las llamadas simultáneas.
+        Devuelve (resultado, compartido) donde compartido indica si se reutilizó la llamada de otro hilo."""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = self._Call()
+                self.executed += 1
+            else:
+                self.coalesced += 1
+
+        if leader:
+            try:
+                call.result = fn()
+            except Exception as e:
+                call.error = e
+                with self._lock:
+                    self.errors += 1
+                raise
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call.event.set()
+            return call.result, False
+
+        wait_timeout = timeout if timeout is not None else self.wait_timeout
+        if not call.event.wait(wait_timeout):
+            with self._lock:
+                self.timeouts += 1
+            raise TimeoutError("Tiempo de espera agotado esperando una búsqueda idéntica en curso")
+        if call.error is not None:
+            raise call.error
+        return call.result, True
+
+    def stats(self):
+        with self._lock:
+            return {
+                'in_flight': len(self._calls),
+                'executed': self.executed,
+                'coalesced': self.coalesced,
+                'timeouts': self.timeouts,
+                'errors': self.errors
+            }
+
+
+search_singleflight = SingleFlight(wait_timeout=float(os.getenv('SEARCH_COALESCE_WAIT_TIMEOUT', '45')))
+
+# Error cuando el circuito está abierto y no se llama a Amadeus
+class CircuitOpenError(Exception):
+    pass
+
+# Circuit breaker para las búsquedas en Amadeus
+class CircuitBreaker:
+    """Registra el resultado de las últimas `window` llamadas. Si al menos `min_calls` llamadas y una
+    fracción `failure_rate` de ellas fallaron o tardaron más de `slow_call_seconds`, el circuito se abre
+    y las llamadas fallan de inmediato durante `open_seconds`. Después se deja pasar una sola llamada
+    de prueba (semiabierto): si funciona el circuito se cierra, si no, vuelve a abrirse."""
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name, failure_rate=0.5, min_calls=5, window=20, slow_call_seconds=15, open_seconds=30):
+        self.name = name
+        self.failure_rate = failure_rate
+        self.min_calls = min_calls
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self._outcomes = deque(maxlen=window)
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started = 0.0
+        self._lock = threading.Lock()
+        self.rejected = 0
+        self.opened = 0
+
+    @staticmethod
+    def is_failure(error):
+        """Los errores de la solicitud (4xx) y las esperas en la cola del limitador no indican que Amadeus esté caído"""
+        if isinstance(error, (AmadeusQueueTimeout, DeadlineExceeded)):
+            return False
+        response = getattr(error, 'response', None)
+        if isinstance(error, requests.exceptions.HTTPError) and response is not None:
+            return response.status_code >= 500 or response.status_code == 429
+        return True
+
+    @property
+    def state(self):
+        return self._state
+
+    def rejecting(self):
+        """Indica si una llamada hecha ahora sería rechazada, sin consumir la llamada de prueba"""
+        with self._lock:
+            if self._state == self.OPEN:
+                return time.monotonic() - self._opened_at < self.open_seconds
+            return self._state == self.HALF_OPEN and self._probe_pending()
+
+    def _probe_pending(self):
+        # Una llamada de prueba que no terminó (ej. cancelada) deja de bloquear tras open_seconds
+        return self._probe_in_flight and time.monotonic() - self._probe_started < self.open_seconds
+
+    def allow(self):
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self._state = self.HALF_OPEN
+                self._probe_in_flight = False
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._probe_pending():
+                self._probe_in_flight = True
+                self._probe_started = time.monotonic()
+                return True
+            self.rejected += 1
+            return False
+
+    def _open(self):
+        self._state = self.OPEN
+        self._opened_at = time.monotonic()
+        self._probe_in_flight = False
+        self.opened += 1
+        print(f"Circuito {self.name} abierto: Amadeus falla o responde lento, se servirán resultados en caché")
+
+    def record(self, failed):
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                if failed:
+                    self._open()
+                else:
+                    self._state = self.CLOSED
+                    self._outcomes.clear()
+                    print(f"Circuito {self.name} cerrado")
+                return
+            self._outcomes.append(failed)
+            failures = sum(self._outcomes)
+            if (self._state == self.CLOSED and len(self._outcomes) >= self.min_calls
+                    and failures >= self.failure_rate * len(self._outcomes)):
+                self._outcomes.clear()
+                self._open()
+
+    def release(self):
+        """Termina una llamada sin registrar su resultado: si era la llamada de prueba, libera su turno
+        sin cerrar el circuito para que la siguiente llamada pueda probar"""
+        with self._lock:
+            if self._state == self.HALF_OPEN:
+                self._probe_in_flight = False
+
+    def call(self, fn, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpenError("Servicio de búsqueda de Amadeus no disponible temporalmente")
+        started = time.monotonic()
+        try:
+            result = fn(*args, **kwargs)
+        except Exception as e:
+            # Los errores que no son fallos de Amadeus no cuentan como éxito ni como fallo
+            if self.is_failure(e):
+                self.record(True)
+            else:
+                self.release()
+            raise
+        self.record(time.monotonic() - started > self.slow_call_seconds)
+        return result
+
+    async def call_async(self, fn, *args, **kwargs):
+        if not self.allow():
+            raise CircuitOpenError("Servicio de búsqueda de Amadeus no disponible temporalmente")
+        started = time.monotonic()
+        try:
+            result = await fn(*args, **kwargs)
+        except Exception as e:
+            # Los errores que no son fallos de Amadeus no cuentan como éxito ni como fallo
+            if self.is_failure(e):
+                self.record(True)
+            else:
+                self.release()
+            raise
+        self.record(time.monotonic() - started > self.slow_call_seconds)
+        return result
+
+    def stats(self):
+        with self._lock:
+            return {
+                'state': self._state,
+                'recent_calls': len(self._outcomes),
+                'recent_failures': sum(self._outcomes),
+                'opened': self.opened,
+                'rejected': self.rejected
+            }
+
+
+search_circuit = CircuitBreaker(
+    'flight_offers',
+    failure_rate=float(os.getenv('SEARCH_CIRCUIT_FAILURE_RATE', '0.5')),
+    min_calls=int(os.getenv('SEARCH_CIRCUIT_MIN_CALLS', '5')),
+    window=int(os.getenv('SEARCH_CIRCUIT_WINDOW', '20')),
+    slow_call_seconds=float(os.getenv('SEARCH_CIRCUIT_SLOW_SECONDS', '15')),
+    open_seconds=float(os.getenv('SEARCH_CIRCUIT_OPEN_SECONDS', '30'))
+)
+
+# Pool de hilos compartido para las búsquedas en paralelo (por grupos de aerolíneas, fuentes, fechas, etc.)
+search_executor = ThreadPoolExecutor(
+    max_workers=int(os.getenv('SEARCH_MAX_WORKERS', '16')),
+    thread_name_prefix='amadeus-search'
+)
+
+# Función para consultar vuelos usando la caché de resultados
+def search_flights_cached(origin, destination, departure_date, return_date=None, adults=1, children=0, infants=0, source_system="GDS", trip_type="roundtrip", airlines=None):
+    """Igual que search_flights, pero reutiliza resultados recientes de la misma búsqueda y agrupa
+    las búsquedas idénticas simultáneas en una sola llamada a Amadeus.
+    Devuelve (resultados, info_caché) donde info_caché indica si se sirvió desde caché y su antigüedad."""
+    key = flight_search_key(origin, destination, departure_date, return_date, adults, children, infants, source_system, trip_type, airlines)
+    cache_warmer.record_search(origin, destination)
+    cached = search_cache.get(key)
+    if cached is not None:
+        results, age = cached
+        return results, {'hit': True, 'age_seconds': int(age)}
+
+    def fetch():
+        results = search_flights(origin, destination, departure_date, return_date, adults, children, infants, source_system, trip_type, airlines)
+        search_cache.set(key, results)
+        return results
+
+    # Con el circuito abierto no se espera a Amadeus: se sirve el último resultado conocido y se
+    # intenta renovar en segundo plano
+    if search_circuit.rejecting():
+        stale = stale_search_result(key, fetch)
+        if stale is not None:
+            return stale
+
+    try:
+        # Las búsquedas idénticas que llegan mientras esta está en curso esperan su resultado
+        # (como máximo, lo que le queda a la solicitud entrante)
+        results, coalesced = search_singleflight.do(key, fetch, timeout=check_deadline())
+    except Exception as e:
+        stale = stale_search_result(key, fetch, error=e)
+        if stale is None:
+            raise
+        return stale
+    return results, {'hit': False, 'age_seconds': 0, 'coalesced': coalesced}
+
+# Búsquedas que se están renovando en segundo plano tras servir un resultado obsoleto
+_background_refreshes = set()
+_background_refreshes_lock = threading.Lock()
+
+# Devuelve el último resultado conocido de una búsqueda (marcado como obsoleto) y programa su renovación
+def stale_search_result(key, fetch, error=None):
+    stale = search_cache.get_stale(key)
+    if stale is None:
+        return None
+    results, age = stale
+    reason = str(error) if error is not None else 'circuit_open'
+    print(f"Sirviendo resultados obsoletos ({int(age)}s) para {key[0]}-{key[1]} {key[2]}: {reason}")
+
+    with _background_refreshes_lock:
+        schedule = key not in _background_refreshes
+        _background_refreshes.add(key)
+    if schedule:
+        def refresh():
+            try:
+                search_singleflight.do(key, fetch)
+            except Exception as e:
+                print(f"No se pudo renovar en segundo plano la búsqueda {key[0]}-{key[1]} {key[2]}: {str(e)}")
+            finally:
+                with _background_refreshes_lock:
+                    _background_refreshes.discard(key)
+        search_executor.submit(refresh)
+
+    return results, {
+        'hit': True,
+        'stale': True,
+        'age_seconds': int(age),
+        'circuit': search_circuit.state
+    }
+
+# Rutas de calentamiento configuradas (ej. "MEX-CUN,MEX-MAD"), siempre se mantienen en caché
+def parse_route_list(value):
+    routes = []
+    for item in (value or '').split(','):
+        parts = item.strip().upper().split('-')
+        if len(parts) == 2 and all(re.fullmatch(r'[A-Z]{3}', part) for part in parts):
+            routes.append((parts[0], parts[1]))
+    return routes
+
+# Calentamiento de la caché de búsquedas para las rutas más solicitadas
+class CacheWarmer:
+    """Ejecuta en segundo plano las búsquedas de las rutas populares para que estén en la caché
+    antes de que lleguen los usuarios. Las rutas salen de la configuración, de los pares
+    origen-destino de Booking.flight_id y de las búsquedas recientes; las dos últimas dejan de
+    calentarse cuando nadie las busca durante `idle_hours`. El ritmo nunca supera `rate_per_minute`
+    ni la fracción `quota_share` de la cuota por segundo de Amadeus."""
+
+    def __init__(self, routes=None, date_offsets=(7, 14, 30), trip_days=7, rate_per_minute=30,
+                 quota_per_second=10, quota_share=0.1, idle_hours=72, max_routes=50,
+                 refresh_fraction=0.75, interval=300):
+        self.routes = list(routes or [])
+        self.date_offsets = list(date_offsets)
+        self.trip_days = trip_days
+        self.interval = interval
+        self.idle_seconds = idle_hours * 3600
+        self.max_routes = max_routes
+        self.refresh_fraction = refresh_fraction
+        # Segundos entre búsquedas de calentamiento
+        self.pace = 1.0 / min(rate_per_minute / 60.0, quota_per_second * quota_share)
+        self._activity = {}
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self.warmed = 0
+        self.skipped_fresh = 0
+        self.errors = 0
+        self.last_cycle_at = None
+
+    def record_search(self, origin, destination):
+        """Registra una búsqueda de usuario para la ruta (alimenta la lista de rutas recientes)."""
+        route = ((origin or '').upper(), (destination or '').upper())
+        now = time.time()
+        with self._lock:
+            _, count = self._activity.get(route, (0, 0))
+            self._activity[route] = (now, count + 1)
+
+    def _booking_routes(self, since):
+        """Pares origen-destino de las reservas recientes, agrupados en la base de datos por las columnas
+        indexadas origin/destination. created_at se guarda en UTC sin zona horaria."""
+        with app.app_context():
+            rows = db.session.query(
+                Booking.origin, Booking.destination, db.func.max(Booking.created_at), db.func.count(Booking.id)
+            ).filter(
+                Booking.created_at >= since, Booking.origin.isnot(None), Booking.destination.isnot(None)
+            ).group_by(Booking.origin, Booking.destination).all()
+        return {
+            (origin, destination): (last_created.replace(tzinfo=timezone.utc).timestamp(), count)
+            for origin, destination, last_created, count in rows
+        }
+
+    def hot_routes(self):
+        """Rutas a calentar: las configuradas y, después, las más buscadas o reservadas recientemente."""
+        cutoff = time.time() - self.idle_seconds
+        with self._lock:
+            # Olvidar las rutas sin actividad reciente
+            self._activity = {route: activity for route, activity in self._activity.items() if activity[0] >= cutoff}
+            activity = dict(self._activity)
+        try:
+            for route, (last_seen, count) in self._booking_routes(datetime.utcnow() - timedelta(seconds=self.idle_seconds)).items():
+                previous = activity.get(route, (0, 0))
+                activity[route] = (max(previous[0], last_seen), previous[1] + count)
+        except Exception as e:
+            print(f"No se pudieron leer las rutas de las reservas: {str(e)}")
+
+        routes = list(dict.fromkeys(self.routes))
+        ranked = sorted(activity.items(), key=lambda item: (-item[1][1], -item[1][0]))
+        routes.extend(route for route, _ in ranked if route not in routes)
+        return routes[:self.max_routes]
+
+    def plan(self):
+        """Búsquedas que hay que ejecutar: combinaciones ruta/fecha que no están en la caché o están por caducar."""
+        today = datetime.now().date()
+        searches = []
+        for origin, destination in self.hot_routes():
+            for offset in self.date_offsets:
+                departure = today + timedelta(days=offset)
+                params = {'origin': origin, 'destination': destination, 'departure_date': departure.isoformat()}
+                if self.trip_days:
+                    params['return_date'] = (departure + timedelta(days=self.trip_days)).isoformat()
+                else:
+                    params['trip_type'] = 'oneway'
+                # peek() no altera las estadísticas de la caché ni protege la entrada del desalojo LRU
+                cached = search_cache.peek(flight_search_key(**params))
+                if cached is not None and cached[1] < search_cache.ttl * self.refresh_fraction:
+                    self.skipped_fresh += 1
+                    continue
+                searches.append(params)
+        return searches
+
+    def warm(self, params):
+        key = flight_search_key(**params)
+
+        def fetch():
+            results = search_flights(**params)
+            search_cache.set(key, results)
+            return results
+
+        priority_token = amadeus_priority.set('warming')
+        try:
+            search_singleflight.do(key, fetch)
+            self.warmed += 1
+        except Exception as e:
+            self.errors += 1
+            print(f"Error al calentar la caché para {params['origin']}-{params['destination']} {params['departure_date']}: {str(e)}")
+        finally:
+            amadeus_priority.reset(priority_token)
+
+    def run_cycle(self):
+        for params in self.plan():
+            if self._stop.is_set():
+                return
+            self.warm(params)
+            self._stop.wait(self.pace)
+        self.last_cycle_at = datetime.now().isoformat()
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_cycle()
+            except Exception as e:
+                print(f"Error en el calentamiento de la caché: {str(e)}")
+            self._stop.wait(self.interval)
+
+    def start(self):
+        if self._thread is None or not self._thread.is_alive():
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._run, name='search-cache-warmer', daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+
+    def stats(self):
+        with self._lock:
+            tracked_routes = len(self._activity)
+        return {
+            'running': self._thread is not None and self._thread.is_alive(),
+            'configured_routes': len(self.routes),
+            'tracked_routes': tracked_routes,
+            'warmed': self.warmed,
+            'skipped_fresh': self.skipped_fresh,
+            'errors': self.errors,
+            'last_cycle_at': self.last_cycle_at
+        }
+
+
+cache_warmer = CacheWarmer(
+    routes=parse_route_list(os.getenv('CACHE_WARM_ROUTES', '')),
+    date_offsets=[int(offset) for offset in os.getenv('CACHE_WARM_DATE_OFFSETS', '7,14,30').split(',') if offset.strip()],
+    trip_days=int(os.getenv('CACHE_WARM_TRIP_DAYS', '7')),
+    rate_per_minute=float(os.getenv('CACHE_WARM_RATE_PER_MINUTE', '30')),
+    quota_per_second=float(os.getenv('AMADEUS_QUOTA_PER_SECOND', '10')),
+    quota_share=float(os.getenv('CACHE_WARM_QUOTA_SHARE', '0.1')),
+    idle_hours=float(os.getenv('CACHE_WARM_IDLE_HOURS', '72')),
+    max_routes=int(os.getenv('CACHE_WARM_MAX_ROUTES', '50')),
+    interval=int(os.getenv('CACHE_WARM_INTERVAL', '300'))
+)
+
+# Convierte una duración ISO 8601 de Amadeus (ej. "PT2H35M", "P1DT3H") a minutos
+def parse_iso_duration(value):
+    match = re.match(r'P(?:(\d+)D)?(?:T(?:(\d+)H)?(?:(\d+)M)?)?', value or '')
+    if not match:
+        return 0
+    days, hours, minutes = (int(group) if group else 0 for group in match.groups())
+    return days * 1440 + hours * 60 + minutes
+
+# Resumen de una oferta con los campos usados para ordenar, filtrar y calcular facetas
+def summarize_offer(offer):
+    itineraries = offer.get('itineraries', [])
+    first_segment = {}
+    if itineraries and itineraries[0].get('segments'):
+        first_segment = itineraries[0]['segments'][0]
+    departure_at = first_segment.get('departure', {}).get('at', '')
+    try:
+        price = float(offer.get('price', {}).get('total', 0))
+    except (TypeError, ValueError):
+        price = 0.0
+    return {
+        'price': price,
+        'carrier': first_segment.get('carrierCode', ''),
+        # Número máximo de escalas entre los itinerarios (ida o regreso)
+        'stops': max((len(itinerary.get('segments', [])) - 1 for itinerary in itineraries), default=0),
+        'duration': sum(parse_iso_duration(itinerary.get('duration')) for itinerary in itineraries),
+        'departure_at': departure_at,
+        'departure_time': departure_at[11:16]
+    }
+
+# Sesiones de búsqueda almacenadas en el servidor
+class SearchSessionStore:
+    """Guarda el conjunto de resultados de cada búsqueda bajo un identificador (search_id) para que
+    el cliente pueda paginar, ordenar y filtrar sin volver a descargar todas las ofertas.
+    Las sesiones expiran tras `ttl` segundos y se desalojan las más antiguas al superar `max_sessions`
+    o el tamaño aproximado (JSON) de `max_bytes`.
+    Las ofertas se guardan sin modificar, tal como las devolvió Amadeus, porque son las que se envían
+    a Flight Create Orders; el id con prefijo y los datos de fuente que ve el cliente en las búsquedas
+    combinadas se guardan aparte, en `display`."""
+
+    def __init__(self, ttl=1800, max_sessions=500, max_bytes=64 * 1024 * 1024):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self._sessions = OrderedDict()
+        self._total_bytes = 0
+        self._lock = threading.Lock()
+
+    def create(self, results, params=None, originals=None):
+        """`originals` son las ofertas de Amadeus sin modificar cuando results['data'] contiene copias
+        con otro id o campos añadidos (ej. sourceSystem); deben estar en el mismo orden"""
+        shown = results.get('data', [])
+        offers = shown if originals is None else originals
+        # Campos de cada copia que difieren de la oferta original (las copias son superficiales)
+        display = None
+        if originals is not None:
+            display = [
+                {key: value for key, value in copy.items() if offer.get(key) is not value}
+                for offer, copy in zip(offers, shown)
+            ]
+        carriers = results.get('dictionaries', {}).get('carriers', {})
+        summaries = [summarize_offer(offer) for offer in offers]
+
+        # Facetas precalculadas sobre el conjunto completo de resultados
+        airline_counts = {}
+        stop_counts = {}
+        for summary in summaries:
+            code = summary['carrier']
+            if code:
+                facet = airline_counts.setdefault(code, {'code': code, 'name': carriers.get(code, code), 'count': 0})
+                facet['count'] += 1
+            stop_counts[summary['stops']] = stop_counts.get(summary['stops'], 0) + 1
+        prices = [summary['price'] for summary in summaries]
+
+        session = {
+            'search_id': uuid.uuid4().hex,
+            'created_at': time.time(),
+            'params': params or {},
+            'offers': offers,
+            'display': display,
+            'offer_index': {offer.get('id'): index for index, offer in enumerate(shown)},
+            'carriers': carriers,
+            'summaries': summaries,
+            'facets': {
+                'airlines': sorted(airline_counts.values(), key=lambda facet: -facet['count']),
+                'stops': [{'stops': stops, 'count': count} for stops, count in sorted(stop_counts.items())],
+                'price': {'min': min(prices), 'max': max(prices)} if prices else {'min': None, 'max': None}
+            }
+        }
+
+        session['size'] = len(json.dumps([offers, display], separators=(',', ':')))
+
+        with self._lock:
+            self._sessions[session['search_id']] = session
+            self._total_bytes += session['size']
+            while len(self._sessions) > self.max_sessions or (self._total_bytes > self.max_bytes and len(self._sessions) > 1):
+                _, oldest = self._sessions.popitem(last=False)
+                self._total_bytes -= oldest['size']
+        return session
+
+    def get(self, search_id):
+        with self._lock:
+            session = self._sessions.get(search_id)
+            if session is None:
+                return None
+            if time.time() - session['created_at'] > self.ttl:
+                del self._sessions[search_id]
+                self._total_bytes -= session['size']
+                return None
+            return session
+
+    def get_offer(self, search_id, offer_id, display=False):
+        """Devuelve la oferta completa (tal como la envió Amadeus, o como la ve el cliente si `display`)
+        o None si no existe"""
+        session = self.get(search_id)
+        if session is None:
+            return None
+        index = session['offer_index'].get(offer_id)
+        if index is None:
+            return None
+        return display_offers(session, [index])[0] if display else session['offers'][index]
+
+    def stats(self):
+        with self._lock:
+            return {'sessions': len(self._sessions), 'bytes': self._total_bytes, 'max_bytes': self.max_bytes}
+
+
+# Ofertas de una sesión tal como las ve el cliente (con el id y los datos de fuente de la búsqueda)
+def display_offers(session, indexes=None):
+    offers = session['offers']
+    indexes = range(len(offers)) if indexes is None else indexes
+    display = session['display']
+    if display is None:
+        return [offers[index] for index in indexes]
+    return [dict(offers[index], **display[index]) for index in indexes]
+
+
+search_sessions = SearchSessionStore(
+    ttl=int(os.getenv('SEARCH_SESSION_TTL', '1800')),
+    max_sessions=int(os.getenv('SEARCH_SESSION_MAX', '500')),
+    max_bytes=int(os.getenv('SEARCH_SESSION_MAX_MB', '64')) * 1024 * 1024
+)
+
+# Campos de cada segmento incluidos en el formato compacto (en este orden)
+COMPACT_SEGMENT_FIELDS = [
+    'carrier', 'number', 'departure_iata', 'departure_at', 'arrival_iata', 'arrival_at', 'operating_carrier', 'duration',
+    'operating_carrier_name'
+]
+
+# Formato compacto de ofertas para reducir el tamaño de las respuestas
+def compact_flight_offers(offers, carriers=None):
+    """Convierte una lista de ofertas de Amadeus a un formato compacto: los segmentos y aerolíneas repetidos
+    se guardan una sola vez en tablas compartidas y cada oferta los referencia por índice. Solo se conservan
+    los campos que muestra la interfaz; la oferta completa sigue disponible en la sesión de búsqueda."""
+    carriers = carriers or {}
+    carrier_table = []
+    carrier_index = {}
+    segment_table = []
+    segment_index = {}
+
+    def intern_carrier(code):
+        if not code:
+            return -1
+        if code not in carrier_index:
+            carrier_index[code] = len(carrier_table)
+            carrier_table.append([code, carriers.get(code, code)])
+        return carrier_index[code]
+
+    compact_offers = []
+    for offer in offers:
+        itineraries = []
+        for itinerary in offer.get('itineraries', []):
+            refs = []
+            for segment in itinerary.get('segments', []):
+                departure = segment.get('departure', {})
+                arrival = segment.get('arrival', {})
+                row = (
+                    intern_carrier(segment.get('carrierCode')),
+                    segment.get('number', ''),
+                    departure.get('iataCode', ''),
+                    departure.get('at', ''),
+                    arrival.get('iataCode', ''),
+                    arrival.get('at', ''),
+                    intern_carrier(segment.get('operating', {}).get('carrierCode')),
+                    segment.get('duration', ''),
+                    segment.get('operating', {}).get('carrierName', '')
+                )
+                if row not in segment_index:
+                    segment_index[row] = len(segment_table)
+                    segment_table.append(list(row))
+                refs.append(segment_index[row])
+            itineraries.append([itinerary.get('duration', ''), refs])
+
+        price = offer.get('price', {})
+        compact_offers.append([offer.get('id'), price.get('total'), price.get('currency'), itineraries])
+
+    return {
+        'format': 'compact',
+        'carriers': carrier_table,
+        'segment_fields': COMPACT_SEGMENT_FIELDS,
+        'segments': segment_table,
+        'offer_fields': ['id', 'total', 'currency', 'itineraries'],
+        'offers': compact_offers
+    }
+
+# Reconstruye las ofertas (con los campos que usa la interfaz) a partir del formato compacto;
+# el resultado coincide con display_offers() en esos campos
+def expand_compact_offers(compact):
+    carriers = compact['carriers']
+    offers = []
+    for offer_id, total, currency, itineraries in compact['offers']:
+        expanded_itineraries = []
+        for duration, refs in itineraries:
+            segments = []
+            for ref in refs:
+                (carrier, number, dep_iata, dep_at, arr_iata, arr_at, operating, seg_duration,
+                 operating_name) = compact['segments'][ref]
+                segment = {
+                    'departure': {'iataCode': dep_iata, 'at': dep_at},
+                    'arrival': {'iataCode': arr_iata, 'at': arr_at},
+                    'carrierCode': carriers[carrier][0] if carrier >= 0 else '',
+                    'number': number,
+                    'duration': seg_duration
+                }
+                if operating >= 0 or operating_name:
+                    segment['operating'] = {}
+                    if operating >= 0:
+                        segment['operating']['carrierCode'] = carriers[operating][0]
+                    if operating_name:
+                        segment['operating']['carrierName'] = operating_name
+                segments.append(segment)
+            expanded_itineraries.append({'duration': duration, 'segments': segments})
+        offers.append({
+            'id': offer_id,
+            'price': {'total': total, 'currency': currency},
+            'itineraries': expanded_itineraries
+        })
+    return offers
+
+# Criterios de ordenación disponibles para las sesiones de búsqueda
+SEARCH_SORT_KEYS = {
+    'price': lambda summary: summary['price'],
+    'duration': lambda summary: summary['duration'],
+    'departure': lambda summary: summary['departure_at'],
+    'stops': lambda summary: (summary['stops'], summary['price'])
+}
+
+# Devuelve una página de una sesión de búsqueda aplicando filtros y ordenación
+def query_search_session(session, page=1, page_size=10, sort='price', order='asc', airlines=None,
+                         max_stops=None, min_price=None, max_price=None, departure_from=None, departure_to=None):
+    airlines = {code.strip().upper() for code in airlines if code.strip()} if airlines else None
+
+    indexes = []
+    for index, summary in enumerate(session['summaries']):
+        if airlines and summary['carrier'] not in airlines:
+            continue
+        if max_stops is not None and summary['stops'] > max_stops:
+            continue
+        if min_price is not None and summary['price'] < min_price:
+            continue
+        if max_price is not None and summary['price'] > max_price:
+            continue
+        # Ventana horaria de salida en formato HH:MM
+        if departure_from and summary['departure_time'] < departure_from:
+            continue
+        if departure_to and summary['departure_time'] > departure_to:
+            continue
+        indexes.append(index)
+
+    sort_key = SEARCH_SORT_KEYS.get(sort, SEARCH_SORT_KEYS['price'])
+    indexes.sort(key=lambda index: sort_key(session['summaries'][index]), reverse=(order == 'desc'))
+
+    page_size = max(1, min(page_size, 100))
+    total = len(indexes)
+    pages = (total + page_size - 1) // page_size
+    page = max(1, page)
+    start = (page - 1) * page_size
+
+    return {
+        'search_id': session['search_id'],
+        'total': total,
+        'total_unfiltered': len(session['offers']),
+        'page': page,
+        'page_size': page_size,
+        'pages': pages,
+        'offers': display_offers(session, indexes[start:start + page_size]),
+        'facets': session['facets']
+    }
+
+@app.route('/', methods=['GET'])
+def index():
+    return render_template('index.html')
+
+# Ruta para continuar una reserva desde una URL compartida
+@app.route('/quick_search')
+def quick_search():
+    # Obtener parámetros de la URL
+    origin = request.args.get('origin', '')
+    destination = request.args.get('destination', '')
+    departure_date = request.args.get('departure_date', '')
+    return_date = request.args.get('return_date', '')
+    trip_type = request.args.get('trip_type', 'roundtrip')
+    adults = request.args.get('adults', '1')
+    children = request.args.get('children', '0')
+    infants = request.args.get('infants', '0')
+    
+    # Pasar los parámetros a la plantilla
+    return render_template(
+        'index.html',
+        prefill={
+            'origin': origin,
+            'destination': destination,
+            'departure_date': departure_date,
+            'return_date': return_date,
+            'trip_type': trip_type,
+            'adults': adults,
+            'children': children,
+            'infants': infants,
+            'auto_search': 'true' if all([origin, destination, departure_date]) else 'false'
+        }
+    )
+
+# Ruta para buscar reservas por PNR
+@app.route('/find_booking', methods=['POST'])
+def find_booking():
     try:
         # Obtener el PNR de la solicitud
         pnr = request.form.get('pnr', '').strip().upper()
@@ -300,76 +2260,32 @@ def find_booking():
         if not pnr:
             return jsonify({"success": False, "error": "Por favor, ingresa un código PNR válido."})
         
-        # Buscar la reserva en la base de datos
-        booking = Booking.query.filter_by(pnr=pnr).first()
+        # Buscar la reserva (desde la caché si se consultó hace poco)
+        view = get_booking_view(pnr)
         
-        if not booking:
+        if not view:
             return jsonify({"success": False, "error": "No se encontró ninguna reserva con ese código PNR."})
         
-        # Extraer información de vuelo del flight_id
-        flight_segments = booking.flight_id.split('-')
-        origin = flight_segments[0] if len(flight_segments) > 0 else ''
-        destination = flight_segments[1] if len(flight_segments) > 1 else ''
-        
-        # Convertir los datos de pasajeros de JSON a diccionario
-        try:
-            print(f"Tipo de passenger_data: {type(booking.passenger_data)}")
-            print(f"Valor de passenger_data: {booking.passenger_data}")
-            
-            if isinstance(booking.passenger_data, str):
-                passenger_data = json.loads(booking.passenger_data)
-            else:
-                passenger_data = booking.passenger_data
-            
-            # Extraer los pasajeros del diccionario si es necesario
-            all_passengers = []
-            if isinstance(passenger_data, dict):
-                # Si es un diccionario, extraer todos los tipos de pasajeros
-                if 'adults' in passenger_data and isinstance(passenger_data['adults'], list):
-                    for adult in passenger_data['adults']:
-                        adult['type'] = 'ADT'  # Asegurar que el tipo sea ADT
-                        all_passengers.append(adult)
-                
-                if 'children' in passenger_data and isinstance(passenger_data['children'], list):
-                    for child in passenger_data['children']:
-                        child['type'] = 'CHD'  # Asegurar que el tipo sea CHD
-                        all_passengers.append(child)
-                
-                if 'infants' in passenger_data and isinstance(passenger_data['infants'], list):
-                    for infant in passenger_data['infants']:
-                        infant['type'] = 'INF'  # Asegurar que el tipo sea INF
-                        all_passengers.append(infant)
-                
-                # Usar la lista combinada
-                passenger_data = all_passengers
-            elif not isinstance(passenger_data, list):
-                passenger_data = []
-            
-            print(f"Datos de pasajeros procesados: {passenger_data}")
-        except Exception as e:
-            print(f"Error al procesar datos de pasajeros: {str(e)}")
-            passenger_data = []
-        
         # Preparar la respuesta
         response_data = {
             "success": True,
-            "booking_id": booking.id,
-            "pnr": booking.pnr,
+            "booking_id": view['booking_id'],
+            "pnr": view['pnr'],
             "details": {
-                "pnr": booking.pnr,
-                "flight_id": booking.flight_id,
-                "origin": origin,
-                "destination": destination,
-                "fare_type": booking.fare_type,
-                "fare_price": booking.fare_price,
-                "currency": booking.currency,
-                "service_fee": booking.service_fee,
-                "service_fee_currency": booking.service_fee_currency,
-                "total_price": booking.total_price,
-                "booking_id": booking.id,
-                "status": booking.status,
-                "created_at": booking.created_at.strftime("%Y-%m-%d %H:%M:%S") if booking.created_at else "",
-                "passengers": passenger_data
+                "pnr": view['pnr'],
+                "flight_id": view['flight_id'],
+                "origin": view['origin'],
+                "destination": view['destination'],
+                "fare_type": view['fare_type'],
+                "fare_price": view['fare_price'],
+                "currency": view['currency'],
+                "service_fee": view['service_fee'],
+                "service_fee_currency": view['service_fee_currency'],
+                "total_price": view['total_price'],
+                "booking_id": view['booking_id'],
+                "status": view['status'],
+                "created_at": view['created_at'],
+                "passengers": view['passengers']
             }
         }
         
@@ -395,55 +2311,15 @@ def send_booking_email():
         if not pnr or not email:
             return jsonify({"success": False, "error": "Por favor, proporciona un PNR y un email válidos."})
         
-        # Buscar la reserva en la base de datos
-        booking = Booking.query.filter_by(pnr=pnr).first()
+        # Buscar la reserva (desde la caché si se consultó hace poco)
+        booking = get_booking_view(pnr)
         
         if not booking:
             return jsonify({"success": False, "error": "No se encontró ninguna reserva con ese código PNR."})
         
-        # Extraer información de vuelo del flight_id
-        flight_segments = booking.flight_id.split('-')
-        origin = flight_segments[0] if len(flight_segments) > 0 else ''
-        destination = flight_segments[1] if len(flight_segments) > 1 else ''
-        
-        # Convertir los datos de pasajeros de JSON a diccionario
-        try:
-            print(f"Tipo de passenger_data: {type(booking.passenger_data)}")
-            print(f"Valor de passenger_data: {booking.passenger_data}")
-            
-            if isinstance(booking.passenger_data, str):
-                passenger_data = json.loads(booking.passenger_data)
-            else:
-                passenger_data = booking.passenger_data
-            
-            # Extraer los pasajeros del diccionario si es necesario
-            all_passengers = []
-            if isinstance(passenger_data, dict):
-                # Si es un diccionario, extraer todos los tipos de pasajeros
-                if 'adults' in passenger_data and isinstance(passenger_data['adults'], list):
-                    for adult in passenger_data['adults']:
-                        adult['type'] = 'ADT'  # Asegurar que el tipo sea ADT
-                        all_passengers.append(adult)
-                
-                if 'children' in passenger_data and isinstance(passenger_data['children'], list):
-                    for child in passenger_data['children']:
-                        child['type'] = 'CHD'  # Asegurar que el tipo sea CHD
-                        all_passengers.append(child)
-                
-                if 'infants' in passenger_data and isinstance(passenger_data['infants'], list):
-                    for infant in passenger_data['infants']:
-                        infant['type'] = 'INF'  # Asegurar que el tipo sea INF
-                        all_passengers.append(infant)
-                
-                # Usar la lista combinada
-                passenger_data = all_passengers
-            elif not isinstance(passenger_data, list):
-                passenger_data = []
-            
-            print(f"Datos de pasajeros procesados: {passenger_data}")
-        except Exception as e:
-            print(f"Error al procesar datos de pasajeros: {str(e)}")
-            passenger_data = []
+        origin = booking['origin']
+        destination = booking['destination']
+        passenger_data = booking['passengers']
         
         # Crear el mensaje de correo electrónico
         subject = f"Confirmación de Reserva - PNR: {pnr}"
@@ -509,27 +2385,27 @@ def send_booking_email():
                             </tr>
                             <tr>
                                 <th>Tipo de Tarifa</th>
-                                <td>{booking.fare_type}</td>
+                                <td>{booking['fare_type']}</td>
                             </tr>
                             <tr>
                                 <th>Precio</th>
-                                <td>{booking.fare_price} {booking.currency}</td>
+                                <td>{booking['fare_price']} {booking['currency']}</td>
                             </tr>
                             <tr>
                                 <th>Cargo por Servicio</th>
-                                <td>{booking.service_fee} {booking.service_fee_currency}</td>
+                                <td>{booking['service_fee']} {booking['service_fee_currency']}</td>
                             </tr>
                             <tr>
                                 <th>Precio Total</th>
-                                <td><strong>{booking.total_price} {booking.currency}</strong></td>
+                                <td><strong>{booking['total_price']} {booking['currency']}</strong></td>
                             </tr>
                             <tr>
                                 <th>Estado</th>
-                                <td>{booking.status}</td>
+                                <td>{booking['status']}</td>
                             </tr>
                             <tr>
                                 <th>Fecha de Creación</th>
-                                <td>{booking.created_at.strftime("%Y-%m-%d %H:%M:%S") if booking.created_at else ""}</td>
+                                <td>{booking['created_at']}</td>
                             </tr>
                         </table>
                     </div>
@@ -558,28 +2434,9 @@ def send_booking_email():
             else:
                 # Procesar cada pasajero
                 for passenger in passenger_data:
-                    # Verificar si passenger es un diccionario
-                    if isinstance(passenger, dict):
-                        first_name = passenger.get('firstName', '')
-                        last_name = passenger.get('lastName', '')
-                        passenger_type = passenger.get('type', '')
-                    else:
-                        # Si no es un diccionario, intentar convertirlo o usar valores predeterminados
-                        try:
-                            if isinstance(passenger, str):
-                                passenger_dict = json.loads(passenger)
-                                first_name = passenger_dict.get('firstName', '')
-                                last_name = passenger_dict.get('lastName', '')
-                                passenger_type = passenger_dict.get('type', '')
-                            else:
-                                first_name = ''
-                                last_name = ''
-                                passenger_type = ''
-                        except Exception as e:
-                            print(f"Error al procesar datos de pasajero: {str(e)}")
-                            first_name = ''
-                            last_name = ''
-                            passenger_type = ''
+                    first_name = passenger.get('firstName', '')
+                    last_name = passenger.get('lastName', '')
+                    passenger_type = passenger.get('type', '')
                     
                     # Traducir el tipo de pasajero a un formato más legible
                     print(f"Tipo de pasajero antes de traducir: '{passenger_type}'")
@@ -696,7 +2553,7 @@ def autocomplete_airport():
             })
         
         # Buscar aeropuertos que coincidan con el término de búsqueda
-        airports = search_airports(keyword)
+        airports = autocomplete_airports(keyword)
         
         # Devolver los resultados
         return jsonify({
@@ -711,66 +2568,593 @@ def autocomplete_airport():
             'data': []
         }), 500
 
-@app.route('/search_flights', methods=['POST'])
-def search():
+# Ejecuta fn(item) para cada elemento en el pool de búsquedas limitando cuántos hay en curso a la vez
+def run_bounded(fn, items, max_concurrency, timeout=None):
+    """Devuelve una lista de (resultado, error) en el mismo orden que `items`. Los elementos que no
+    terminan antes de `timeout` segundos (o que no llegaron a empezar) se devuelven con TimeoutError."""
+    items = list(items)
+    outcomes = [None] * len(items)
+    # Nunca esperar más que el tiempo que le queda a la solicitud entrante
+    remaining = deadline_remaining()
+    if remaining is not None:
+        timeout = max(0.001, min(timeout, remaining) if timeout else remaining)
+    deadline = time.monotonic() + timeout if timeout else None
+    pending = {}
+    queue = iter(enumerate(items))
+
+    def submit_next():
+        for index, item in queue:
+            # Copiar el contexto para que el tiempo límite y la prioridad de la solicitud lleguen a cada búsqueda
+            pending[search_executor.submit(contextvars.copy_context().run, fn, item)] = index
+            return
+
+    for _ in range(max(1, max_concurrency)):
+        submit_next()
+
+    while pending:
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            break
+        done, _ = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            index = pending.pop(future)
+            try:
+                outcomes[index] = (future.result(), None)
+            except Exception as e:
+                outcomes[index] = (None, e)
+            submit_next()
+
+    # Lo que quedó en curso o sin empezar cuando se agotó el tiempo
+    for future, index in pending.items():
+        future.cancel()
+        outcomes[index] = (None, TimeoutError("Tiempo de espera agotado"))
+    for index, _ in queue:
+        outcomes[index] = (None, TimeoutError("Tiempo de espera agotado"))
+    return outcomes
+
+# Firma de un itinerario para detectar la misma combinación de vuelos ofrecida por distintas fuentes
+def itinerary_signature(offer):
+    return tuple(
+        tuple(
+            (
+                segment.get('carrierCode'),
+                segment.get('number'),
+                segment.get('departure', {}).get('iataCode'),
+                segment.get('departure', {}).get('at'),
+                segment.get('arrival', {}).get('iataCode'),
+                segment.get('arrival', {}).get('at')
+            )
+            for segment in itinerary.get('segments', [])
+        )
+        for itinerary in offer.get('itineraries', [])
+    )
+
+# Búsqueda simultánea en varios sistemas de distribución (GDS, NDC, EDIFACT)
+def search_flights_multi_source(sources, **search_params):
+    """Consulta varias fuentes en paralelo (la latencia total es la de la fuente más lenta) y combina los
+    resultados: los itinerarios duplicados se reducen a la tarifa más barata, indicando en `sourceSystem`
+    de qué fuente proviene y en `otherSources` el precio en las demás. Devuelve (resultados, info_caché,
+    originales): las ofertas de los resultados son copias con el id prefijado con la fuente y
+    `originales` son las mismas ofertas sin modificar, en el mismo orden, para guardarlas en la sesión."""
+    search_params = dict(search_params)
+    search_params.pop('source_system', None)
+    # Copiar el contexto para que la prioridad y el tiempo límite de la solicitud lleguen a cada fuente
+    futures = {
+        source: search_executor.submit(contextvars.copy_context().run, search_flights_cached, source_system=source, **search_params)
+        for source in sources
+    }
+
+    best = {}
+    carriers = {}
+    source_meta = {}
+    first_error = None
+    for source, future in futures.items():
+        try:
+            # No esperar más allá del tiempo límite de la solicitud
+            results, cache_info = future.result(timeout=deadline_remaining())
+        except Exception as e:
+            print(f"Error searching flights in source {source}: {str(e)}")
+            source_meta[source] = {'success': False, 'error': 'Error al buscar vuelos en esta fuente'}
+            first_error = first_error or e
+            continue
+
+        offers = results.get('data', [])
+        source_meta[source] = {'success': True, 'count': len(offers), 'cache': cache_info}
+        carriers.update(results.get('dictionaries', {}).get('carriers', {}))
+
+        for offer in offers:
+            price = summarize_offer(offer)['price']
+            signature = itinerary_signature(offer)
+            current = best.get(signature)
+            candidate = (price, source, offer)
+            if current is None:
+                best[signature] = (candidate, [])
+            elif price < current[0][0]:
+                best[signature] = (candidate, current[1] + [current[0]])
+            else:
+                current[1].append(candidate)
+
+    if not any(meta['success'] for meta in source_meta.values()):
+        raise first_error
+
+    merged = []
+    for (price, source, offer), others in best.values():
+        shown = dict(
+            offer,
+            id=f"{source}-{offer.get('id')}",
+            sourceSystem=source,
+            otherSources=[
+                {'sourceSystem': other_source, 'total': other.get('price', {}).get('total')}
+                for _, other_source, other in others
+            ]
+        )
+        merged.append((price, offer, shown))
+    merged.sort(key=lambda item: item[0])
+
+    cache_infos = [meta['cache'] for meta in source_meta.values() if meta['success']]
+    cache_info = {
+        'hit': all(info['hit'] for info in cache_infos),
+        'age_seconds': max(info['age_seconds'] for info in cache_infos)
+    }
+    results = {
+        'meta': {'count': len(merged), 'sources': source_meta},
+        'data': [shown for _, _, shown in merged],
+        'dictionaries': {'carriers': carriers}
+    }
+    return results, cache_info, [offer for _, offer, _ in merged]
+
+# Búsqueda progresiva: consulta cada grupo regional de aerolíneas en paralelo y emite los resultados a medida que llegan
+def stream_flight_search(search_params, timeout=60):
+    """Generador de eventos de búsqueda progresiva:
+    - start: grupos de aerolíneas que se van a consultar
+    - batch: ofertas de un grupo en cuanto Amadeus responde (los ids se prefijan con el grupo para que sean únicos)
+    - batch_error: un grupo falló o excedió el tiempo máximo; los demás continúan
+    - complete: ids de todas las ofertas ordenadas por precio y el search_id de la sesión con los resultados combinados
+    Si el cliente se desconecta, el generador se cierra y se cancelan los grupos que aún no han empezado
+    (también los que ya estaban en la cola del executor). Las llamadas a Amadeus en curso no se interrumpen:
+    terminan como muy tarde en el tiempo límite y su resultado queda en la caché de búsquedas.
+    La respuesta se genera cuando la solicitud ya terminó (y con ella su tiempo límite), así que cada
+    grupo usa como tiempo límite de sus llamadas a Amadeus el de la búsqueda progresiva (`timeout`)."""
+    source_system = search_params.get('source_system', 'GDS')
+    deadline = time.monotonic() + timeout
+    cancelled = threading.Event()
+
+    def search_group(codes):
+        # Future.cancel() no afecta a las tareas que el executor ya ha empezado a ejecutar
+        if cancelled.is_set():
+            raise CancelledError("Búsqueda progresiva cancelada")
+        amadeus_deadline.set(deadline)
+        return search_flights_cached(airlines=codes, **search_params)
+
+    futures = {
+        search_executor.submit(contextvars.copy_context().run, search_group, codes): group
+        for group, codes in AIRLINE_GROUPS.items()
+    }
+    # (oferta original, copia con el id prefijado que se envía al cliente)
+    merged_offers = []
+    carriers = {}
+
     try:
-        origin = request.form.get('origin', '').strip()
-        destination = request.form.get('destination', '').strip()
-        departure_date = request.form.get('departure_date', '').strip()
-        return_date = request.form.get('return_date', '').strip()
-        adults = request.form.get('adults', 1)
-        children = request.form.get('children', 0)
-        infants = request.form.get('infants', 0)
-        
-        # Parámetros adicionales
-        source_system = request.form.get('sourceSystem', 'GDS')  # Tipo de distribución
-
-        # Validaciones
-        if not origin or not destination:
-            return jsonify({"error": "El origen y destino son requeridos"}), 400
-        if not departure_date:
-            return jsonify({"error": "La fecha de salida es requerida"}), 400
-        if len(origin) != 3 or len(destination) != 3:
-            return jsonify({"error": "Los códigos de aeropuerto deben tener 3 letras"}), 400
-        if origin == destination:
-            return jsonify({"error": "El origen y destino no pueden ser iguales"}), 400
-        
-        # Validación de pasajeros
+        yield {'event': 'start', 'groups': list(AIRLINE_GROUPS), 'source_system': source_system}
+
         try:
-            adults_count = int(adults)
-            if adults_count < 1:
-                return jsonify({"error": "Debe haber al menos 1 pasajero adulto"}), 400
-        except ValueError:
-            return jsonify({"error": "El número de adultos debe ser un valor numérico"}), 400
-            
+            for future in as_completed(futures, timeout=max(0, deadline - time.monotonic())):
+                group = futures[future]
+                try:
+                    results, cache_info = future.result()
+                except Exception as e:
+                    print(f"Error searching flights for group {group}: {str(e)}")
+                    yield {'event': 'batch_error', 'group': group, 'error': 'Error al buscar vuelos de este grupo de aerolíneas'}
+                    continue
 
+                offers = [dict(offer, id=f"{group}-{offer.get('id')}") for offer in results.get('data', [])]
+                group_carriers = results.get('dictionaries', {}).get('carriers', {})
+                merged_offers.extend(zip(results.get('data', []), offers))
+                carriers.update(group_carriers)
+                yield {
+                    'event': 'batch',
+                    'group': group,
+                    'count': len(offers),
+                    'data': offers,
+                    'dictionaries': {'carriers': group_carriers},
+                    'cache': cache_info
+                }
+        except FuturesTimeoutError:
+            for future, group in futures.items():
+                if not future.done():
+                    yield {'event': 'batch_error', 'group': group, 'error': 'Tiempo de espera agotado'}
 
-        results = search_flights(origin, destination, departure_date, return_date, adults, children, infants, source_system)
-        return jsonify(results)
-    except Exception as e:
-        print(f"Error in search endpoint: {str(e)}")
-        return jsonify({"error": "Error al buscar vuelos. Por favor, verifica los datos e intenta nuevamente."}), 500
+        merged_offers.sort(key=lambda pair: summarize_offer(pair[0])['price'])
+        session = search_sessions.create(
+            {'data': [shown for _, shown in merged_offers], 'dictionaries': {'carriers': carriers}},
+            params=search_params,
+            originals=[offer for offer, _ in merged_offers]
+        )
+        yield {
+            'event': 'complete',
+            'count': len(merged_offers),
+            'search_id': session['search_id'],
+            'offer_ids': [shown['id'] for _, shown in merged_offers]
+        }
+    finally:
+        # Cancelar los grupos pendientes (por ejemplo, si el cliente cerró la conexión)
+        cancelled.set()
+        for future in futures:
+            future.cancel()
 
-# Función para crear una reserva real en Amadeus
-def create_amadeus_booking(flight_offer, passenger_data, contact_info):
-    """Crea una reserva real en Amadeus usando la API de Flight Create Orders
-    En modo de prueba, simula una respuesta exitosa para evitar errores de la API"""
+# Serializa un evento de búsqueda progresiva como Server-Sent Event o como línea NDJSON
+def format_stream_event(event, sse=False):
+    payload = json.dumps(event, separators=(',', ':'))
+    if sse:
+        return f"event: {event['event']}\ndata: {payload}\n\n"
+    return payload + "\n"
+
+# Lee y valida los parámetros del formulario de búsqueda
+def parse_search_form(form):
+    """Devuelve (parámetros para search_flights, mensaje de error). Si hay error, los parámetros son None."""
+    origin = form.get('origin', '').strip()
+    destination = form.get('destination', '').strip()
+    departure_date = form.get('departure_date', '').strip()
+    return_date = form.get('return_date', '').strip()
+    adults = form.get('adults', 1)
+    children = form.get('children', 0)
+    infants = form.get('infants', 0)
+    
+    trip_type = form.get('trip_type', 'roundtrip').lower()
+    
+    # Parámetros adicionales
+    source_system = form.get('sourceSystem', 'GDS')  # Tipo de distribución
+
+    # Validaciones
+    if not origin or not destination:
+        return None, "El origen y destino son requeridos"
+    if not departure_date:
+        return None, "La fecha de salida es requerida"
+    if len(origin) != 3 or len(destination) != 3:
+        return None, "Los códigos de aeropuerto deben tener 3 letras"
+    if origin == destination:
+        return None, "El origen y destino no pueden ser iguales"
+    
+    # Validación de pasajeros
     try:
-        # Verificar el entorno y modo de prueba
-        app_env = os.getenv('APP_ENV', 'development')
-        test_mode = os.getenv('AMADEUS_TEST_MODE', 'false').lower() == 'true'
+        adults_count = int(adults)
+        if adults_count < 1:
+            return None, "Debe haber al menos 1 pasajero adulto"
+    except ValueError:
+        return None, "El número de adultos debe ser un valor numérico"
+    
+    return {
+        'origin': origin,
+        'destination': destination,
+        'departure_date': departure_date,
+        'return_date': return_date,
+        'adults': adults,
+        'children': children,
+        'infants': infants,
+        'source_system': source_system,
+        'trip_type': trip_type
+    }, None
+
+@app.route('/search_flights', methods=['POST'])
+def search():
+    try:
+        search_params, error = parse_search_form(request.form)
+        if error:
+            return jsonify({"error": error}), 400
         
-        if test_mode:
-            print("Ejecutando en modo de prueba: simulando respuesta de Amadeus")
-            # Generar un PNR aleatorio para pruebas
-            import random
-            import string
-            # Excluir caracteres confusos: I, O, 0, 1
-            chars = [c for c in string.ascii_uppercase + string.digits if c not in ['I', 'O', '0', '1']]
-            pnr = ''.join(random.choice(chars) for _ in range(6))
+        # Búsqueda simultánea en varias fuentes (ej. sourceSystems=NDC,EDIFACT)
+        source_systems = [source.strip() for source in request.form.get('sourceSystems', '').split(',') if source.strip()]
+        originals = None
+        if len(source_systems) > 1:
+            results, cache_info, originals = search_flights_multi_source(source_systems, **search_params)
+        else:
+            results, cache_info = search_flights_cached(**search_params)
+        
+        view = request.form.get('view')
+        response_format = request.form.get('format')
+        
+        if view == 'paged' or response_format == 'compact':
+            # Guardar los resultados completos en el servidor para paginar o recuperar ofertas completas
+            session = search_sessions.create(results, params=search_params, originals=originals)
             
-            # Simular una respuesta exitosa
-            booking_id = f"FL-{pnr}-{int(time.time())}"
+            # Vista paginada: devolver solo la primera página
+            if view == 'paged':
+                page_size = request.form.get('page_size', 10, type=int)
+                page_data = query_search_session(session, page=1, page_size=page_size)
+                if response_format == 'compact':
+                    page_data.update(compact_flight_offers(page_data.pop('offers'), session['carriers']))
+                    return jsonify(dict(page_data, cache=cache_info))
+                return jsonify(dict(page_data, dictionaries=results.get('dictionaries', {}), cache=cache_info))
+            
+            compact = compact_flight_offers(display_offers(session), session['carriers'])
+            return jsonify(dict(compact, search_id=session['search_id'], cache=cache_info))
+        
+        # Guardar las ofertas en el servidor para que /create_booking reserve la oferta real
+        session = search_sessions.create(results, params=search_params, originals=originals)
+        return jsonify(dict(results, cache=cache_info, search_id=session['search_id']))
+    except Exception as e:
+        print(f"Error in search endpoint: {str(e)}")
+        return jsonify({"error": "Error al buscar vuelos. Por favor, verifica los datos e intenta nuevamente."}), 500
+
+# Ruta para la búsqueda progresiva (NDJSON por defecto, o Server-Sent Events si el cliente lo solicita)
+@app.route('/search_flights_stream', methods=['POST'])
+def search_stream():
+    search_params, error = parse_search_form(request.form)
+    if error:
+        return jsonify({"error": error}), 400
+    
+    sse = 'text/event-stream' in request.headers.get('Accept', '')
+    # El tiempo límite de la solicitud (REQUEST_BUDGET_STREAM) se fija ahora: los eventos se generan después
+    timeout = float(os.getenv('SEARCH_STREAM_TIMEOUT', '60'))
+    remaining = deadline_remaining()
+    if remaining is not None:
+        timeout = min(timeout, max(0, remaining))
+    
+    def generate():
+        for chunk in stream_flight_search(search_params, timeout=timeout):
+            yield format_stream_event(chunk, sse)
+    
+    return Response(
+        generate(),
+        mimetype='text/event-stream' if sse else 'application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+# Ruta para paginar, ordenar y filtrar los resultados de una búsqueda guardada en el servidor
+@app.route('/api/search/<search_id>/offers', methods=['GET'])
+def search_session_offers(search_id):
+    session = search_sessions.get(search_id)
+    if session is None:
+        return jsonify({
+            'success': False,
+            'message': 'La búsqueda no existe o ha expirado. Por favor, realiza una nueva búsqueda.'
+        }), 404
+    
+    try:
+        airlines = request.args.get('airlines', '')
+        page_data = query_search_session(
+            session,
+            page=request.args.get('page', 1, type=int),
+            page_size=request.args.get('page_size', 10, type=int),
+            sort=request.args.get('sort', 'price'),
+            order=request.args.get('order', 'asc').lower(),
+            airlines=airlines.split(',') if airlines else None,
+            max_stops=request.args.get('max_stops', type=int),
+            min_price=request.args.get('min_price', type=float),
+            max_price=request.args.get('max_price', type=float),
+            departure_from=request.args.get('departure_from'),
+            departure_to=request.args.get('departure_to')
+        )
+        if request.args.get('format') == 'compact':
+            page_data.update(compact_flight_offers(page_data.pop('offers'), session['carriers']))
+        return jsonify(dict(page_data, success=True))
+    except Exception as e:
+        print(f"Error in search session endpoint: {str(e)}")
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+# Ruta para recuperar la oferta completa (sin compactar) de una búsqueda guardada
+@app.route('/api/search/<search_id>/offers/<offer_id>', methods=['GET'])
+def search_session_offer(search_id, offer_id):
+    offer = search_sessions.get_offer(search_id, offer_id, display=True)
+    if offer is None:
+        return jsonify({
+            'success': False,
+            'message': 'La oferta no existe o la búsqueda ha expirado.'
+        }), 404
+    
+    return jsonify({
+        'success': True,
+        'offer': offer
+    })
+
+# Caché de ofertas revalidadas con Flight Offers Price, por (search_id, id de oferta)
+pricing_cache = SearchResultCache(
+    ttl=int(os.getenv('PRICING_CACHE_TTL', '300')),
+    max_bytes=int(os.getenv('PRICING_CACHE_MAX_MB', '8')) * 1024 * 1024
+)
+
+# Confirma precio y disponibilidad de una oferta antes de reservarla (Flight Offers Price)
+def price_flight_offer(search_id, offer_id, flight_offer):
+    """Devuelve la oferta tal como la devuelve Flight Offers Price (precio actualizado).
+    El resultado se guarda unos minutos para que reintentos de la misma reserva no repitan la llamada.
+    `offer_id` es el id de la oferta en la sesión: en búsquedas combinadas, varias ofertas originales
+    pueden compartir el mismo id de Amadeus."""
+    key = (search_id, offer_id)
+    cached = pricing_cache.get(key)
+    if cached is not None:
+        return cached[0]
+
+    payload = {
+        "data": {
+            "type": "flight-offers-pricing",
+            "flightOffers": [flight_offer]
+        }
+    }
+    response = amadeus_client.post(
+        "/v1/shopping/flight-offers/pricing", operation="pricing",
+        headers={"Content-Type": "application/json"}, json=payload
+    )
+    try:
+        response.raise_for_status()
+    except Exception as e:
+        print(f"Error pricing flight offer: {str(e)}")
+        print(f"Response content: {response.text}")
+        raise
+    priced_offer = response.json()['data']['flightOffers'][0]
+    pricing_cache.set(key, priced_offer)
+    return priced_offer
+
+# Tarifas que ofrece la interfaz y su precio respecto al de la oferta de Amadeus (ver templates/index.html)
+FARE_TYPE_MULTIPLIERS = {'Básica': 0.75, 'Estándar': 1.0, 'Familiar': 1.25}
+
+# Precio de la tarifa elegida calculado a partir de la oferta (nunca del precio que envía el cliente)
+def fare_price_for(flight_offer, fare_type):
+    """Devuelve (precio, moneda). Lanza ValueError si la tarifa no existe. Las tarifas distintas de la
+    estándar se redondean a unidades, igual que las muestra la interfaz (Math.round)."""
+    multiplier = FARE_TYPE_MULTIPLIERS.get(fare_type)
+    if multiplier is None:
+        raise ValueError(f"Tipo de tarifa no válido: {fare_type}")
+    price = flight_offer.get('price', {})
+    total = float(price['total'])
+    if multiplier != 1:
+        total = float(int(total * multiplier + 0.5))
+    return total, price.get('currency', 'EUR')
+
+# Referencia de vuelo que se guarda en Booking.flight_id: ORIGEN-DESTINO-VUELO (ej. MEX-CUN-AM500)
+def flight_reference(flight_offer):
+    segments = flight_offer['itineraries'][0]['segments']
+    first_segment, last_segment = segments[0], segments[-1]
+    return f"{first_segment['departure']['iataCode']}-{last_segment['arrival']['iataCode']}-{first_segment['carrierCode']}{first_segment['number']}"
+
+# Idempotencia de /create_booking: una solicitud repetida con la misma Idempotency-Key
+# devuelve la respuesta de la primera sin volver a llamar a Amadeus ni crear otra reserva
+IDEMPOTENCY_KEY_TTL = int(os.getenv('IDEMPOTENCY_KEY_TTL', '86400'))  # segundos que se conserva la respuesta
+IDEMPOTENCY_WAIT_TIMEOUT = float(os.getenv('IDEMPOTENCY_WAIT_TIMEOUT', '60'))  # espera máxima a una solicitud en curso
+# Una solicitud en curso más antigua que esto se considera abandonada (por ejemplo, el proceso se reinició).
+# Por defecto, el doble del tiempo máximo de /create_booking: una reserva lenta pero viva nunca lo supera
+IDEMPOTENCY_LOCK_TIMEOUT = float(os.getenv('IDEMPOTENCY_LOCK_TIMEOUT') or 2 * REQUEST_BUDGETS['create_booking'])
+IDEMPOTENCY_POLL_INTERVAL = 0.1
+IDEMPOTENCY_CLEANUP_INTERVAL = 300
+_idempotency_last_cleanup = 0.0
+
+class IdempotencyConflict(Exception):
+    def __init__(self, message, status_code):
+        super().__init__(message)
+        self.status_code = status_code
+
+def idempotency_request_hash():
+    payload = json.dumps([request.path, sorted(request.form.items(multi=True))], separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+def purge_expired_idempotency_keys():
+    global _idempotency_last_cleanup
+    now = time.monotonic()
+    if now - _idempotency_last_cleanup < IDEMPOTENCY_CLEANUP_INTERVAL:
+        return
+    _idempotency_last_cleanup = now
+    IdempotencyKey.query.filter(IdempotencyKey.expires_at < datetime.utcnow()).delete(synchronize_session=False)
+    db.session.commit()
+
+def claim_idempotency_key(key, request_hash):
+    """Registra la clave como en curso. Devuelve None si esta solicitud debe ejecutarse, o la fila
+    completada cuya respuesta hay que devolver. Si otra solicitud con la misma clave está en curso,
+    espera a que termine (hasta IDEMPOTENCY_WAIT_TIMEOUT)."""
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_TIMEOUT
+    while True:
+        now = datetime.utcnow()
+        try:
+            db.session.execute(db.insert(IdempotencyKey).values(
+                key=key, request_hash=request_hash, expires_at=now + timedelta(seconds=IDEMPOTENCY_KEY_TTL)
+            ))
+            db.session.commit()
+            return None
+        except IntegrityError:
+            db.session.rollback()
+        
+        record = db.session.get(IdempotencyKey, key, populate_existing=True)
+        if record is None:
+            continue
+        if record.expires_at < now or (
+            record.status == 'IN_PROGRESS' and record.created_at < now - timedelta(seconds=IDEMPOTENCY_LOCK_TIMEOUT)
+        ):
+            # Clave caducada o abandonada: se elimina y se vuelve a reclamar
+            IdempotencyKey.query.filter_by(key=key, status=record.status, created_at=record.created_at).delete(synchronize_session=False)
+            db.session.commit()
+            continue
+        if record.request_hash != request_hash:
+            raise IdempotencyConflict('La Idempotency-Key ya se usó con una solicitud diferente', 422)
+        if record.status == 'COMPLETED':
+            return record
+        if time.monotonic() >= deadline:
+            raise IdempotencyConflict('Hay una solicitud con la misma Idempotency-Key en curso. Inténtalo de nuevo más tarde.', 409)
+        time.sleep(IDEMPOTENCY_POLL_INTERVAL)
+
+def release_idempotency_key(key):
+    # Descartar cualquier transacción fallida de la vista antes de borrar la clave
+    db.session.rollback()
+    IdempotencyKey.query.filter_by(key=key).delete(synchronize_session=False)
+    db.session.commit()
+
+def store_idempotent_response(key, response):
+    # Descartar cualquier transacción fallida de la vista antes de guardar la respuesta
+    db.session.rollback()
+    IdempotencyKey.query.filter_by(key=key).update({
+        'status': 'COMPLETED',
+        'response_status': response.status_code,
+        'response_body': response.get_data(as_text=True),
+        'response_mimetype': response.mimetype
+    }, synchronize_session=False)
+    db.session.commit()
+
+def idempotent(view):
+    """Hace que la vista respete la cabecera Idempotency-Key. Sin cabecera, la vista se ejecuta normalmente."""
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        key = request.headers.get('Idempotency-Key', '').strip()
+        if not key:
+            return view(*args, **kwargs)
+        if len(key) > 255:
+            return jsonify({'success': False, 'message': 'La Idempotency-Key no puede superar los 255 caracteres'}), 400
+        
+        purge_expired_idempotency_keys()
+        try:
+            record = claim_idempotency_key(key, idempotency_request_hash())
+        except IdempotencyConflict as e:
+            return jsonify({'success': False, 'message': str(e)}), e.status_code
+        
+        if record is not None:
+            replay = Response(record.response_body, status=record.response_status, mimetype=record.response_mimetype)
+            replay.headers['Idempotent-Replayed'] = 'true'
+            return replay
+        
+        try:
+            response = app.make_response(view(*args, **kwargs))
+        except Exception:
+            # Sin respuesta que guardar: liberar la clave para que el cliente pueda reintentar
+            release_idempotency_key(key)
+            raise
+        if response.status_code >= 500:
+            # Los errores del servidor no se guardan: el cliente puede reintentar con la misma clave
+            release_idempotency_key(key)
+        else:
+            store_idempotent_response(key, response)
+        return response
+    return wrapper
+
+# Indica si una excepción de AmadeusClient garantiza que la solicitud no llegó a enviarse:
+# espera agotada en la cola del limitador o antes de enviar, o conexión no establecida.
+# Un timeout de lectura (también ResponseDeadlineExceeded) o una conexión cortada a mitad de
+# respuesta no lo garantizan.
+def is_unsent_request_error(error):
+    if isinstance(error, ResponseDeadlineExceeded):
+        return False
+    if isinstance(error, (AmadeusQueueTimeout, DeadlineExceeded, requests.exceptions.ConnectTimeout)):
+        return True
+    if isinstance(error, requests.exceptions.ConnectionError) and error.args:
+        return isinstance(getattr(error.args[0], 'reason', None), NewConnectionError)
+    return False
+
+# Función para crear una reserva real en Amadeus
+def create_amadeus_booking(flight_offer, passenger_data, contact_info):
+    """Crea una reserva real en Amadeus usando la API de Flight Create Orders
+    En modo de prueba, simula una respuesta exitosa para evitar errores de la API"""
+    try:
+        # Verificar el entorno y modo de prueba
+        app_env = os.getenv('APP_ENV', 'development')
+        test_mode = os.getenv('AMADEUS_TEST_MODE', 'false').lower() == 'true'
+        
+        if test_mode:
+            print("Ejecutando en modo de prueba: simulando respuesta de Amadeus")
+            # Generar un PNR aleatorio para pruebas
+            pnr = generate_pnr()
+            
+            # Simular una respuesta exitosa
+            booking_id = f"FL-{pnr}-{int(time.time())}"
             
             # Obtener información del primer pasajero para el registro
             first_name = ""
@@ -783,17 +3167,13 @@ def create_amadeus_booking(flight_offer, passenger_data, contact_info):
             return {
                 "success": True,
                 "booking_id": booking_id,
-                "pnr": pnr
+                "pnr": pnr,
+                "simulated": True
             }
         
         # Si no estamos en modo de prueba, continuar con la implementación real
-        # Obtener token de acceso
-        access_token = get_access_token()
-        
         # Configurar la llamada a la API
-        booking_url = "https://test.api.amadeus.com/v1/booking/flight-orders"
         headers = {
-            "Authorization": f"Bearer {access_token}",
             "Content-Type": "application/json"
         }
         
@@ -921,7 +3301,12 @@ def create_amadeus_booking(flight_offer, passenger_data, contact_info):
         print(f"Enviando solicitud a Amadeus: {json.dumps(payload)}")
         
         # Enviar la solicitud a la API
-        response = requests.post(booking_url, headers=headers, json=payload)
+        try:
+            response = amadeus_client.post("/v1/booking/flight-orders", operation="flight_orders", headers=headers, json=payload)
+        except Exception as e:
+            print(f"Error enviando la reserva a Amadeus: {str(e)}")
+            # request_sent indica si Amadeus pudo llegar a crear la orden (por ejemplo, timeout de lectura)
+            return {"success": False, "error": str(e), "request_sent": not is_unsent_request_error(e)}
         
         # Verificar si la solicitud fue exitosa
         if response.status_code == 200 or response.status_code == 201:
@@ -959,13 +3344,7 @@ def create_amadeus_booking(flight_offer, passenger_data, contact_info):
                     if enable_auto_fallback and error_code in auto_fallback_error_codes:
                         # Activar modo de prueba para simular una reserva exitosa
                         print(f"Detectado error {error_code}: {error_title}. Cambiando a modo de prueba.")
-                        import random
-                        import string
-                        import time
-                        
-                        # Excluir caracteres confusos: I, O, 0, 1
-                        chars = [c for c in string.ascii_uppercase + string.digits if c not in ['I', 'O', '0', '1']]
-                        pnr = ''.join(random.choice(chars) for _ in range(6))
+                        pnr = generate_pnr()
                         
                         # Simular una respuesta exitosa
                         booking_id = f"FL-{pnr}-{int(time.time())}"
@@ -984,6 +3363,7 @@ def create_amadeus_booking(flight_offer, passenger_data, contact_info):
                             "success": True,
                             "booking_id": booking_id,
                             "pnr": pnr,
+                            "simulated": True,
                             "message": fallback_message
                         }
                     else:
@@ -991,20 +3371,49 @@ def create_amadeus_booking(flight_offer, passenger_data, contact_info):
             except Exception as e:
                 print(f"Error al procesar la respuesta de error: {str(e)}")
             
-            return {"success": False, "error": error_message, "details": response.text}
+            return {"success": False, "error": error_message, "details": response.text, "status_code": response.status_code}
     
     except Exception as e:
         print(f"Error creating Amadeus booking: {str(e)}")
-        return {"success": False, "error": str(e)}
+        # No se sabe en qué punto falló: se asume que la orden pudo crearse
+        return {"success": False, "error": str(e), "request_sent": True}
 
 @app.route('/create_booking', methods=['POST'])
+@idempotent
 def create_booking():
     try:
         # Obtener datos del formulario
         flight_id = request.form.get('flightId')
+        search_id = request.form.get('searchId')
+        
+        # Recuperar la oferta real guardada al mostrar los resultados de la búsqueda
+        flight_offer = search_sessions.get_offer(search_id, flight_id) if search_id else None
+        if flight_offer is None:
+            return jsonify({
+                'success': False,
+                'message': 'La oferta seleccionada ya no está disponible. Por favor, realiza la búsqueda de nuevo.'
+            }), 410
+        
+        # Confirmar precio y disponibilidad con Amadeus antes de reservar (opcional). Si falla, se reserva
+        # con la oferta de la búsqueda y la respuesta lo indica con price_confirmed=false
+        price_confirmed = False
+        if os.getenv('REPRICE_BEFORE_BOOKING', 'false').lower() == 'true':
+            try:
+                flight_offer = price_flight_offer(search_id, flight_id, flight_offer)
+                price_confirmed = True
+            except Exception as e:
+                print(f"No se pudo revalidar la oferta {flight_id}, se reserva con la oferta de la búsqueda: {str(e)}")
+        flight_id = flight_reference(flight_offer)
+        
+        # El precio y la moneda salen de la oferta (revalidada si se revalidó), no del formulario
         fare_type = request.form.get('fareType')
-        fare_price = float(request.form.get('farePrice'))
-        currency = request.form.get('currency', 'EUR')
+        try:
+            fare_price, currency = fare_price_for(flight_offer, fare_type)
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'message': f"El tipo de tarifa debe ser uno de: {', '.join(FARE_TYPE_MULTIPLIERS)}"
+            }), 400
         service_fee = float(request.form.get('serviceFee', 0))
         service_fee_currency = request.form.get('serviceFeeCurrency', currency)
         
@@ -1076,141 +3485,66 @@ def create_booking():
             'phone': contact_phone
         }
         
-        # Obtener la oferta de vuelo original desde la sesión o la base de datos
-        # Nota: En un entorno real, deberías almacenar la oferta completa al mostrarla
-        # Por ahora, creamos una estructura básica para la demostración
-        flight_offer = {
-            "type": "flight-offer",
-            "id": "1",
-            "source": "GDS",
-            "instantTicketingRequired": False,
-            "nonHomogeneous": False,
-            "oneWay": False,
-            "lastTicketingDate": "2025-04-15",
-            "numberOfBookableSeats": adults + children,
-            "itineraries": [
-                {
-                    "duration": "PT2H",
-                    "segments": [
-                        {
-                            "departure": {
-                                "iataCode": flight_id.split('-')[0] if '-' in flight_id and len(flight_id.split('-')) > 0 else "LAX",
-                                "terminal": "1",
-                                "at": "2025-05-01T10:00:00"
-                            },
-                            "arrival": {
-                                "iataCode": flight_id.split('-')[1] if '-' in flight_id and len(flight_id.split('-')) > 1 else "GDL",
-                                "terminal": "2",
-                                "at": "2025-05-01T12:00:00"
-                            },
-                            "carrierCode": "IB",
-                            "number": "1234",
-                            "aircraft": {
-                                "code": "320"
-                            },
-                            "operating": {
-                                "carrierCode": "IB"
-                            },
-                            "duration": "PT2H",
-                            "id": "1",
-                            "numberOfStops": 0,
-                            "blacklistedInEU": False
-                        }
-                    ]
+        # Modo asíncrono: guardar la reserva como pendiente y encolar la llamada a Amadeus
+        if booking_async_requested():
+            new_booking = Booking(
+                id=str(uuid.uuid4()),
+                pnr=pnr,
+                flight_id=flight_id,
+                fare_type=fare_type,
+                fare_price=fare_price,
+                currency=currency,
+                service_fee=service_fee,
+                service_fee_currency=service_fee_currency,
+                total_price=total_price,
+                contact_email=contact_email,
+                contact_phone=contact_phone,
+                adults=adults,
+                children=children,
+                infants=infants,
+                passenger_data=json.dumps(passenger_data),
+                passengers=build_passengers(passenger_data),
+                status='PENDING',
+                jobs=[BookingJob(
+                    payload=json.dumps({
+                        'flight_offer': flight_offer,
+                        'passenger_data': passenger_data,
+                        'contact_info': contact_info
+                    }),
+                    max_attempts=booking_workers.max_attempts
+                )]
+            )
+            # La reserva y su tarea se guardan en la misma transacción
+            save_booking(new_booking)
+            booking_workers.notify()
+            
+            status_url = url_for('booking_status', pnr=new_booking.pnr)
+            response = jsonify({
+                'success': True,
+                'booking_id': new_booking.id,
+                'pnr': new_booking.pnr,
+                'status': 'PENDING',
+                'status_url': status_url,
+                'price_confirmed': price_confirmed,
+                'message': 'Reserva recibida. Se está confirmando con la aerolínea.',
+                'details': {
+                    'pnr': new_booking.pnr,
+                    'flight_id': flight_id,
+                    'fare_type': fare_type,
+                    'fare_price': fare_price,
+                    'currency': currency,
+                    'service_fee': service_fee,
+                    'service_fee_currency': service_fee_currency,
+                    'total_price': total_price,
+                    'booking_id': new_booking.id,
+                    'status': 'PENDING'
                 }
-            ],
-            "price": {
-                "currency": currency,
-                "total": str(total_price),
-                "base": str(fare_price),
-                "fees": [
-                    {
-                        "amount": str(service_fee),
-                        "type": "SUPPLIER"
-                    }
-                ],
-                "grandTotal": str(total_price)
-            },
-            "pricingOptions": {
-                "fareType": ["PUBLISHED"],
-                "includedCheckedBagsOnly": True
-            },
-            "validatingAirlineCodes": ["IB"],
-            "travelerPricings": []
-        }
-        
-        # Añadir precios por pasajero
-        for i in range(adults):
-            flight_offer["travelerPricings"].append({
-                "travelerId": str(i+1),
-                "fareOption": "STANDARD",
-                "travelerType": "ADULT",
-                "price": {
-                    "currency": currency,
-                    "total": str(fare_price),
-                    "base": str(fare_price)
-                },
-                "fareDetailsBySegment": [
-                    {
-                        "segmentId": "1",
-                        "cabin": request.form.get('travelClass', 'ECONOMY').upper(),
-                        "fareBasis": fare_type[:1].upper() + "BAS",  # Primera letra del fare_type + BAS
-                        "class": fare_type[:1].upper(),  # Primera letra del fare_type
-                        "includedCheckedBags": {
-                            "quantity": 1 if fare_type.lower() != 'basic' else 0
-                        }
-                    }
-                ]
-            })
-        
-        for i in range(children):
-            flight_offer["travelerPricings"].append({
-                "travelerId": str(adults+i+1),
-                "fareOption": "STANDARD",
-                "travelerType": "CHILD",
-                "price": {
-                    "currency": currency,
-                    "total": str(fare_price * 0.75),  # 75% del precio adulto
-                    "base": str(fare_price * 0.75)
-                },
-                "fareDetailsBySegment": [
-                    {
-                        "segmentId": "1",
-                        "cabin": request.form.get('travelClass', 'ECONOMY').upper(),
-                        "fareBasis": fare_type[:1].upper() + "BAS",  # Primera letra del fare_type + BAS
-                        "class": fare_type[:1].upper(),  # Primera letra del fare_type
-                        "includedCheckedBags": {
-                            "quantity": 1 if fare_type.lower() != 'basic' else 0
-                        }
-                    }
-                ]
-            })
-        
-        for i in range(infants):
-            flight_offer["travelerPricings"].append({
-                "travelerId": str(adults+children+i+1),
-                "fareOption": "STANDARD",
-                "travelerType": "INFANT",
-                "price": {
-                    "currency": currency,
-                    "total": str(fare_price * 0.1),  # 10% del precio adulto
-                    "base": str(fare_price * 0.1)
-                },
-                "fareDetailsBySegment": [
-                    {
-                        "segmentId": "1",
-                        "cabin": request.form.get('travelClass', 'ECONOMY').upper(),
-                        "fareBasis": fare_type[:1].upper() + "INF",  # Primera letra del fare_type + INF para infantes
-                        "class": fare_type[:1].upper(),  # Primera letra del fare_type
-                        "includedCheckedBags": {
-                            "quantity": 0  # Los infantes generalmente no tienen equipaje incluido
-                        }
-                    }
-                ],
-                "associatedAdultId": "1"  # Asociado al primer adulto
             })
+            response.status_code = 202
+            response.headers['Location'] = status_url
+            return response
         
-        # Crear la reserva en Amadeus
+        # Crear la reserva en Amadeus con la oferta tal como la devolvió Amadeus
         amadeus_result = create_amadeus_booking(flight_offer, passenger_data, contact_info)
         amadeus_booking_id = amadeus_result.get('booking_id') if amadeus_result.get('success') else None
         
@@ -1220,6 +3554,8 @@ def create_booking():
         # Si Amadeus devuelve un PNR, usarlo en lugar del generado localmente
         if amadeus_result.get('success') and amadeus_result.get('pnr'):
             pnr = amadeus_result.get('pnr')
+        # Un PNR real de Amadeus no se puede sustituir; los generados aquí sí
+        local_pnr = amadeus_result.get('simulated', False) or not (amadeus_result.get('success') and amadeus_result.get('pnr'))
         
         # Crear nueva reserva en nuestra base de datos
         new_booking = Booking(
@@ -1237,14 +3573,15 @@ def create_booking():
             adults=adults,
             children=children,
             infants=infants,
-            passenger_data=json.dumps(passenger_data),
+            passenger_data=json.dumps(passenger_data),  # Copia original; las lecturas usan la tabla Passenger
+            passengers=build_passengers(passenger_data),
             amadeus_booking_id=amadeus_booking_id,  # ID de la reserva en Amadeus
             status='CONFIRMED'
         )
         
-        # Guardar en la base de datos
-        db.session.add(new_booking)
-        db.session.commit()
+        # Guardar en la base de datos (una sola escritura; reintenta si el PNR ya existe)
+        save_booking(new_booking, regenerate_pnr=local_pnr)
+        pnr = new_booking.pnr
         
         # Devolver el PNR y los detalles de la reserva
         response_data = {
@@ -1252,6 +3589,7 @@ def create_booking():
             'booking_id': new_booking.id,
             'pnr': pnr,  # Incluir el PNR en la respuesta
             'message': 'Reserva creada exitosamente',
+            'price_confirmed': price_confirmed,
             'details': {
                 'pnr': pnr,
                 'flight_id': flight_id,
@@ -1282,97 +3620,617 @@ def create_booking():
             'message': f'Error al crear la reserva: {str(e)}'
         }), 500
 
+# Indica si la reserva debe procesarse en segundo plano: por configuración (BOOKING_ASYNC_ENABLED)
+# o porque el cliente lo pide con la cabecera "Prefer: respond-async"
+def booking_async_requested():
+    if 'respond-async' in request.headers.get('Prefer', '').lower():
+        return True
+    return os.getenv('BOOKING_ASYNC_ENABLED', 'false').lower() == 'true'
+
+# Trabajadores que procesan la cola persistente de reservas (tabla BookingJob)
+class BookingWorkerPool:
+    """Hilos que toman tareas de BookingJob, llaman a Amadeus y actualizan Booking.status
+    (PENDING -> CONFIRMED/FAILED/NEEDS_REVIEW). Cada tarea se reclama con un UPDATE condicional,
+    por lo que varios procesos pueden compartir la cola. Solo se reintentan, con backoff exponencial
+    hasta `max_attempts`, los fallos en los que la orden seguro que no se creó (ver classify_failure).
+    Si la orden pudo crearse (timeout de lectura, 5xx, o una tarea que quedó a medias y cuyo bloqueo
+    supera `lease_seconds`), la tarea pasa a NEEDS_REVIEW para revisarla a mano y no duplicarla."""
+
+    # Respuestas 4xx con las que Amadeus rechaza la orden sin crearla pero que pueden resolverse
+    # reintentando más tarde; el resto de 4xx (validación) no se reintenta
+    RETRY_STATUS_CODES = (401, 408, 429)
+
+    def __init__(self, workers=2, max_attempts=3, retry_backoff=5, poll_interval=2, job_timeout=60, lease_seconds=300,
+                 autostart=False):
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.poll_interval = poll_interval
+        self.job_timeout = job_timeout
+        # El bloqueo debe durar más que cualquier intento para que otra instancia no lo repita
+        self.lease_seconds = max(lease_seconds, job_timeout * 2)
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self._threads = []
+        self._lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        # Los hilos no arrancan al importar el módulo (reloader, flask CLI, cada worker de gunicorn),
+        # sino cuando el servidor arranca o atiende su primera solicitud (ver autostart_once)
+        self.autostart = autostart
+        self._autostarted = False
+        self.confirmed = 0
+        self.failed = 0
+        self.retried = 0
+        self.needs_review = 0
+        self.errors = 0
+
+    def notify(self):
+        """Despierta a los trabajadores de este proceso tras encolar una tarea
+        (y los arranca la primera vez si autostart está activo)"""
+        if self.autostart:
+            self.start()
+        self._wake.set()
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def mark_for_review(self, job, error):
+        job.status = 'NEEDS_REVIEW'
+        job.booking.status = 'NEEDS_REVIEW'
+        job.last_error = error
+        self._count('needs_review')
+        print(f"Reserva {job.booking.pnr} pendiente de revisión (la orden pudo crearse en Amadeus): {error}")
+
+    def expire_leases(self):
+        """Pasa a NEEDS_REVIEW las tareas RUNNING cuyo bloqueo expiró: el trabajador que las tenía
+        pudo enviar la orden a Amadeus antes de caerse, así que no se vuelven a enviar"""
+        expired = db.and_(
+            BookingJob.status == 'RUNNING',
+            BookingJob.locked_at < datetime.utcnow() - timedelta(seconds=self.lease_seconds)
+        )
+        job_ids = db.session.execute(db.select(BookingJob.id).where(expired)).scalars().all()
+        for job_id in job_ids:
+            taken = BookingJob.query.filter(BookingJob.id == job_id, expired).update(
+                {'status': 'NEEDS_REVIEW', 'locked_by': None, 'locked_at': None},
+                synchronize_session=False
+            )
+            if not taken:
+                # Otro trabajador la marcó antes
+                continue
+            job = db.session.get(BookingJob, job_id, populate_existing=True)
+            self.mark_for_review(job, f"Tarea interrumpida en el intento {job.attempts} (bloqueo expirado)")
+        db.session.commit()
+
+    def claim(self, worker_id):
+        """Reclama la siguiente tarea disponible o devuelve None"""
+        self.expire_leases()
+        now = datetime.utcnow()
+        claimable = db.and_(BookingJob.status == 'QUEUED', BookingJob.run_after <= now)
+        job_id = db.session.execute(
+            db.select(BookingJob.id).where(claimable).order_by(BookingJob.run_after, BookingJob.id).limit(1)
+        ).scalar()
+        if job_id is None:
+            db.session.rollback()
+            return None
+        claimed = BookingJob.query.filter(BookingJob.id == job_id, claimable).update({
+            'status': 'RUNNING',
+            'locked_by': worker_id,
+            'locked_at': now,
+            'attempts': BookingJob.attempts + 1
+        }, synchronize_session=False)
+        db.session.commit()
+        if not claimed:
+            # Otro trabajador la reclamó antes
+            return None
+        return db.session.get(BookingJob, job_id, populate_existing=True)
+
+    def classify_failure(self, result):
+        """'retry' si la orden seguro que no se creó y puede reintentarse, 'failed' si Amadeus la
+        rechazó (4xx de validación) y 'review' si pudo llegar a crearse (5xx, timeout de lectura)"""
+        status_code = result.get('status_code')
+        if status_code is not None:
+            if status_code in self.RETRY_STATUS_CODES:
+                return 'retry'
+            return 'failed' if 400 <= status_code < 500 else 'review'
+        return 'retry' if result.get('request_sent') is False else 'review'
+
+    def process(self, job):
+        payload = json.loads(job.payload)
+        priority_token = amadeus_priority.set('booking')
+        deadline_token = amadeus_deadline.set(time.monotonic() + self.job_timeout)
+        try:
+            result = create_amadeus_booking(payload['flight_offer'], payload['passenger_data'], payload['contact_info'])
+        except Exception as e:
+            result = {'success': False, 'error': str(e)}
+        finally:
+            amadeus_deadline.reset(deadline_token)
+            amadeus_priority.reset(priority_token)
+        
+        booking = job.booking
+        failure = None if result.get('success') else self.classify_failure(result)
+        if failure is None:
+            booking.status = 'CONFIRMED'
+            booking.amadeus_booking_id = result.get('booking_id')
+            job.status = 'DONE'
+            job.last_error = None
+            self._count('confirmed')
+            print(f"Reserva {booking.pnr} confirmada en el intento {job.attempts}")
+        elif failure == 'review':
+            self.mark_for_review(job, result.get('error'))
+        elif failure == 'failed' or job.attempts >= job.max_attempts:
+            booking.status = 'FAILED'
+            job.status = 'FAILED'
+            job.last_error = result.get('error')
+            self._count('failed')
+            print(f"Reserva {booking.pnr} fallida tras {job.attempts} intentos: {job.last_error}")
+        else:
+            job.status = 'QUEUED'
+            job.run_after = datetime.utcnow() + timedelta(seconds=self.retry_backoff * (2 ** (job.attempts - 1)))
+            job.last_error = result.get('error')
+            self._count('retried')
+            print(f"Reserva {booking.pnr}: intento {job.attempts} fallido, se reintentará: {job.last_error}")
+        job.locked_by = None
+        job.locked_at = None
+        db.session.commit()
+
+    def run_once(self, worker_id):
+        """Procesa una tarea si hay alguna disponible. Devuelve True si procesó una."""
+        with app.app_context():
+            job = self.claim(worker_id)
+            if job is None:
+                return False
+            self.process(job)
+            return True
+
+    def _run(self):
+        worker_id = f"{os.getpid()}-{threading.current_thread().name}"
+        while not self._stop.is_set():
+            try:
+                if self.run_once(worker_id):
+                    continue
+            except Exception as e:
+                self._count('errors')
+                print(f"Error en el trabajador de reservas {worker_id}: {str(e)}")
+            if self._wake.wait(self.poll_interval):
+                self._wake.clear()
+
+    def start(self):
+        with self._start_lock:
+            self._threads = [thread for thread in self._threads if thread.is_alive()]
+            if self._threads:
+                return
+            self._stop.clear()
+            for index in range(self.workers):
+                thread = threading.Thread(target=self._run, name=f'booking-worker-{index}', daemon=True)
+                thread.start()
+                self._threads.append(thread)
+
+    def autostart_once(self):
+        """Arranca los trabajadores la primera vez que se llama si autostart está activo, para que las
+        tareas pendientes de un reinicio (encoladas, reintentos, bloqueos vencidos) se procesen
+        sin esperar a que este proceso encole una reserva nueva"""
+        if self.autostart and not self._autostarted:
+            self._autostarted = True
+            self.start()
+
+    def stop(self):
+        self._stop.set()
+        self._wake.set()
+
+    def stats(self):
+        with app.app_context():
+            queue = dict(db.session.query(BookingJob.status, db.func.count(BookingJob.id)).group_by(BookingJob.status).all())
+        with self._lock:
+            return {
+                'running_workers': sum(1 for thread in self._threads if thread.is_alive()),
+                'queue': {status: queue.get(status, 0) for status in ('QUEUED', 'RUNNING', 'DONE', 'FAILED', 'NEEDS_REVIEW')},
+                'confirmed': self.confirmed,
+                'failed': self.failed,
+                'retried': self.retried,
+                'needs_review': self.needs_review,
+                'errors': self.errors
+            }
+
+
+booking_workers = BookingWorkerPool(
+    workers=int(os.getenv('BOOKING_WORKERS', '2')),
+    max_attempts=int(os.getenv('BOOKING_JOB_MAX_ATTEMPTS', '3')),
+    retry_backoff=float(os.getenv('BOOKING_JOB_RETRY_BACKOFF', '5')),
+    poll_interval=float(os.getenv('BOOKING_JOB_POLL_INTERVAL', '2')),
+    job_timeout=float(os.getenv('REQUEST_BUDGET_BOOKING', '60')),
+    lease_seconds=float(os.getenv('BOOKING_JOB_LEASE', '300')),
+    autostart=os.getenv('BOOKING_WORKERS_ENABLED', 'true').lower() == 'true'
+)
+
+# Arrancar los trabajadores de reservas con la primera solicitud que atiende el servidor
+# (con ASGI se arrancan antes, en el evento de inicio)
+@app.before_request
+def start_booking_workers():
+    booking_workers.autostart_once()
+
+# Estado de una reserva procesada en segundo plano (URL devuelta por /create_booking en modo asíncrono)
+@app.route('/api/bookings/<pnr>/status', methods=['GET'])
+def booking_status(pnr):
+    booking = Booking.query.filter_by(pnr=pnr.upper()).first()
+    if not booking:
+        return jsonify({
+            'success': False,
+            'message': 'No se encontró ninguna reserva con ese PNR'
+        }), 404
+    
+    response_data = {
+        'success': True,
+        'pnr': booking.pnr,
+        'booking_id': booking.id,
+        'status': booking.status
+    }
+    job = BookingJob.query.filter_by(booking_id=booking.id).order_by(BookingJob.id.desc()).first()
+    if job:
+        response_data['job'] = {
+            'status': job.status,
+            'attempts': job.attempts,
+            'max_attempts': job.max_attempts,
+            'next_attempt_at': job.run_after.strftime('%Y-%m-%d %H:%M:%S') if job.status == 'QUEUED' else None,
+            'last_error': job.last_error
+        }
+    return jsonify(response_data)
+
+# Crea los índices definidos en los modelos que falten en tablas ya existentes
+# (db.create_all() no modifica tablas creadas por versiones anteriores)
+def ensure_indexes(bind):
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            try:
+                index.create(bind, checkfirst=True)
+            except IntegrityError:
+                # Índice único sobre datos duplicados (ej. pasajeros migrados dos veces por versiones anteriores)
+                print(f"No se pudo crear el índice único {index.name}: hay filas duplicadas. "
+                      "Ejecuta flask --app app migrate-passengers para eliminarlas.")
+
+# Añade las columnas origin y destination a tablas booking creadas por versiones anteriores y las
+# rellena a partir de flight_id en la misma transacción (se ejecuta una sola vez, al añadirlas)
+def ensure_booking_route_columns(bind):
+    if {'origin', 'destination'} <= {column['name'] for column in db.inspect(bind).get_columns('booking')}:
+        return False
+    try:
+        with bind.begin() as connection:
+            connection.execute(db.text("ALTER TABLE booking ADD COLUMN origin VARCHAR(3)"))
+            connection.execute(db.text("ALTER TABLE booking ADD COLUMN destination VARCHAR(3)"))
+            connection.execute(db.text(
+                "UPDATE booking SET origin = upper(substr(flight_id, 1, 3)), destination = upper(substr(flight_id, 5, 3)) "
+                "WHERE flight_id LIKE '___-___-%'"
+            ))
+            # El filtro por ruta ya no usa el índice sobre flight_id
+            connection.execute(db.text("DROP INDEX IF EXISTS ix_booking_flight_id_created_at_id"))
+    except OperationalError:
+        # Otro proceso añadió las columnas al mismo tiempo
+        return False
+    return True
+
 # Crear las tablas de la base de datos al iniciar la aplicación
 with app.app_context():
     db.create_all()
+    if ensure_booking_route_columns(db.engine):
+        print("Columnas origin/destination añadidas a las reservas existentes")
+    ensure_indexes(db.engine)
+
+# Iniciar el calentamiento de la caché de búsquedas (opcional)
+if os.getenv('CACHE_WARM_ENABLED', 'false').lower() == 'true':
+    cache_warmer.start()
+
+# Valida los parámetros de búsqueda de la API (para integración con WhatsApp)
+def parse_api_search_params(args):
+    """Devuelve (parámetros para search_flights_cached, mensaje de error). Si hay error, los parámetros son None."""
+    origin = args.get('origin')
+    destination = args.get('destination')
+    departure_date = args.get('departure_date')
+    return_date = args.get('return_date')
+    trip_type = str(args.get('trip_type', 'roundtrip')).lower()  # Por defecto: roundtrip
+    adults = args.get('adults', '1')
+    children = args.get('children', '0')
+    infants = args.get('infants', '0')
+    
+    # Validar parámetros obligatorios
+    if not all([origin, destination, departure_date]):
+        return None, 'Faltan parámetros obligatorios: origin, destination, departure_date'
+    
+    # En las búsquedas por lotes los valores llegan como JSON y pueden tener cualquier tipo
+    if not all(isinstance(value, str) for value in (origin, destination, departure_date)) or (
+        return_date is not None and not isinstance(return_date, str)
+    ):
+        return None, 'Los parámetros origin, destination, departure_date y return_date deben ser texto'
+    try:
+        adults, children, infants = (int(value) if value not in (None, '') else 0 for value in (adults, children, infants))
+    except (TypeError, ValueError):
+        return None, 'Los parámetros adults, children e infants deben ser números enteros'
+    if adults < 1 or children < 0 or infants < 0:
+        return None, 'Debe haber al menos un adulto y el número de pasajeros no puede ser negativo'
+        
+    # Validar que return_date esté presente si trip_type es roundtrip
+    if trip_type == 'roundtrip' and not return_date:
+        return None, 'El parámetro return_date es obligatorio para búsquedas de ida y vuelta (roundtrip)'
+        
+    # Validar que trip_type sea válido
+    if trip_type not in ['roundtrip', 'oneway']:
+        return None, 'El parámetro trip_type debe ser "roundtrip" o "oneway"'
+    
+    return {
+        'origin': origin,
+        'destination': destination,
+        'departure_date': departure_date,
+        'return_date': return_date if trip_type == 'roundtrip' else None,
+        'adults': adults,
+        'children': children,
+        'infants': infants,
+        'trip_type': trip_type
+    }, None
+
+# Simplificar la respuesta de Amadeus para WhatsApp
+def simplify_flight_offers(flight_data):
+    simplified_results = []
+    for offer in flight_data.get('data', []):
+        price = offer.get('price', {})
+        itineraries = offer.get('itineraries', [])
+        
+        flight_info = {
+            'price': {
+                'total': price.get('total'),
+                'currency': price.get('currency')
+            },
+            'segments': []
+        }
+        
+        # Procesar segmentos de vuelo
+        for itinerary in itineraries:
+            for segment in itinerary.get('segments', []):
+                departure = segment.get('departure', {})
+                arrival = segment.get('arrival', {})
+                carrier = segment.get('carrierCode', '')
+                
+                flight_info['segments'].append({
+                    'departure': {
+                        'iataCode': departure.get('iataCode'),
+                        'at': departure.get('at')
+                    },
+                    'arrival': {
+                        'iataCode': arrival.get('iataCode'),
+                        'at': arrival.get('at')
+                    },
+                    'carrier': carrier,
+                    'number': segment.get('number')
+                })
+        
+        simplified_results.append(flight_info)
+    return simplified_results
 
 # API Endpoint para búsqueda de vuelos (para integración con WhatsApp)
 @app.route('/api/search_flights', methods=['GET'])
 def api_search_flights():
     try:
-        # Obtener parámetros de la URL
-        origin = request.args.get('origin')
-        destination = request.args.get('destination')
-        departure_date = request.args.get('departure_date')
-        return_date = request.args.get('return_date')
-        trip_type = request.args.get('trip_type', 'roundtrip').lower()  # Por defecto: roundtrip
-        adults = request.args.get('adults', '1')
-        children = request.args.get('children', '0')
-        infants = request.args.get('infants', '0')
-        
-        # Validar parámetros obligatorios
-        if not all([origin, destination, departure_date]):
+        # Obtener y validar parámetros de la URL
+        search_params, error = parse_api_search_params(request.args)
+        if error:
             return jsonify({
                 'success': False,
-                'message': 'Faltan parámetros obligatorios: origin, destination, departure_date'
+                'message': error
             }), 400
-            
-        # Validar que return_date esté presente si trip_type es roundtrip
-        if trip_type == 'roundtrip' and not return_date:
+        
+        # Buscar vuelos
+        flight_data, cache_info = search_flights_cached(**search_params)
+        
+        # Simplificar la respuesta para WhatsApp (opcional)
+        simplified_results = simplify_flight_offers(flight_data)
+        
+        return jsonify({
+            'success': True,
+            'count': len(simplified_results),
+            'results': simplified_results,
+            'cache': cache_info
+        })
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+# API Endpoint para varias búsquedas en una sola solicitud (para integración con WhatsApp)
+@app.route('/api/search_flights/batch', methods=['POST'])
+def api_search_flights_batch():
+    try:
+        payload = request.get_json(silent=True) or {}
+        searches = payload.get('searches')
+        max_items = int(os.getenv('BATCH_SEARCH_MAX_ITEMS', '20'))
+        
+        if not isinstance(searches, list) or not searches:
             return jsonify({
                 'success': False,
-                'message': 'El parámetro return_date es obligatorio para búsquedas de ida y vuelta (roundtrip)'
+                'message': 'El cuerpo debe ser JSON con una lista "searches" de búsquedas'
             }), 400
-            
-        # Validar que trip_type sea válido
-        if trip_type not in ['roundtrip', 'oneway']:
+        if len(searches) > max_items:
             return jsonify({
                 'success': False,
-                'message': 'El parámetro trip_type debe ser "roundtrip" o "oneway"'
+                'message': f'Se permiten como máximo {max_items} búsquedas por solicitud'
             }), 400
         
-        # Buscar vuelos
-        flight_data = search_flights(
-            origin=origin,
-            destination=destination,
-            departure_date=departure_date,
-            return_date=return_date if trip_type == 'roundtrip' else None,
-            adults=adults,
-            children=children,
-            infants=infants,
-            trip_type=trip_type
+        # Tiempo máximo del lote: el cliente puede reducirlo, pero no superar el configurado
+        max_timeout = float(os.getenv('BATCH_SEARCH_TIMEOUT', '60'))
+        try:
+            timeout = min(float(payload.get('timeout', max_timeout)), max_timeout)
+        except (TypeError, ValueError):
+            timeout = max_timeout
+        
+        # Validar cada búsqueda y agrupar las que tienen parámetros idénticos
+        items = []
+        unique = {}
+        for spec in searches:
+            search_params, error = parse_api_search_params(spec if isinstance(spec, dict) else {})
+            if error:
+                items.append({'error': error})
+                continue
+            try:
+                key = flight_search_key(**search_params)
+            except (TypeError, ValueError) as e:
+                items.append({'error': f'Parámetros de búsqueda no válidos: {str(e)}'})
+                continue
+            unique.setdefault(key, search_params)
+            items.append({'key': key})
+        
+        keys = list(unique)
+        outcomes = run_bounded(
+            lambda key: search_flights_cached(**unique[key]), keys,
+            max_concurrency=int(os.getenv('BATCH_SEARCH_CONCURRENCY', '4')),
+            timeout=timeout
         )
+        outcome_by_key = dict(zip(keys, outcomes))
         
-        # Simplificar la respuesta para WhatsApp (opcional)
-        simplified_results = []
-        for offer in flight_data.get('data', []):
-            price = offer.get('price', {})
-            itineraries = offer.get('itineraries', [])
-            
-            flight_info = {
-                'price': {
-                    'total': price.get('total'),
-                    'currency': price.get('currency')
-                },
-                'segments': []
+        results = []
+        for index, item in enumerate(items):
+            if 'error' in item:
+                results.append({'index': index, 'success': False, 'message': item['error']})
+                continue
+            outcome, error = outcome_by_key[item['key']]
+            if error is not None:
+                results.append({'index': index, 'success': False, 'message': str(error) or 'Error al buscar vuelos'})
+                continue
+            flight_data, cache_info = outcome
+            simplified_results = simplify_flight_offers(flight_data)
+            results.append({
+                'index': index,
+                'success': True,
+                'count': len(simplified_results),
+                'results': simplified_results,
+                'cache': cache_info
+            })
+        
+        return jsonify({
+            'success': True,
+            'count': len(results),
+            'unique_searches': len(keys),
+            'results': results
+        })
+    
+    except Exception as e:
+        return jsonify({
+            'success': False,
+            'message': str(e)
+        }), 500
+
+# API Endpoint para el calendario de tarifas (precio más bajo para fechas cercanas)
+@app.route('/api/fare_calendar', methods=['GET'])
+def api_fare_calendar():
+    try:
+        # Mismas validaciones que /api/search_flights
+        search_params, error_message = parse_api_search_params(request.args)
+        if error_message:
+            return jsonify({
+                'success': False,
+                'message': error_message
+            }), 400
+        
+        origin = search_params['origin'].strip()
+        destination = search_params['destination'].strip()
+        departure_date = search_params['departure_date'].strip()
+        return_date = (search_params['return_date'] or '').strip()
+        trip_type = search_params['trip_type']
+        adults = search_params['adults']
+        children = search_params['children']
+        infants = search_params['infants']
+        source_system = request.args.get('source_system', 'GDS').strip().upper()
+        
+        if not source_system.isalnum():
+            return jsonify({
+                'success': False,
+                'message': 'El parámetro source_system no es válido (ej. GDS, NDC)'
+            }), 400
+        
+        # Ventana de días alrededor de cada fecha (por defecto ±3)
+        max_days = int(os.getenv('FARE_CALENDAR_MAX_DAYS', '3'))
+        days = request.args.get('days', max_days, type=int)
+        departure_days = min(max(request.args.get('departure_days', days, type=int), 0), max_days)
+        return_days = min(max(request.args.get('return_days', days, type=int), 0), max_days)
+        
+        try:
+            base_departure = datetime.strptime(departure_date, '%Y-%m-%d').date()
+            base_return = datetime.strptime(return_date, '%Y-%m-%d').date() if trip_type == 'roundtrip' else None
+        except ValueError:
+            return jsonify({
+                'success': False,
+                'message': 'Las fechas deben tener el formato YYYY-MM-DD'
+            }), 400
+        
+        today = datetime.now().date()
+        departure_dates = [base_departure + timedelta(days=offset) for offset in range(-departure_days, departure_days + 1)]
+        departure_dates = [day for day in departure_dates if day >= today]
+        return_dates = [base_return + timedelta(days=offset) for offset in range(-return_days, return_days + 1)] if base_return else [None]
+        
+        # Combinaciones de fechas válidas (el regreso no puede ser anterior a la salida)
+        pairs = [(dep, ret) for dep in departure_dates for ret in return_dates if ret is None or ret >= dep]
+        
+        def cheapest_fare(pair):
+            dep, ret = pair
+            results, cache_info = search_flights_cached(
+                origin, destination, dep.isoformat(), ret.isoformat() if ret else None,
+                adults, children, infants, source_system, trip_type
+            )
+            offers = results.get('data', [])
+            if not offers:
+                return None, None, cache_info
+            cheapest = min(offers, key=lambda offer: summarize_offer(offer)['price'])
+            return summarize_offer(cheapest)['price'], cheapest.get('price', {}).get('currency'), cache_info
+        
+        outcomes = run_bounded(
+            cheapest_fare, pairs,
+            max_concurrency=int(os.getenv('FARE_CALENDAR_CONCURRENCY', '6')),
+            timeout=float(os.getenv('FARE_CALENDAR_TIMEOUT', '90'))
+        )
+        
+        # Matriz de precios: una fila por fecha de salida y una columna por fecha de regreso
+        prices = {}
+        currency = None
+        errors = 0
+        cached = 0
+        for (dep, ret), (outcome, error) in zip(pairs, outcomes):
+            if error is not None:
+                print(f"Error in fare calendar for {dep} / {ret}: {str(error)}")
+                errors += 1
+                continue
+            price, price_currency, cache_info = outcome
+            cached += 1 if cache_info['hit'] else 0
+            if price is not None:
+                prices[(dep, ret)] = price
+                currency = currency or price_currency
+        
+        # Si fallaron todas las búsquedas, la matriz vacía no significa que no haya vuelos
+        if pairs and errors == len(pairs):
+            return jsonify({
+                'success': False,
+                'message': 'No se pudo consultar ninguna fecha del calendario en Amadeus',
+                'searches': len(pairs),
+                'errors': errors
+            }), 502
+        
+        matrix = [[prices.get((dep, ret)) for ret in return_dates] for dep in departure_dates]
+        cheapest = None
+        if prices:
+            (dep, ret), price = min(prices.items(), key=lambda item: item[1])
+            cheapest = {
+                'departure_date': dep.isoformat(),
+                'return_date': ret.isoformat() if ret else None,
+                'price': price
             }
-            
-            # Procesar segmentos de vuelo
-            for itinerary in itineraries:
-                for segment in itinerary.get('segments', []):
-                    departure = segment.get('departure', {})
-                    arrival = segment.get('arrival', {})
-                    carrier = segment.get('carrierCode', '')
-                    
-                    flight_info['segments'].append({
-                        'departure': {
-                            'iataCode': departure.get('iataCode'),
-                            'at': departure.get('at')
-                        },
-                        'arrival': {
-                            'iataCode': arrival.get('iataCode'),
-                            'at': arrival.get('at')
-                        },
-                        'carrier': carrier,
-                        'number': segment.get('number')
-                    })
-            
-            simplified_results.append(flight_info)
         
         return jsonify({
             'success': True,
-            'count': len(simplified_results),
-            'results': simplified_results
+            'currency': currency,
+            'departure_dates': [day.isoformat() for day in departure_dates],
+            'return_dates': [day.isoformat() if day else None for day in return_dates],
+            'prices': matrix,
+            'cheapest': cheapest,
+            'searches': len(pairs),
+            'from_cache': cached,
+            'errors': errors
         })
     
     except Exception as e:
@@ -1381,6 +4239,261 @@ def api_search_flights():
             'message': str(e)
         }), 500
 
+# API Endpoint para invalidar la caché de búsquedas (por ruta o completa); requiere el token de back-office
+@app.route('/api/search_cache/invalidate', methods=['POST'])
+def api_invalidate_search_cache():
+    auth_error = backoffice_token_error()
+    if auth_error:
+        return auth_error
+    
+    origin = request.values.get('origin', '').strip()
+    destination = request.values.get('destination', '').strip()
+    
+    if origin or destination:
+        removed = search_cache.invalidate_route(origin or None, destination or None)
+    else:
+        removed = search_cache.clear()
+    
+    return jsonify({
+        'success': True,
+        'removed': removed,
+        'stats': search_cache.stats()
+    })
+
+# API Endpoint con estadísticas de la caché de búsquedas
+@app.route('/api/search_cache/stats', methods=['GET'])
+def api_search_cache_stats():
+    return jsonify({
+        'success': True,
+        'stats': search_cache.stats(),
+        'coalescing': search_singleflight.stats(),
+        'warming': cache_warmer.stats(),
+        'circuit': search_circuit.stats(),
+        'sessions': search_sessions.stats()
+    })
+
+# Estado de la cola de reservas asíncronas y de sus trabajadores
+@app.route('/api/booking_queue/stats', methods=['GET'])
+def api_booking_queue_stats():
+    return jsonify({
+        'success': True,
+        'stats': booking_workers.stats()
+    })
+
+# API Endpoint con estadísticas de la caché de consultas de reservas por PNR
+@app.route('/api/booking_cache/stats', methods=['GET'])
+def api_booking_cache_stats():
+    return jsonify({
+        'success': True,
+        'stats': booking_cache.stats()
+    })
+
+# Exportación masiva de reservas y registros de correo (CSV o NDJSON)
+BOOKING_EXPORT_COLUMNS = (
+    'id', 'pnr', 'flight_id', 'fare_type', 'fare_price', 'currency', 'service_fee', 'service_fee_currency',
+    'total_price', 'contact_email', 'contact_phone', 'adults', 'children', 'infants', 'amadeus_booking_id',
+    'status', 'created_at'
+)
+EMAIL_LOG_EXPORT_COLUMNS = ('id', 'pnr', 'recipient', 'subject', 'environment', 'sent_at')
+EXPORT_BATCH_SIZE = int(os.getenv('EXPORT_BATCH_SIZE', '1000'))
+
+def backoffice_token_error():
+    """Comprueba el token de los endpoints de back-office (exportación, listado de reservas e invalidación de la caché).
+    Devuelve la respuesta de error o None si el token es válido."""
+    expected_token = os.getenv('EXPORT_API_TOKEN')
+    if not expected_token:
+        return jsonify({'success': False, 'message': 'Los endpoints de back-office no están habilitados (EXPORT_API_TOKEN)'}), 403
+    provided_token = request.headers.get('Authorization', '').removeprefix('Bearer ').strip()
+    if not secrets.compare_digest(provided_token.encode('utf-8'), expected_token.encode('utf-8')):
+        return jsonify({'success': False, 'message': 'Token de back-office no válido'}), 401
+    return None
+
+def parse_export_date(value, end=False):
+    """Convierte YYYY-MM-DD o una fecha ISO en datetime. Una fecha sin hora como límite final incluye el día completo."""
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if end and len(value) == 10:
+        parsed += timedelta(days=1)
+    return parsed
+
+def export_value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+def export_rows(rows, columns, export_format):
+    """Genera el contenido de la exportación por bloques, sin cargar todas las filas en memoria"""
+    if export_format == 'csv':
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(columns)
+        for count, row in enumerate(rows, 1):
+            writer.writerow(['' if value is None else export_value(value) for value in row])
+            if count % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    else:
+        chunk = []
+        for row in rows:
+            chunk.append(json.dumps({column: export_value(value) for column, value in zip(columns, row)}, ensure_ascii=False))
+            if len(chunk) >= EXPORT_BATCH_SIZE:
+                yield '\n'.join(chunk) + '\n'
+                chunk = []
+        if chunk:
+            yield '\n'.join(chunk) + '\n'
+
+def export_response(model, columns, date_column, filters, name):
+    """Respuesta en streaming con las filas de `model` filtradas por fecha (from/to) y los filtros dados"""
+    auth_error = backoffice_token_error()
+    if auth_error:
+        return auth_error
+
+    export_format = request.args.get('format', 'csv').lower()
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'success': False, 'message': 'Formato no soportado. Usa csv o ndjson'}), 400
+    try:
+        date_from = parse_export_date(request.args.get('from'))
+        date_to = parse_export_date(request.args.get('to'), end=True)
+    except ValueError:
+        return jsonify({'success': False, 'message': 'Fechas no válidas. Usa el formato YYYY-MM-DD'}), 400
+
+    query = db.select(*[getattr(model, column) for column in columns]).where(*filters)
+    if date_from:
+        query = query.where(date_column >= date_from)
+    if date_to:
+        query = query.where(date_column < date_to)
+    # Recorrer la tabla en orden y en bloques de EXPORT_BATCH_SIZE filas en el servidor
+    query = query.order_by(date_column, model.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+    def generate():
+        result = db.session.execute(query)
+        try:
+            yield from export_rows(result, columns, export_format)
+        finally:
+            result.close()
+
+    extension = 'csv' if export_format == 'csv' else 'ndjson'
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/csv' if export_format == 'csv' else 'application/x-ndjson',
+        headers={
+            'Content-Disposition': f'attachment; filename={name}-{datetime.now().strftime("%Y%m%d%H%M%S")}.{extension}',
+            'Cache-Control': 'no-cache',
+            'X-Accel-Buffering': 'no'
+        }
+    )
+
+def export_status_filter():
+    statuses = [status.strip().upper() for status in request.args.get('status', '').split(',') if status.strip()]
+    return [Booking.status.in_(statuses)] if statuses else []
+
+# Exportar reservas: ?format=csv|ndjson&from=YYYY-MM-DD&to=YYYY-MM-DD&status=CONFIRMED,CANCELLED
+@app.route('/api/export/bookings', methods=['GET'])
+def export_bookings():
+    return export_response(Booking, BOOKING_EXPORT_COLUMNS, Booking.created_at, export_status_filter(), 'bookings')
+
+# Exportar registros de correo (el filtro de estado se aplica al estado de la reserva asociada)
+@app.route('/api/export/email_logs', methods=['GET'])
+def export_email_logs():
+    filters = []
+    status_filter = export_status_filter()
+    if status_filter:
+        filters.append(EmailLog.pnr.in_(db.select(Booking.pnr).where(*status_filter)))
+    return export_response(EmailLog, EMAIL_LOG_EXPORT_COLUMNS, EmailLog.sent_at, filters, 'email_logs')
+
+# Listado de reservas para el back-office, paginado por cursor sobre (created_at, id)
+BOOKINGS_PAGE_SIZE = int(os.getenv('BOOKINGS_PAGE_SIZE', '50'))
+BOOKINGS_PAGE_MAX = int(os.getenv('BOOKINGS_PAGE_MAX', '200'))
+
+def encode_booking_cursor(booking):
+    payload = json.dumps([booking.created_at.isoformat(), booking.id], separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+def decode_booking_cursor(cursor):
+    """Devuelve (created_at, id) de la última reserva de la página anterior. Lanza ValueError si el cursor no es válido."""
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        created_at, booking_id = json.loads(payload)
+        return datetime.fromisoformat(created_at), str(booking_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError('Cursor no válido') from e
+
+def route_filters(origin, destination):
+    """Filtros de igualdad por ruta; cada combinación tiene un índice que termina en (created_at, id)"""
+    filters = []
+    if origin:
+        filters.append(Booking.origin == origin)
+    if destination:
+        filters.append(Booking.destination == destination)
+    return filters
+
+@app.route('/api/bookings', methods=['GET'])
+def api_list_bookings():
+    """Lista reservas de la más reciente a la más antigua. Cada página devuelve `next_cursor`;
+    se pasa como `cursor` para obtener la siguiente con el mismo coste que la primera."""
+    auth_error = backoffice_token_error()
+    if auth_error:
+        return auth_error
+    
+    try:
+        limit = min(max(request.args.get('limit', BOOKINGS_PAGE_SIZE, type=int), 1), BOOKINGS_PAGE_MAX)
+        date_from = parse_export_date(request.args.get('from'))
+        date_to = parse_export_date(request.args.get('to'), end=True)
+        cursor = request.args.get('cursor')
+        after = decode_booking_cursor(cursor) if cursor else None
+        origin = request.args.get('origin', '').strip().upper()
+        destination = request.args.get('destination', '').strip().upper()
+        if any(code and not (len(code) == 3 and code.isalpha()) for code in (origin, destination)):
+            raise ValueError('origin y destination deben ser códigos IATA de 3 letras')
+    except ValueError as e:
+        return jsonify({'success': False, 'message': f'Parámetros no válidos: {str(e)}'}), 400
+    
+    filters = export_status_filter()
+    email = request.args.get('email', '').strip()
+    if email:
+        filters.append(Booking.contact_email == email)
+    filters += route_filters(origin, destination)
+    if date_from:
+        filters.append(Booking.created_at >= date_from)
+    if date_to:
+        filters.append(Booking.created_at < date_to)
+    if after:
+        filters.append(tuple_(Booking.created_at, Booking.id) < tuple_(*after))
+    
+    # Se pide una reserva más de las necesarias para saber si hay página siguiente
+    bookings = (Booking.query
+                .options(db.selectinload(Booking.passengers))
+                .filter(*filters)
+                .order_by(Booking.created_at.desc(), Booking.id.desc())
+                .limit(limit + 1)
+                .all())
+    has_more = len(bookings) > limit
+    bookings = bookings[:limit]
+    
+    return jsonify({
+        'success': True,
+        'bookings': [booking_view(booking) for booking in bookings],
+        'count': len(bookings),
+        'next_cursor': encode_booking_cursor(bookings[-1]) if has_more else None
+    })
+
+# Estado del limitador de solicitudes hacia Amadeus (profundidad de la cola y tiempos de espera por prioridad)
+@app.route('/api/amadeus/rate_limit', methods=['GET'])
+def api_amadeus_rate_limit():
+    return jsonify({
+        'success': True,
+        'stats': amadeus_client.rate_limiter.stats()
+    })
+
+# Latencias recientes por operación de Amadeus y uso de solicitudes duplicadas (hedging)
+@app.route('/api/amadeus/latency', methods=['GET'])
+def api_amadeus_latency():
+    return jsonify({
+        'success': True,
+        'stats': amadeus_client.latency_stats()
+    })
+
 # API Endpoint para consultar reservas por PNR
 @app.route('/api/find_booking', methods=['GET'])
 def api_find_booking():
@@ -1393,8 +4506,8 @@ def api_find_booking():
                 'message': 'Falta el parámetro PNR'
             }), 400
         
-        # Buscar la reserva en la base de datos
-        booking = Booking.query.filter_by(pnr=pnr.upper()).first()
+        # Buscar la reserva (desde la caché si se consultó hace poco)
+        booking = get_booking_view(pnr.upper())
         
         if not booking:
             return jsonify({
@@ -1402,20 +4515,17 @@ def api_find_booking():
                 'message': 'No se encontró ninguna reserva con ese PNR'
             }), 404
         
-        # Convertir datos de pasajeros de JSON a diccionario
-        passenger_data = json.loads(booking.passenger_data)
-        
         # Crear respuesta con datos de la reserva
         booking_info = {
-            'pnr': booking.pnr,
-            'status': booking.status,
-            'fare_type': booking.fare_type,
-            'total_price': booking.total_price,
-            'currency': booking.currency,
-            'contact_email': booking.contact_email,
-            'contact_phone': booking.contact_phone,
-            'passengers': passenger_data,
-            'created_at': booking.created_at.strftime('%Y-%m-%d %H:%M:%S')
+            'pnr': booking['pnr'],
+            'status': booking['status'],
+            'fare_type': booking['fare_type'],
+            'total_price': booking['total_price'],
+            'currency': booking['currency'],
+            'contact_email': booking['contact_email'],
+            'contact_phone': booking['contact_phone'],
+            'passengers': booking['passengers'],
+            'created_at': booking['created_at']
         }
         
         return jsonify({
@@ -1429,5 +4539,556 @@ def api_find_booking():
             'message': str(e)
         }), 500
 
+# Comando de diagnóstico: compara respuestas grabadas de búsqueda en formato completo y compacto
+@app.cli.command('bench-compact')
+@click.argument('files', nargs=-1, required=True, type=click.Path(exists=True, dir_okay=False))
+@click.option('--iterations', default=50, help='Repeticiones para medir el tiempo de parseo')
+def bench_compact(files, iterations):
+    """Compara tamaño (bytes y gzip) y tiempo de parseo de respuestas grabadas de /search_flights.
+
+    Uso: flask --app app bench-compact respuesta1.json respuesta2.json
+    """
+    click.echo(f"{'archivo':<30} {'ofertas':>7} {'completo':>10} {'compacto':>10} {'gzip comp.':>10} {'gzip compac.':>12} {'parseo comp.':>12} {'parseo compac.':>14}")
+    for path in files:
+        with open(path, encoding='utf-8') as f:
+            results = json.load(f)
+        offers = results.get('data', [])
+        full_body = json.dumps(results, separators=(',', ':')).encode('utf-8')
+        compact_body = json.dumps(
+            compact_flight_offers(offers, results.get('dictionaries', {}).get('carriers', {})), separators=(',', ':')
+        ).encode('utf-8')
+
+        full_parse = timeit.timeit(lambda: json.loads(full_body), number=iterations) / iterations * 1000
+        compact_parse = timeit.timeit(lambda: json.loads(compact_body), number=iterations) / iterations * 1000
+
+        click.echo(
+            f"{os.path.basename(path)[:30]:<30} {len(offers):>7} {len(full_body):>10} {len(compact_body):>10} "
+            f"{len(gzip.compress(full_body)):>10} {len(gzip.compress(compact_body)):>12} "
+            f"{full_parse:>10.2f}ms {compact_parse:>12.2f}ms"
+        )
+
+@app.cli.command('bench-db-writes')
+@click.option('--threads', default=16, help='Hilos escribiendo a la vez')
+@click.option('--writes', default=50, help='Reservas por hilo (cada una con su registro de correo)')
+@click.option('--path', default=None, type=click.Path(dir_okay=False), help='Archivo SQLite de pruebas (por defecto, uno temporal)')
+def bench_db_writes(threads, writes, path):
+    """Compara el rendimiento de escrituras concurrentes en SQLite con la configuración por defecto
+    (journal DELETE, synchronous FULL, timeout de 5s) y con la ajustada (DB_SQLITE_*, DB_BUSY_TIMEOUT, DB_POOL_*).
+
+    Uso: flask --app app bench-db-writes --threads 16 --writes 50
+    """
+    path = path or os.path.join(tempfile.gettempdir(), 'bench_db_writes.db')
+    uri = f"sqlite:///{path}"
+    configs = [
+        ('por defecto', {'connect_args': {'timeout': 5}}, sqlite_pragmas('DELETE', 'FULL', 5)),
+        ('ajustada', database_engine_options(uri), sqlite_pragmas()),
+    ]
+
+    click.echo(f"{'configuración':<14} {'escrituras':>10} {'errores':>8} {'tiempo':>9} {'escrituras/s':>13}")
+    for name, options, pragmas in configs:
+        for suffix in ('', '-wal', '-shm', '-journal'):
+            if os.path.exists(path + suffix):
+                os.remove(path + suffix)
+        engine = create_engine(uri, **options)
+        event.listen(engine, 'connect', pragmas)
+        db.metadata.create_all(engine)
+
+        errors = []
+        def writer():
+            for _ in range(writes):
+                pnr = generate_pnr()
+                try:
+                    with Session(engine) as session:
+                        session.add(Booking(
+                            pnr=pnr, flight_id='MAD-BCN-IB1234', fare_type='Estándar', fare_price=100.0,
+                            currency='EUR', total_price=100.0, contact_email='bench@example.com',
+                            contact_phone='000000000', passenger_data='{}'
+                        ))
+                        session.add(EmailLog(
+                            pnr=pnr, recipient='bench@example.com', subject='bench', body='',
+                            environment='bench'
+                        ))
+                        session.commit()
+                except (OperationalError, IntegrityError) as e:
+                    errors.append(e)
+
+        pool = [threading.Thread(target=writer) for _ in range(threads)]
+        started = time.perf_counter()
+        for thread in pool:
+            thread.start()
+        for thread in pool:
+            thread.join()
+        elapsed = time.perf_counter() - started
+        engine.dispose()
+
+        done = threads * writes - len(errors)
+        click.echo(f"{name:<14} {done:>10} {len(errors):>8} {elapsed:>8.2f}s {done / elapsed:>13.1f}")
+        if errors:
+            click.echo(f"  primer error: {str(errors[0]).splitlines()[0]}")
+
+# Elimina las filas de Passenger repetidas (misma reserva y posición), conservando la primera
+def remove_duplicate_passengers():
+    first_ids = db.select(db.func.min(Passenger.id)).group_by(Passenger.booking_id, Passenger.position)
+    removed = Passenger.query.filter(Passenger.id.not_in(first_ids)).delete(synchronize_session=False)
+    db.session.commit()
+    return removed
+
+@app.cli.command('migrate-passengers')
+@click.option('--batch-size', default=500, show_default=True, help='Reservas por transacción')
+def migrate_passengers(batch_size):
+    """Migra a la tabla Passenger los pasajeros de las reservas antiguas (solo JSON en passenger_data).
+
+    Se ejecuta una vez tras actualizar, en lugar de en cada proceso al importar la aplicación.
+    También elimina los pasajeros duplicados por versiones anteriores y crea el índice único
+    (booking_id, position).
+    """
+    removed = remove_duplicate_passengers()
+    if removed:
+        click.echo(f"Pasajeros duplicados eliminados: {removed}")
+    ensure_indexes(db.engine)
+    migrated = migrate_passenger_data(batch_size=batch_size)
+    click.echo(f"Pasajeros migrados a la tabla Passenger: {migrated} reservas")
+
+@app.cli.command('booking-worker')
+def booking_worker():
+    """Procesa la cola de reservas asíncronas en primer plano, en un proceso separado del servidor web.
+
+    Uso: BOOKING_WORKERS_ENABLED=false en el servidor web y flask --app app booking-worker
+    """
+    booking_workers.start()
+    click.echo(f"Procesando reservas con {booking_workers.workers} trabajadores (Ctrl+C para salir)")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        booking_workers.stop()
+
+# Respuesta de una llamada asíncrona a Amadeus (misma interfaz básica que requests.Response)
+class AmadeusAsyncResponse:
+    def __init__(self, status_code, headers, body, url):
+        self.status_code = status_code
+        self.headers = headers
+        self.body = body
+        self.url = url
+
+    @property
+    def text(self):
+        return self.body.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.body)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.exceptions.HTTPError(f"{self.status_code} Error for url: {self.url}", response=self)
+
+
+# Cliente asíncrono (asyncio + aiohttp) para Amadeus
+class AsyncAmadeusClient:
+    """Equivalente asíncrono de AmadeusClient: un único proceso puede mantener cientos de búsquedas
+    en curso sin ocupar un hilo por cada una. Reutiliza la configuración de timeouts y reintentos del
+    cliente síncrono, incluido su token. La sesión aiohttp pertenece al event loop en el que se crea."""
+
+    def __init__(self, sync_client, pool_size=200):
+        self.sync_client = sync_client
+        self.pool_size = pool_size
+        self._session = None
+        self._loop = None
+
+    async def _ensure_session(self):
+        loop = asyncio.get_running_loop()
+        if self._session is None or self._session.closed or self._loop is not loop:
+            previous = self._session
+            connector = aiohttp.TCPConnector(limit=self.pool_size, ttl_dns_cache=300)
+            self._session = aiohttp.ClientSession(connector=connector)
+            self._loop = loop
+            # Cerrar la sesión del event loop anterior para no dejar abiertas sus conexiones
+            if previous is not None and not previous.closed:
+                try:
+                    await previous.close()
+                except RuntimeError:
+                    # El event loop anterior ya se cerró (y con él sus conexiones)
+                    pass
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    def _timeout_for(self, operation):
+        connect_timeout, read_timeout = self.sync_client.timeout_for(operation)
+        return aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+
+    def _deadline_clipped(self, operation, timeout):
+        return self.sync_client.deadline_clipped(operation, (timeout.sock_connect, timeout.sock_read))
+
+    async def get_token(self):
+        """Token del AmadeusTokenManager compartido con el cliente síncrono. Si hay que renovarlo,
+        la solicitud (bloqueante) se hace en un hilo para no detener el event loop."""
+        token_manager = self.sync_client.token_manager
+        token = token_manager.cached_token()
+        if token:
+            return token
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(None, contextvars.copy_context().run, token_manager.get_token)
+
+    async def _request_once(self, method, url, operation, headers, timeout, hedge=False, **kwargs):
+        session = await self._ensure_session()
+        rate_limiter = self.sync_client.rate_limiter
+        if rate_limiter is not None:
+            await rate_limiter.acquire_async(
+                self.sync_client.priority_for(operation),
+                timeout=self.sync_client.queue_timeout_for(operation, hedge)
+            )
+        async with session.request(method, url, headers=headers, timeout=timeout, **kwargs) as response:
+            body = await response.read()
+            result = AmadeusAsyncResponse(response.status, response.headers, body, str(response.url))
+        self.sync_client.throttle_response(result)
+        return result
+
+    async def _send(self, method, url, operation, authenticated, headers, timeout, hedge=False, **kwargs):
+        headers = dict(headers or {})
+        if not authenticated:
+            return await self._request_once(method, url, operation, headers, timeout, hedge=hedge, **kwargs)
+
+        access_token = await self.get_token()
+        headers["Authorization"] = f"Bearer {access_token}"
+        response = await self._request_once(method, url, operation, headers, timeout, hedge=hedge, **kwargs)
+
+        # Si Amadeus rechaza el token, renovarlo y reintentar una vez
+        if response.status_code == 401:
+            print("Amadeus rechazó el token (401), renovando y reintentando")
+            self.sync_client.token_manager.invalidate(access_token)
+            headers["Authorization"] = f"Bearer {await self.get_token()}"
+            response = await self._request_once(method, url, operation, headers, timeout, **kwargs)
+        return response
+
+    async def _send_hedged(self, method, url, operation, authenticated, headers, timeout, **kwargs):
+        delay = self.sync_client.hedge_delay(operation)
+        if delay is None:
+            return await self._send(method, url, operation, authenticated, headers, timeout, **kwargs)
+
+        stats = self.sync_client.hedge_stats
+        stats_lock = self.sync_client._latency_lock
+        primary = asyncio.ensure_future(self._send(method, url, operation, authenticated, headers, timeout, **kwargs))
+        done, _ = await asyncio.wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        with stats_lock:
+            stats['hedged'] += 1
+        hedge = asyncio.ensure_future(self._send(method, url, operation, authenticated, headers, timeout, hedge=True, **kwargs))
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            with stats_lock:
+                                stats['hedge_wins'] += 1
+                        return task.result()
+            # Ambas fallaron: propagar el error de la solicitud original
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def request(self, method, path, operation='default', authenticated=True, headers=None, **kwargs):
+        method = method.upper()
+        url = f"{self.sync_client.base_url}{path}"
+        retries = self.sync_client.max_retries if method == 'GET' else 0
+
+        attempt = 0
+        while True:
+            timeout = self._timeout_for(operation)
+            started = time.monotonic()
+            try:
+                if method == 'GET':
+                    response = await self._send_hedged(method, url, operation, authenticated, headers, timeout, **kwargs)
+                else:
+                    response = await self._send(method, url, operation, authenticated, headers, timeout, **kwargs)
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                if isinstance(e, (AmadeusQueueTimeout, DeadlineExceeded)):
+                    raise
+                # Un timeout recortado al tiempo límite de la solicitud no es un fallo de Amadeus
+                if isinstance(e, asyncio.TimeoutError) and self._deadline_clipped(operation, timeout):
+                    raise ResponseDeadlineExceeded("Se agotó el tiempo límite de la solicitud esperando a Amadeus") from e
+                if attempt >= retries:
+                    raise
+                delay = self.sync_client._backoff(attempt)
+                print(f"Error de red en {operation} ({str(e) or type(e).__name__}), reintento {attempt + 1}/{retries} en {delay:.2f}s")
+                error = e
+            else:
+                if response.status_code < 500:
+                    self.sync_client.record_latency(operation, time.monotonic() - started)
+                if response.status_code not in AmadeusClient.RETRY_STATUS_CODES or attempt >= retries:
+                    return response
+                delay = self.sync_client._backoff(attempt)
+                print(f"Amadeus respondió {response.status_code} en {operation}, reintento {attempt + 1}/{retries} en {delay:.2f}s")
+                error = None
+            # No reintentar si la espera consumiría el tiempo que le queda a la solicitud entrante
+            remaining = deadline_remaining()
+            if remaining is not None and delay >= remaining:
+                if error is not None:
+                    raise error
+                return response
+            await asyncio.sleep(delay)
+            attempt += 1
+
+    async def get(self, path, operation='default', **kwargs):
+        return await self.request('GET', path, operation=operation, **kwargs)
+
+    async def post(self, path, operation='default', **kwargs):
+        return await self.request('POST', path, operation=operation, **kwargs)
+
+
+async_amadeus_client = AsyncAmadeusClient(
+    amadeus_client, pool_size=int(os.getenv('AMADEUS_ASYNC_POOL_SIZE', '200'))
+) if aiohttp is not None else None
+
+# Versión asíncrona de search_airports
+async def async_search_airports(keyword):
+    try:
+        response = await async_amadeus_client.get("/v1/reference-data/locations", operation="locations", params=airport_search_params(keyword))
+        response.raise_for_status()
+        return parse_airport_results(response.json())
+    except Exception as e:
+        print(f"Error searching airports: {str(e)}")
+        return []
+
+# Versión asíncrona de search_flights
+async def async_search_flights(origin, destination, departure_date, return_date=None, adults=1, children=0, infants=0, source_system="GDS", trip_type="roundtrip", airlines=None):
+    params = build_flight_search_params(origin, destination, departure_date, return_date, adults, children, infants, source_system, trip_type, airlines)
+    # aiohttp solo acepta cadenas en los parámetros de la URL
+    params = {name: str(value) for name, value in params.items()}
+
+    async def fetch_offers():
+        response = await async_amadeus_client.get(
+            "/v2/shopping/flight-offers", operation="flight_offers",
+            headers={"Content-Type": "application/json"}, params=params
+        )
+        if response.status_code >= 400:
+            print(f"Response content: {response.text}")
+        response.raise_for_status()
+        return response
+
+    try:
+        response = await search_circuit.call_async(fetch_offers)
+    except Exception as e:
+        print(f"Error searching flights: {str(e)}")
+        raise
+    return response.json()
+
+# Búsquedas asíncronas en curso por clave (equivalente asíncrono de search_singleflight)
+_async_searches_in_flight = {}
+
+# Versión asíncrona de search_flights_cached (comparte la caché de resultados con el camino síncrono)
+async def async_search_flights_cached(origin, destination, departure_date, return_date=None, adults=1, children=0, infants=0, source_system="GDS", trip_type="roundtrip", airlines=None):
+    key = flight_search_key(origin, destination, departure_date, return_date, adults, children, infants, source_system, trip_type, airlines)
+    cache_warmer.record_search(origin, destination)
+    cached = search_cache.get(key)
+    if cached is not None:
+        results, age = cached
+        return results, {'hit': True, 'age_seconds': int(age)}
+
+    # Renovación en segundo plano (en el pool de hilos) cuando se sirve un resultado obsoleto
+    def fetch():
+        results = search_flights(origin, destination, departure_date, return_date, adults, children, infants, source_system, trip_type, airlines)
+        search_cache.set(key, results)
+        return results
+
+    if search_circuit.rejecting():
+        stale = stale_search_result(key, fetch)
+        if stale is not None:
+            return stale
+
+    task = _async_searches_in_flight.get(key)
+    coalesced = task is not None
+    if not coalesced:
+        task = asyncio.ensure_future(async_search_flights(origin, destination, departure_date, return_date, adults, children, infants, source_system, trip_type, airlines))
+        _async_searches_in_flight[key] = task
+    try:
+        # La espera se limita a lo que le queda a la solicitud entrante; la búsqueda sigue para los demás
+        results = await asyncio.wait_for(asyncio.shield(task), check_deadline())
+        if not coalesced:
+            search_cache.set(key, results)
+    except Exception as e:
+        stale = stale_search_result(key, fetch, error=e)
+        if stale is None:
+            # Los timeouts de asyncio y aiohttp no traen mensaje
+            if isinstance(e, asyncio.TimeoutError) and not str(e):
+                raise DeadlineExceeded("Se agotó el tiempo de espera de la búsqueda en Amadeus") from e
+            raise
+        return stale
+    finally:
+        if not coalesced:
+            _async_searches_in_flight.pop(key, None)
+    return results, {'hit': False, 'age_seconds': 0, 'coalesced': coalesced}
+
+# Envía una respuesta JSON desde el punto de entrada ASGI
+async def _asgi_json(send, status, payload):
+    body = json.dumps(payload).encode('utf-8')
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())]
+    })
+    await send({'type': 'http.response.body', 'body': body})
+
+# Ruta asíncrona equivalente a /api/search_flights
+async def async_api_search_flights(args, send):
+    search_params, error = parse_api_search_params(args)
+    if error:
+        return await _asgi_json(send, 400, {'success': False, 'message': error})
+    try:
+        flight_data, cache_info = await async_search_flights_cached(**search_params)
+        simplified_results = simplify_flight_offers(flight_data)
+        await _asgi_json(send, 200, {
+            'success': True,
+            'count': len(simplified_results),
+            'results': simplified_results,
+            'cache': cache_info
+        })
+    except Exception as e:
+        await _asgi_json(send, 500, {'success': False, 'message': str(e)})
+
+# Ruta asíncrona equivalente a /autocomplete_airport
+async def async_autocomplete_airport(args, send):
+    keyword = args.get('keyword', '')
+    if len(keyword) < 2:
+        return await _asgi_json(send, 200, {
+            'success': False,
+            'message': 'El término de búsqueda debe tener al menos 2 caracteres',
+            'data': []
+        })
+    airports = airport_index.search(keyword)
+    if not airports:
+        airports = await async_search_airports(keyword)
+        airport_index.add(airports)
+    await _asgi_json(send, 200, {'success': True, 'data': airports})
+
+# Ruta -> (función, endpoint equivalente de Flask cuyo tiempo máximo se aplica)
+ASYNC_ROUTES = {
+    '/async/api/search_flights': (async_api_search_flights, 'api_search_flights'),
+    '/async/autocomplete_airport': (async_autocomplete_airport, 'autocomplete_airport'),
+}
+
+# Punto de entrada ASGI (ej. `uvicorn app:asgi_app`): las rutas de ASYNC_ROUTES se atienden de forma
+# nativa con asyncio y el resto de la aplicación Flask se sirve a través de WsgiToAsgi
+_flask_asgi = WsgiToAsgi(app) if WsgiToAsgi is not None else None
+
+async def asgi_app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                booking_workers.autostart_once()
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                booking_workers.stop()
+                if async_amadeus_client is not None:
+                    await async_amadeus_client.close()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
+
+    route = ASYNC_ROUTES.get(scope.get('path')) if scope['type'] == 'http' else None
+    if route is not None and scope['method'] == 'GET':
+        handler, endpoint = route
+        budget = REQUEST_BUDGETS.get(endpoint)
+        amadeus_deadline.set(time.monotonic() + budget if budget else None)
+        args = {name: values[-1] for name, values in parse_qs(scope.get('query_string', b'').decode('utf-8')).items()}
+        return await handler(args, send)
+    return await _flask_asgi(scope, receive, send)
+
+# Comando de diagnóstico: compara el camino síncrono y el asíncrono contra un servidor local simulado
+@app.cli.command('bench-search')
+@click.option('--requests', 'total_requests', default=400, help='Número total de búsquedas')
+@click.option('--concurrency', default=200, help='Búsquedas simultáneas en el camino asíncrono')
+@click.option('--sync-workers', default=16, help='Hilos del camino síncrono (equivalente a los hilos de los workers web)')
+@click.option('--latency', default=0.5, help='Latencia simulada de Amadeus en segundos')
+def bench_search(total_requests, concurrency, sync_workers, latency):
+    """Prueba de carga de búsquedas de vuelos contra un servidor local que simula Amadeus."""
+    if aiohttp is None:
+        raise click.ClickException('El camino asíncrono requiere aiohttp y asgiref (pip install -r requirements.txt)')
+
+    from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+    body = json.dumps({'meta': {'count': 0}, 'data': []}).encode('utf-8')
+    token_body = json.dumps({'access_token': 'bench', 'expires_in': 1799}).encode('utf-8')
+
+    class StubHandler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, *args):
+            pass
+
+        def _reply(self, payload):
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get('Content-Length', 0)))
+            self._reply(token_body)
+
+        def do_GET(self):
+            time.sleep(latency)
+            self._reply(body)
+
+    ThreadingHTTPServer.request_queue_size = 1024
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StubHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_address[1]}"
+    params = build_flight_search_params('MEX', 'CUN', '2030-01-15', '2030-01-22')
+
+    def report(name, elapsed, latencies):
+        latencies.sort()
+        click.echo(
+            f"{name:<10} {total_requests / elapsed:>8.1f} búsquedas/s   total {elapsed:>6.2f}s   "
+            f"p50 {latencies[len(latencies) // 2] * 1000:>7.0f}ms   p95 {latencies[int(len(latencies) * 0.95) - 1] * 1000:>7.0f}ms"
+        )
+
+    # Camino síncrono: cada búsqueda ocupa un hilo durante toda la llamada
+    sync_client = AmadeusClient(base_url, pool_size=sync_workers, read_timeouts={'default': 60})
+
+    def sync_search(_):
+        started = time.monotonic()
+        sync_client.get('/v2/shopping/flight-offers', operation='flight_offers', params=params).raise_for_status()
+        return time.monotonic() - started
+
+    started = time.monotonic()
+    with ThreadPoolExecutor(max_workers=sync_workers) as executor:
+        sync_latencies = list(executor.map(sync_search, range(total_requests)))
+    report('síncrono', time.monotonic() - started, sync_latencies)
+
+    # Camino asíncrono: un solo hilo con hasta `concurrency` búsquedas en curso
+    async_client = AsyncAmadeusClient(AmadeusClient(base_url, read_timeouts={'default': 60}), pool_size=concurrency)
+    async_params = {name: str(value) for name, value in params.items()}
+
+    async def run_async():
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def one():
+            async with semaphore:
+                started = time.monotonic()
+                response = await async_client.get('/v2/shopping/flight-offers', operation='flight_offers', params=async_params)
+                response.raise_for_status()
+                return time.monotonic() - started
+
+        try:
+            return await asyncio.gather(*(one() for _ in range(total_requests)))
+        finally:
+            await async_client.close()
+
+    started = time.monotonic()
+    async_latencies = list(asyncio.run(run_async()))
+    report('asíncrono', time.monotonic() - started, async_latencies)
+    server.shutdown()
+
 if __name__ == '__main__':
     app.run(debug=True, port=5005, host='0.0.0.0')
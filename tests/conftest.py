@@ -0,0 +1,193 @@
+"""Fixtures comunes de las pruebas.
+
+app.py lee su configuración al importarse, así que antes de importarlo se arranca un servidor local
+que simula Amadeus (StubAmadeus) y se apunta la aplicación a él y a una base de datos SQLite temporal.
+"""
+import json
+import os
+import sys
+import tempfile
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+import pytest
+
+
+class StubAmadeus:
+    """Servidor HTTP que responde como Amadeus a las rutas que usa la aplicación. Cuenta las
+    solicitudes por ruta y permite forzar las siguientes respuestas de cada una (`fail_next`)
+    o rechazar tokens concretos con 401 (`rejected_tokens`)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _reply(self, status, payload):
+                body = json.dumps(payload).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                self._reply(*stub.handle('POST', urlparse(self.path).path, {}, self.headers, body))
+
+            def do_GET(self):
+                url = urlparse(self.path)
+                query = {name: values[-1] for name, values in parse_qs(url.query).items()}
+                self._reply(*stub.handle('GET', url.path, query, self.headers, b''))
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.server.daemon_threads = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base_url = f"http://127.0.0.1:{self.server.server_address[1]}"
+
+    def reset(self):
+        with self._lock:
+            self.calls = {}
+            self.tokens_issued = 0
+            self.rejected_tokens = set()
+            self.failures = {}
+
+    def fail_next(self, path, status, payload=None, times=1):
+        """Las próximas `times` solicitudes a `path` responden con `status`"""
+        with self._lock:
+            self.failures.setdefault(path, []).extend([(status, payload or {'errors': [{'code': status}]})] * times)
+
+    def handle(self, method, path, query, headers, body):
+        with self._lock:
+            self.calls[path] = self.calls.get(path, 0) + 1
+            if path == '/v1/security/oauth2/token':
+                self.tokens_issued += 1
+                return 200, {'access_token': f'token-{self.tokens_issued}', 'expires_in': 1799}
+            token = headers.get('Authorization', '').removeprefix('Bearer ')
+            if token in self.rejected_tokens:
+                return 401, {'errors': [{'code': 38190, 'title': 'Invalid access token'}]}
+            if self.failures.get(path):
+                return self.failures[path].pop(0)
+            if path == '/v2/shopping/flight-offers':
+                return 200, flight_offers_response(query)
+            if path == '/v1/shopping/flight-offers/pricing':
+                return 200, {'data': {'type': 'flight-offers-pricing', 'flightOffers': json.loads(body)['data']['flightOffers']}}
+            if path == '/v1/booking/flight-orders':
+                number = self.calls[path]
+                return 201, {'data': {'id': f'ORDER{number}', 'associatedRecords': [{'reference': f'AMA{number:03d}'}]}}
+            return 404, {}
+
+
+def flight_offer(index, origin, destination, departure_date, carrier, price):
+    return {
+        'type': 'flight-offer',
+        'id': str(index),
+        'source': 'GDS',
+        'itineraries': [{
+            'duration': 'PT3H',
+            'segments': [{
+                'departure': {'iataCode': origin, 'at': f'{departure_date}T{8 + index:02d}:00:00'},
+                'arrival': {'iataCode': destination, 'at': f'{departure_date}T{11 + index:02d}:00:00'},
+                'carrierCode': carrier,
+                'number': str(100 + index),
+                'operating': {'carrierCode': carrier},
+                'duration': 'PT3H',
+                'id': str(index),
+                'numberOfStops': 0
+            }]
+        }],
+        'price': {'currency': 'EUR', 'total': f'{price:.2f}', 'base': f'{price * 0.8:.2f}', 'grandTotal': f'{price:.2f}'},
+        'validatingAirlineCodes': [carrier],
+        'travelerPricings': [{'travelerId': '1', 'travelerType': 'ADULT', 'price': {'currency': 'EUR', 'total': f'{price:.2f}'}}]
+    }
+
+
+def flight_offers_response(query):
+    carriers = query.get('includedAirlineCodes', 'AM').split(',')
+    offers = [
+        flight_offer(index, query['originLocationCode'], query['destinationLocationCode'], query['departureDate'],
+                     carriers[index % len(carriers)], 100 + index * 10)
+        for index in range(1, 4)
+    ]
+    return {
+        'meta': {'count': len(offers)},
+        'data': offers,
+        'dictionaries': {'carriers': {code: f'{code} AIRLINES' for code in carriers}}
+    }
+
+
+STUB = StubAmadeus()
+_database_dir = tempfile.mkdtemp(prefix='amadeus-tests-')
+os.environ.update({
+    'DATABASE_URL': f"sqlite:///{os.path.join(_database_dir, 'bookings.db')}",
+    'AMADEUS_BASE_URL': STUB.base_url,
+    'AMADEUS_API_KEY': 'test-key',
+    'AMADEUS_API_SECRET': 'test-secret',
+    'AMADEUS_RETRY_BACKOFF': '0.01',
+    'AMADEUS_TEST_MODE': 'false',
+    'BOOKING_WORKERS_ENABLED': 'false',
+    'BOOKING_ASYNC_ENABLED': 'false',
+    'CACHE_WARM_ENABLED': 'false',
+    'REPRICE_BEFORE_BOOKING': 'false',
+    'EXPORT_API_TOKEN': 'backoffice-token',
+})
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as app_module  # noqa: E402
+
+
+@pytest.fixture(autouse=True)
+def clean_state():
+    """Base de datos vacía, cachés y token descartados y stub sin fallos pendientes en cada prueba"""
+    STUB.reset()
+    with app_module.app.app_context():
+        app_module.db.drop_all()
+        app_module.db.create_all()
+        app_module.ensure_indexes(app_module.db.engine)
+    app_module.token_manager.invalidate()
+    app_module.search_cache.clear()
+    app_module.booking_cache.clear()
+    app_module.pricing_cache.clear()
+    yield
+
+
+@pytest.fixture
+def stub():
+    return STUB
+
+
+@pytest.fixture
+def app():
+    return app_module
+
+
+@pytest.fixture
+def client():
+    return app_module.app.test_client()
+
+
+@pytest.fixture
+def booking_form(client):
+    """Formulario de /create_booking para la primera oferta de una búsqueda MEX-CUN"""
+    response = client.post('/search_flights', data={
+        'origin': 'MEX', 'destination': 'CUN', 'departure_date': '2030-01-15', 'tripType': 'oneway'
+    })
+    assert response.status_code == 200
+    results = response.get_json()
+    return {
+        'searchId': results['search_id'],
+        'flightId': results['data'][0]['id'],
+        'fareType': 'Estándar',
+        'contactEmail': 'ana@example.com',
+        'contactPhone': '+34 600000000',
+        'adults': '1',
+        'adultFirstName1': 'Ana',
+        'adultLastName1': 'López'
+    }
@@ -0,0 +1,45 @@
+"""Token OAuth compartido y renovación ante 401 (AmadeusClient / AmadeusTokenManager)"""
+from concurrent.futures import ThreadPoolExecutor
+
+TOKEN_PATH = '/v1/security/oauth2/token'
+SEARCH_PATH = '/v2/shopping/flight-offers'
+SEARCH_PARAMS = {'originLocationCode': 'MEX', 'destinationLocationCode': 'CUN', 'departureDate': '2030-01-15', 'adults': 1}
+
+
+def test_token_is_reused_between_requests(app, stub):
+    for _ in range(3):
+        response = app.amadeus_client.get(SEARCH_PATH, operation='flight_offers', params=SEARCH_PARAMS)
+        assert response.status_code == 200
+
+    assert stub.tokens_issued == 1
+    assert stub.calls[SEARCH_PATH] == 3
+
+
+def test_concurrent_requests_fetch_a_single_token(app, stub):
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        tokens = list(pool.map(lambda _: app.token_manager.get_token(), range(16)))
+
+    assert set(tokens) == {'token-1'}
+    assert stub.tokens_issued == 1
+
+
+def test_rejected_token_is_renewed_and_request_retried_once(app, stub):
+    first_token = app.token_manager.get_token()
+    stub.rejected_tokens.add(first_token)
+
+    response = app.amadeus_client.get(SEARCH_PATH, operation='flight_offers', params=SEARCH_PARAMS)
+
+    assert response.status_code == 200
+    assert stub.tokens_issued == 2
+    assert stub.calls[SEARCH_PATH] == 2
+    assert app.token_manager.get_token() == 'token-2'
+
+
+def test_persistent_401_is_not_retried_forever(app, stub):
+    stub.rejected_tokens.update({'token-1', 'token-2', 'token-3'})
+
+    response = app.amadeus_client.get(SEARCH_PATH, operation='flight_offers', params=SEARCH_PARAMS)
+
+    assert response.status_code == 401
+    assert stub.tokens_issued == 2
+    assert stub.calls[SEARCH_PATH] == 2
@@ -0,0 +1,108 @@
+"""Cola de reservas asíncronas: reintentos y transiciones a CONFIRMED, FAILED y NEEDS_REVIEW"""
+from datetime import datetime, timedelta
+
+import pytest
+
+ORDERS_PATH = '/v1/booking/flight-orders'
+
+
+@pytest.fixture
+def pool(app):
+    """Pool sin hilos ni espera entre reintentos: las pruebas procesan las tareas con run_once()"""
+    return app.BookingWorkerPool(workers=1, max_attempts=3, retry_backoff=0, job_timeout=10)
+
+
+@pytest.fixture
+def queued_booking(client, booking_form):
+    response = client.post('/create_booking', data=booking_form, headers={'Prefer': 'respond-async'})
+    assert response.status_code == 202
+    return response.get_json()['pnr']
+
+
+def job_state(app, pnr):
+    with app.app.app_context():
+        booking = app.Booking.query.filter_by(pnr=pnr).one()
+        job = booking.jobs[0]
+        return booking.status, job.status, job.attempts
+
+
+def test_queued_booking_is_confirmed(app, pool, stub, queued_booking):
+    assert job_state(app, queued_booking) == ('PENDING', 'QUEUED', 0)
+
+    assert pool.run_once('test-worker') is True
+
+    assert job_state(app, queued_booking) == ('CONFIRMED', 'DONE', 1)
+    assert stub.calls[ORDERS_PATH] == 1
+    assert pool.run_once('test-worker') is False
+
+
+def test_rate_limited_order_is_retried_until_confirmed(app, pool, stub, queued_booking):
+    stub.fail_next(ORDERS_PATH, 429)
+
+    pool.run_once('test-worker')
+    assert job_state(app, queued_booking) == ('PENDING', 'QUEUED', 1)
+
+    pool.run_once('test-worker')
+    assert job_state(app, queued_booking) == ('CONFIRMED', 'DONE', 2)
+    assert pool.retried == 1
+
+
+def test_retries_stop_after_max_attempts(app, pool, stub, queued_booking):
+    stub.fail_next(ORDERS_PATH, 429, times=3)
+
+    for _ in range(3):
+        pool.run_once('test-worker')
+
+    assert job_state(app, queued_booking) == ('FAILED', 'FAILED', 3)
+    assert stub.calls[ORDERS_PATH] == 3
+    assert pool.run_once('test-worker') is False
+
+
+def test_validation_error_fails_without_retrying(app, pool, stub, queued_booking):
+    stub.fail_next(ORDERS_PATH, 400, {'errors': [{'code': 477, 'title': 'INVALID FORMAT'}]})
+
+    pool.run_once('test-worker')
+
+    assert job_state(app, queued_booking) == ('FAILED', 'FAILED', 1)
+    assert stub.calls[ORDERS_PATH] == 1
+
+
+def test_server_error_needs_review_instead_of_resending(app, pool, stub, queued_booking):
+    stub.fail_next(ORDERS_PATH, 500)
+
+    pool.run_once('test-worker')
+
+    assert job_state(app, queued_booking) == ('NEEDS_REVIEW', 'NEEDS_REVIEW', 1)
+    assert pool.run_once('test-worker') is False
+    assert stub.calls[ORDERS_PATH] == 1
+
+
+def test_expired_lease_needs_review(app, pool, stub, queued_booking):
+    with app.app.app_context():
+        job = app.Booking.query.filter_by(pnr=queued_booking).one().jobs[0]
+        job.status = 'RUNNING'
+        job.attempts = 1
+        job.locked_by = 'worker-que-se-cayó'
+        job.locked_at = datetime.utcnow() - timedelta(seconds=pool.lease_seconds + 1)
+        app.db.session.commit()
+
+    assert pool.run_once('test-worker') is False
+
+    assert job_state(app, queued_booking) == ('NEEDS_REVIEW', 'NEEDS_REVIEW', 1)
+    assert ORDERS_PATH not in stub.calls
+
+
+@pytest.mark.parametrize('result, expected', [
+    ({'success': False, 'status_code': 429}, 'retry'),
+    ({'success': False, 'status_code': 422}, 'failed'),
+    ({'success': False, 'status_code': 502}, 'review'),
+    ({'success': False, 'request_sent': False}, 'retry'),
+    ({'success': False, 'request_sent': True}, 'review'),
+])
+def test_classify_failure(pool, result, expected):
+    assert pool.classify_failure(result) == expected
+
+
+def test_response_deadline_is_not_treated_as_unsent(app):
+    assert app.is_unsent_request_error(app.DeadlineExceeded()) is True
+    assert app.is_unsent_request_error(app.ResponseDeadlineExceeded()) is False
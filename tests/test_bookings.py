@@ -0,0 +1,132 @@
+"""Creación de reservas: Idempotency-Key, colisiones de PNR y paginación por cursor de /api/bookings"""
+import uuid
+from datetime import datetime, timedelta
+
+import pytest
+
+ORDERS_PATH = '/v1/booking/flight-orders'
+BACKOFFICE_HEADERS = {'Authorization': 'Bearer backoffice-token'}
+
+
+def make_booking(app, pnr, created_at, flight_id='MEX-CUN-AM101'):
+    booking = app.Booking(
+        id=str(uuid.uuid4()), pnr=pnr, flight_id=flight_id, fare_type='Estándar', fare_price=110.0,
+        currency='EUR', total_price=110.0, contact_email='ana@example.com', contact_phone='+34 600000000',
+        adults=1, children=0, infants=0, passenger_data='{}', status='CONFIRMED', created_at=created_at
+    )
+    with app.app.app_context():
+        app.save_booking(booking, regenerate_pnr=False)
+        return booking.id
+
+
+def test_repeated_idempotency_key_replays_the_first_response(client, stub, booking_form):
+    headers = {'Idempotency-Key': 'booking-attempt-1'}
+
+    first = client.post('/create_booking', data=booking_form, headers=headers)
+    second = client.post('/create_booking', data=booking_form, headers=headers)
+
+    assert first.status_code == 200
+    assert second.status_code == 200
+    assert second.headers.get('Idempotent-Replayed') == 'true'
+    assert second.get_json() == first.get_json()
+    assert stub.calls[ORDERS_PATH] == 1
+
+
+def test_idempotency_key_reused_with_different_data_is_rejected(client, stub, booking_form):
+    headers = {'Idempotency-Key': 'booking-attempt-2'}
+
+    first = client.post('/create_booking', data=booking_form, headers=headers)
+    conflict = client.post('/create_booking', data=dict(booking_form, adultFirstName1='Eva'), headers=headers)
+
+    assert first.status_code == 200
+    assert conflict.status_code == 422
+    assert conflict.get_json()['success'] is False
+    assert stub.calls[ORDERS_PATH] == 1
+
+
+def test_server_errors_release_the_idempotency_key(app, client, stub, booking_form, monkeypatch):
+    headers = {'Idempotency-Key': 'booking-attempt-3'}
+
+    def broken_booking(*args, **kwargs):
+        raise RuntimeError('base de datos no disponible')
+
+    monkeypatch.setattr(app, 'create_amadeus_booking', broken_booking)
+    assert client.post('/create_booking', data=booking_form, headers=headers).status_code == 500
+    monkeypatch.undo()
+
+    retried = client.post('/create_booking', data=booking_form, headers=headers)
+    assert retried.status_code == 200
+    assert retried.headers.get('Idempotent-Replayed') is None
+
+
+def test_pnr_collision_is_retried_with_a_new_pnr(app, monkeypatch):
+    make_booking(app, 'TAKEN1', datetime.utcnow())
+    generated = iter(['FRESH1'])
+    monkeypatch.setattr(app, 'generate_pnr', lambda: next(generated))
+
+    booking = app.Booking(
+        id=str(uuid.uuid4()), pnr='TAKEN1', flight_id='MEX-CUN-AM101', fare_type='Estándar', fare_price=110.0,
+        currency='EUR', total_price=110.0, contact_email='eva@example.com', contact_phone='+34 600000001',
+        adults=1, children=0, infants=0, passenger_data='{}', status='CONFIRMED'
+    )
+    with app.app.app_context():
+        app.save_booking(booking)
+        assert booking.pnr == 'FRESH1'
+        assert app.Booking.query.count() == 2
+
+
+def test_pnr_from_amadeus_is_never_replaced(app):
+    make_booking(app, 'AMA001', datetime.utcnow())
+
+    booking = app.Booking(
+        id=str(uuid.uuid4()), pnr='AMA001', flight_id='MEX-CUN-AM101', fare_type='Estándar', fare_price=110.0,
+        currency='EUR', total_price=110.0, contact_email='eva@example.com', contact_phone='+34 600000001',
+        adults=1, children=0, infants=0, passenger_data='{}', status='CONFIRMED'
+    )
+    with app.app.app_context():
+        with pytest.raises(app.IntegrityError):
+            app.save_booking(booking, regenerate_pnr=False)
+
+
+def test_keyset_pagination_returns_every_booking_once_newest_first(app, client):
+    base = datetime(2030, 1, 1, 12, 0, 0)
+    # Dos reservas con la misma fecha: el id desempata el orden
+    created = [base, base, base + timedelta(minutes=1), base + timedelta(minutes=2), base + timedelta(minutes=3)]
+    ids = {make_booking(app, f'PNR{index:03d}', created_at): created_at for index, created_at in enumerate(created)}
+
+    seen = []
+    cursor = None
+    while True:
+        params = {'limit': 2}
+        if cursor:
+            params['cursor'] = cursor
+        page = client.get('/api/bookings', query_string=params, headers=BACKOFFICE_HEADERS).get_json()
+        assert page['success'] is True
+        assert page['count'] <= 2
+        seen.extend(booking['booking_id'] for booking in page['bookings'])
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+
+    assert sorted(seen) == sorted(ids)
+    assert seen == sorted(ids, key=lambda booking_id: (ids[booking_id], booking_id), reverse=True)
+
+
+def test_keyset_pagination_filters_by_route(app, client):
+    now = datetime.utcnow()
+    make_booking(app, 'ROUTE1', now, flight_id='MEX-CUN-AM101')
+    make_booking(app, 'ROUTE2', now, flight_id='GDL-TIJ-Y4100')
+
+    page = client.get('/api/bookings', query_string={'origin': 'gdl'}, headers=BACKOFFICE_HEADERS).get_json()
+
+    assert [booking['pnr'] for booking in page['bookings']] == ['ROUTE2']
+    assert page['next_cursor'] is None
+
+
+def test_invalid_cursor_is_rejected(client):
+    response = client.get('/api/bookings', query_string={'cursor': 'no-es-un-cursor'}, headers=BACKOFFICE_HEADERS)
+    assert response.status_code == 400
+
+
+def test_bookings_listing_requires_the_backoffice_token(client):
+    assert client.get('/api/bookings').status_code == 401
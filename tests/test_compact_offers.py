@@ -0,0 +1,64 @@
+"""Formato compacto de resultados: expand_compact_offers() reconstruye lo que muestra la interfaz"""
+
+
+def ui_fields(offer):
+    """Campos de la oferta que lee templates/index.html"""
+    return {
+        'id': offer['id'],
+        'price': {'total': offer['price']['total'], 'currency': offer['price']['currency']},
+        'itineraries': [
+            {
+                'duration': itinerary.get('duration', ''),
+                'segments': [
+                    dict(
+                        {
+                            'departure': {'iataCode': segment['departure']['iataCode'], 'at': segment['departure']['at']},
+                            'arrival': {'iataCode': segment['arrival']['iataCode'], 'at': segment['arrival']['at']},
+                            'carrierCode': segment['carrierCode'],
+                            'number': segment['number'],
+                            'duration': segment.get('duration', '')
+                        },
+                        **({'operating': segment['operating']} if 'operating' in segment else {})
+                    )
+                    for segment in itinerary['segments']
+                ]
+            }
+            for itinerary in offer['itineraries']
+        ]
+    }
+
+
+def test_expanded_offers_match_display_offers(app, client):
+    results = client.post('/search_flights', data={
+        'origin': 'MEX', 'destination': 'CUN', 'departure_date': '2030-01-15', 'tripType': 'oneway'
+    }).get_json()
+    session = app.search_sessions.get(results['search_id'])
+    offers = app.display_offers(session)
+    # Aerolínea operadora con nombre (la interfaz lo muestra en lugar del código)
+    offers[0] = dict(offers[0], itineraries=[dict(offers[0]['itineraries'][0], segments=[
+        dict(offers[0]['itineraries'][0]['segments'][0], operating={'carrierCode': 'IB', 'carrierName': 'IBERIA'})
+    ])])
+
+    compact = app.compact_flight_offers(offers, results['dictionaries']['carriers'])
+    expanded = app.expand_compact_offers(compact)
+
+    assert expanded == [ui_fields(offer) for offer in offers]
+    assert expanded[0]['itineraries'][0]['segments'][0]['operating'] == {'carrierCode': 'IB', 'carrierName': 'IBERIA'}
+
+
+def test_compact_format_shares_repeated_segments(app):
+    offer = {
+        'id': '1',
+        'price': {'total': '100.00', 'currency': 'EUR'},
+        'itineraries': [{'duration': 'PT3H', 'segments': [{
+            'departure': {'iataCode': 'MEX', 'at': '2030-01-15T08:00:00'},
+            'arrival': {'iataCode': 'CUN', 'at': '2030-01-15T11:00:00'},
+            'carrierCode': 'AM', 'number': '500', 'duration': 'PT3H'
+        }]}]
+    }
+
+    compact = app.compact_flight_offers([offer, dict(offer, id='2')])
+
+    assert len(compact['segments']) == 1
+    assert [row[0] for row in compact['offers']] == ['1', '2']
+    assert app.expand_compact_offers(compact)[1]['itineraries'] == app.expand_compact_offers(compact)[0]['itineraries']